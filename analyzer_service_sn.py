@@ -1,144 +1,192 @@
 import os
-import re
+import sys
+import csv
+import glob
+import json
+import time
+import argparse
+import hashlib
+import heapq
+import threading
 import numpy as np
 import cv2
-from dataclasses import dataclass
-from typing import Optional, List
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass, field, asdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import get_context
+from typing import Optional, List, Dict, Tuple, Iterable
 from paddleocr import PaddleOCR
 
-# Импортируем разрешённые префиксы (если config.py доступен)
-try:
-    from config import ALLOWED_SERIAL_PREFIXES
-except ImportError:
-    ALLOWED_SERIAL_PREFIXES = ["PC", "CE"]  # Дефолтное значение
+from serial_text import (
+    normalize_line,
+    compact,
+    fix_digits_mistakes,
+    is_valid_serial,
+    compute_bios_password_string,
+    extract_serial,
+    find_all_serials_in_text,
+    find_serial_candidates,
+)
+from serial_lexicon import SerialLexicon
 
-DIGIT_SUBS = str.maketrans({
-    'O':'0', 'o':'0', 'I':'1', 'l':'1', 'L':'1', 'i':'1', 'B':'8', 'S':'5', 'Z':'2',
-})
+# Видео: сколько самых резких кадров оставлять, сколько кадров в секунду оценивать,
+# с какой уверенностью OCR прекращать перебор
+VIDEO_TOP_FRAMES = int(os.getenv("VIDEO_TOP_FRAMES", "8"))
+VIDEO_SAMPLE_FPS = float(os.getenv("VIDEO_SAMPLE_FPS", "5"))
+VIDEO_MIN_CONFIDENCE = float(os.getenv("VIDEO_MIN_CONFIDENCE", "0.9"))
 
-def normalize_line(s: str) -> str:
-    if s is None:
-        return ""
-    s = s.replace('\\', '/')
-    s = s.replace('\u2013', '-')
-    s = re.sub(r'[^A-Za-z0-9\s/:.\-]', ' ', s)
-    return s.upper().strip()
+# ROI-подсказка: сколько живёт запомненная рамка S/N, после скольких промахов подряд
+# забывается и насколько расширяется при кадрировании (доля от длины рамки)
+ROI_PRIOR_TTL_SEC = float(os.getenv("ROI_PRIOR_TTL_SEC", "600"))
+ROI_PRIOR_MAX_MISSES = int(os.getenv("ROI_PRIOR_MAX_MISSES", "2"))
+ROI_MARGIN = float(os.getenv("ROI_MARGIN", "0.25"))
 
-def compact(s: str) -> str:
-    return re.sub(r'[\s.:/\\\-]', '', s)
-
-def fix_digits_mistakes(s: str) -> str:
-    return s.translate(DIGIT_SUBS)
-
-def is_valid_serial(sn: str) -> bool:
-    """
-    Проверяет валидность серийного номера:
-    - Формат: 5 букв + 9 цифр
-    - Префикс: ТОЛЬКО из списка ALLOWED_SERIAL_PREFIXES (по умолчанию: PC, CE)
-    """
-    if not re.fullmatch(r'[A-Z]{5}[0-9]{9}', sn):
-        return False
-    
-    prefix = sn[:2]
-    return prefix in ALLOWED_SERIAL_PREFIXES
-
-def compute_bios_password_string(serial: str) -> str:
-    if not is_valid_serial(serial):
-        raise ValueError("Сериал не валидный для вычисления пароля")
-    first_two = serial[:2]
-    digits = serial[5:]
-    number1 = int(digits[:3])
-    number2 = int(digits[-3:])
-    product = number1 * number2
-    return f"{first_two}{product}"
-
-def find_serial_near_sn_in_text(text: str) -> Optional[str]:
-    norm = normalize_line(text)
-    comp = compact(norm)
-
-    # ИСПРАВЛЕНО: экранирование спецсимволов
-    pat1 = re.compile(r'\bS[\s/\\\.\-]*N[\s:]*([A-Z0-9]{14})\b', re.IGNORECASE)
-    pat2 = re.compile(r'\bSN[\s:]*([A-Z0-9]{14})\b', re.IGNORECASE)
-    
-    for pat in (pat1, pat2):
-        for m in pat.finditer(norm):
-            candidate_raw = m.group(1)
-            letters_part = candidate_raw[:5]
-            digits_part_raw = candidate_raw[5:]
-            digits_fixed = fix_digits_mistakes(digits_part_raw)
-            candidate = (letters_part + digits_fixed).upper()
-            if is_valid_serial(candidate):
-                return candidate
-
-    m2 = re.search(r'(?:SN|S5N|5N)([A-Z0-9]{14})', comp, re.IGNORECASE)
-    if m2:
-        candidate_raw = m2.group(1)
-        letters_part = candidate_raw[:5]
-        digits_part_raw = candidate_raw[5:]
-        digits_fixed = fix_digits_mistakes(digits_part_raw)
-        candidate = (letters_part + digits_fixed).upper()
-        if is_valid_serial(candidate):
-            return candidate
-
-    for m in re.finditer(r'\bS[\s/\\\.\-]*N\b|\bSN\b|\bS5N\b|\b5N\b', norm, re.IGNORECASE):
-        start = m.end()
-        window = norm[start:start + 80]
-        joined = compact(window)
-        mo = re.search(r'([A-Z0-9]{14})', joined)
-        if mo:
-            candidate_raw = mo.group(1)
-            letters_part = candidate_raw[:5]
-            digits_part_raw = candidate_raw[5:]
-            digits_fixed = fix_digits_mistakes(digits_part_raw)
-            candidate = (letters_part + digits_fixed).upper()
-            if is_valid_serial(candidate):
-                return candidate
-
-    return None
-
-def find_any_serial_in_text(text: str) -> Optional[str]:
-    norm = normalize_line(text)
-    
-    m = re.search(r'([A-Z]{5}[0-9]{9})', norm)
-    if m:
-        return m.group(1).upper()
-
-    for m in re.finditer(r'([A-Z]{5}[A-Z0-9]{9})', norm):
-        letters = m.group(1)[:5]
-        digits_raw = m.group(1)[5:]
-        digits_fixed = fix_digits_mistakes(digits_raw)
-        candidate = (letters + digits_fixed).upper()
-        if is_valid_serial(candidate):
-            return candidate
-
-    comp = compact(norm)
-    mo = re.search(r'([A-Z]{5}[A-Z0-9]{9})', comp)
-    if mo:
-        letters = mo.group(1)[:5]
-        digits_raw = mo.group(1)[5:]
-        digits_fixed = fix_digits_mistakes(digits_raw)
-        candidate = (letters + digits_fixed).upper()
-        if is_valid_serial(candidate):
-            return candidate
-    
-    return None
-
-def preprocess(img: np.ndarray) -> np.ndarray:
-    """Предобработка изображения для улучшения OCR"""
+def upscale(img: np.ndarray) -> np.ndarray:
+    """Апскейл маленьких изображений"""
     h, w = img.shape[:2]
     max_side = max(h, w)
     
-    # Апскейл маленьких изображений
     if max_side < 1100:
         scale = min(1600 / max_side, 3.0)
         if scale > 1.05:
             img = cv2.resize(img, (int(w*scale), int(h*scale)), interpolation=cv2.INTER_CUBIC)
     
-    # Лёгкий шарпинг
+    return img
+
+def sharpen(img: np.ndarray) -> np.ndarray:
+    """Лёгкий шарпинг"""
     blur = cv2.GaussianBlur(img, (0, 0), 1.0)
-    img = cv2.addWeighted(img, 1.5, blur, -0.5, 0)
+    return cv2.addWeighted(img, 1.5, blur, -0.5, 0)
+
+def serial_boxes(boxes: List[Tuple[list, str, float]], serial: str) -> List[Tuple[list, str, float]]:
+    """Боксы OCR, из которых собран серийник: бокс содержит его целиком или является его фрагментом"""
+    matched = []
+    for item in boxes:
+        comp = compact(normalize_line(item[1]))
+        fixed = comp[:5] + fix_digits_mistakes(comp[5:])
+        if serial in comp or serial in fixed:
+            matched.append(item)
+            continue
+        # Фрагмент серийника (OCR разбил его на несколько боксов)
+        if len(comp) >= 4 and any(part in serial for part in (comp, fix_digits_mistakes(comp))):
+            matched.append(item)
+    return matched
+
+def serial_confidence(boxes: List[Tuple[list, str, float]], serial: str) -> Optional[float]:
+    """
+    Уверенность распознавания серийника: минимальный score среди боксов,
+    из которых он собран.
+    """
+    scores = [score for _, _, score in serial_boxes(boxes, serial)]
+    return round(min(scores), 4) if scores else None
+
+def bounding_box(boxes: List[Tuple[list, str, float]]) -> Optional[List[int]]:
+    """Описывающий прямоугольник [x0, y0, x1, y1] для набора боксов OCR"""
+    points = [pt for box, _, _ in boxes for pt in box]
+    if not points:
+        return None
+    xs = [pt[0] for pt in points]
+    ys = [pt[1] for pt in points]
+    return [int(min(xs)), int(min(ys)), int(max(xs)), int(max(ys))]
+
+def expand_box(frac_box: Tuple[float, float, float, float], width: int, height: int,
+               margin: float = ROI_MARGIN, min_side: int = 64) -> List[int]:
+    """
+    Рамка в долях кадра → прямоугольник кропа в пикселях [x0, y0, x1, y1]
+    с запасом margin * длина рамки со всех сторон (серийник — узкая строка,
+    поэтому запас считаем от длинной стороны).
+    """
+    x0, y0, x1, y1 = frac_box[0] * width, frac_box[1] * height, frac_box[2] * width, frac_box[3] * height
+    pad = margin * max(x1 - x0, y1 - y0, min_side)
+    return [
+        max(0, int(x0 - pad)), max(0, int(y0 - pad)),
+        min(width, int(x1 + pad)), min(height, int(y1 + pad)),
+    ]
+
+def preprocess(img: np.ndarray) -> np.ndarray:
+    """Предобработка изображения для улучшения OCR"""
+    return sharpen(upscale(img))
+
+def sharpness(img: np.ndarray, width: int = 640) -> float:
+    """Резкость кадра: дисперсия лапласиана на уменьшенном сером изображении"""
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if img.ndim == 3 else img
+    h, w = gray.shape[:2]
+    if w > width:
+        gray = cv2.resize(gray, (width, int(h * width / w)), interpolation=cv2.INTER_AREA)
+    return float(cv2.Laplacian(gray, cv2.CV_64F).var())
+
+def sample_sharp_frames(path: str, top_k: int = VIDEO_TOP_FRAMES,
+                        sample_fps: float = VIDEO_SAMPLE_FPS) -> Tuple[List[Tuple[float, int, np.ndarray]], int]:
+    """
+    Потоково читает видео и оставляет top_k самых резких кадров.
+    Оценивается sample_fps кадров в секунду, промежуточные только grab()-ятся
+    (без конвертации в BGR). В памяти одновременно не больше top_k кадров.
+    Возвращает ([(резкость, номер кадра, кадр), ...] от резкого к размытому, число оценённых кадров).
+    """
+    cap = cv2.VideoCapture(path)
+    heap: List[Tuple[float, int, np.ndarray]] = []
+    sampled = 0
+    try:
+        if not cap.isOpened():
+            return [], 0
+        fps = cap.get(cv2.CAP_PROP_FPS) or 0
+        step = max(1, int(round(fps / sample_fps))) if fps > 0 and sample_fps > 0 else 1
+        
+        index = -1
+        while cap.grab():
+            index += 1
+            if index % step:
+                continue
+            ok, frame = cap.retrieve()
+            if not ok or frame is None:
+                continue
+            sampled += 1
+            item = (sharpness(frame), index, frame)
+            if len(heap) < top_k:
+                heapq.heappush(heap, item)
+            elif item[0] > heap[0][0]:
+                heapq.heapreplace(heap, item)
+    finally:
+        cap.release()
     
-    return img
+    return sorted(heap, key=lambda item: (-item[0], item[1])), sampled
+
+@contextmanager
+def _timed(timings: Dict[str, float], stage: str):
+    """Записывает длительность этапа в миллисекундах в timings[stage]"""
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[stage] = round((time.perf_counter() - t0) * 1000, 2)
+
+@dataclass
+class AnalyzeDiagnostics:
+    """Диагностика одного анализа: время этапов (мс), размеры изображения, число боксов"""
+    timings_ms: Dict[str, float] = field(default_factory=dict)
+    input_size: Optional[Tuple[int, int]] = None      # (ширина, высота) после декодирования
+    processed_size: Optional[Tuple[int, int]] = None  # (ширина, высота) после предобработки
+    box_count: int = 0
+    extractor: Optional[str] = None                   # "near_sn" / "any_serial"
+    cache_hit: bool = False
+    frames_sampled: int = 0                           # видео: сколько кадров оценено по резкости
+    frames_ocr: int = 0                               # видео: на скольких кадрах запускался OCR
+    roi: Optional[str] = None                         # ROI-подсказка: "hit" / "miss" / None (не было)
+    roi_box: Optional[List[int]] = None               # кроп ROI [x0, y0, x1, y1] в пикселях исходного кадра
+    lexicon_corrected: bool = False                   # серийник исправлен по справочнику известных
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+@dataclass
+class SerialHit:
+    """Один серийник на изображении: рамка в пикселях исходного кадра и уверенность"""
+    serial: str
+    password: str
+    confidence: Optional[float] = None
+    box: Optional[List[int]] = None   # [x0, y0, x1, y1]
+    corrected_from: Optional[str] = None  # как прочитал OCR, если серийник исправлен по справочнику
 
 @dataclass
 class AnalyzeResult:
@@ -146,66 +194,566 @@ class AnalyzeResult:
     serial: Optional[str] = None
     password: Optional[str] = None
     debug_text: Optional[str] = None
+    confidence: Optional[float] = None
+    diagnostics: Optional[AnalyzeDiagnostics] = None
+    serials: List[SerialHit] = field(default_factory=list)  # все серийники на фото (стеллаж, ряд юнитов)
+    corrected_from: Optional[str] = None  # как прочитал OCR, если серийник исправлен по справочнику
+    frame_jpeg: Optional[bytes] = None    # видео: кадр, на котором найден S/N (JPEG)
+
+class RoiPriors:
+    """
+    Где был серийник на прошлом фото пользователя — по пользователю и модели
+    (первые 5 букв S/N). Техник обычно снимает партию одинаковых юнитов с одного
+    ракурса, и следующий кадр сначала распознаётся только в этой области.
+    Рамка хранится в долях кадра; забывается по TTL и после max_misses промахов подряд.
+    Запоминается и то, сколько S/N было на прошлом фото: кроп видит один юнит,
+    так что после фото с несколькими юнитами подсказка без явного single не применяется.
+    """
+    
+    def __init__(self, ttl: float = ROI_PRIOR_TTL_SEC, max_misses: int = ROI_PRIOR_MAX_MISSES):
+        self.ttl = ttl
+        self.max_misses = max_misses
+        self._priors: Dict[Tuple[int, str], dict] = {}
+        self._multi: Dict[int, bool] = {}       # пользователь → на прошлом фото было несколько S/N
+        self._lock = threading.Lock()
+        self.attempts = 0
+        self.hits = 0
+    
+    def latest(self, user_id: int) -> Optional[Tuple[str, Tuple[float, float, float, float]]]:
+        """Самая свежая живая подсказка пользователя: (модель, рамка) или None"""
+        now = time.monotonic()
+        with self._lock:
+            for key in [k for k, p in self._priors.items() if now - p["seen"] > self.ttl]:
+                del self._priors[key]
+            own = [(k[1], p) for k, p in self._priors.items() if k[0] == user_id]
+        if not own:
+            return None
+        prefix, prior = max(own, key=lambda item: item[1]["seen"])
+        return prefix, prior["box"]
+    
+    def remember(self, user_id: int, serial: str, frac_box: Tuple[float, float, float, float],
+                 count: int = 1):
+        with self._lock:
+            self._priors[(user_id, serial[:5])] = {"box": frac_box, "seen": time.monotonic(), "misses": 0}
+            self._multi[user_id] = count > 1
+    
+    def expects_single(self, user_id: int) -> bool:
+        """На прошлом фото пользователя был один S/N — кроп по подсказке ничего не потеряет"""
+        with self._lock:
+            return not self._multi.get(user_id, False)
+    
+    def record(self, user_id: int, prefix: str, hit: bool):
+        """Учитывает попытку: попадание обновляет время, промах копит счётчик до сброса подсказки"""
+        key = (user_id, prefix)
+        with self._lock:
+            self.attempts += 1
+            prior = self._priors.get(key)
+            if hit:
+                self.hits += 1
+                if prior:
+                    prior["seen"] = time.monotonic()
+                    prior["misses"] = 0
+            elif prior:
+                prior["misses"] += 1
+                if prior["misses"] >= self.max_misses:
+                    del self._priors[key]
+    
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "attempts": self.attempts,
+                "hits": self.hits,
+                "hit_rate": round(self.hits / self.attempts, 4) if self.attempts else None,
+                "active": len(self._priors),
+            }
 
 class AnalyzerSNService:
-    def __init__(self, use_gpu: bool = False):
+    def __init__(self, use_gpu: bool = False, cache_size: int = 32, cpu_threads: Optional[int] = None,
+                 roi_ttl: float = ROI_PRIOR_TTL_SEC, roi_max_misses: int = ROI_PRIOR_MAX_MISSES):
+        ocr_kwargs = {}
+        if cpu_threads:
+            ocr_kwargs["cpu_threads"] = cpu_threads
         self.ocr = PaddleOCR(
             use_angle_cls=True,
             lang='latin',
             show_log=False,
             det_limit_side_len=1920,
             rec_score_thresh=0.5,
+            **ocr_kwargs,
         )
+        self._ocr_api = self._detect_ocr_api()
+        # Кэш сырого вывода OCR по хэшу содержимого (повторная отправка того же файла).
+        # Справочник применяется после кэша — его пополнение видно и на повторах
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[str, Tuple[list, Tuple[int, int], Tuple[int, int]]]" = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self.roi_priors = RoiPriors(ttl=roi_ttl, max_misses=roi_max_misses)
+        # Справочник известных серийников (наполняет бот из Redmine); None — без исправлений
+        self.lexicon: Optional[SerialLexicon] = None
 
-    def analyze_bytes(self, image_bytes: bytes) -> AnalyzeResult:
-        """Анализирует изображение и ищет серийный номер"""
+    def _cache_get(self, key: str) -> Optional[Tuple[list, Tuple[int, int], Tuple[int, int]]]:
+        with self._cache_lock:
+            res = self._cache.get(key)
+            if res is not None:
+                self._cache.move_to_end(key)
+            return res
+
+    def _cache_put(self, key: str, res: Tuple[list, Tuple[int, int], Tuple[int, int]]):
+        if self.cache_size <= 0:
+            return
+        with self._cache_lock:
+            self._cache[key] = res
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def _detect_ocr_api(self) -> str:
+        """
+        Какой вызов PaddleOCR использовать — определяется один раз, на пустом кадре:
+        "timed" — TextSystem.__call__ отдаёт (boxes, rec_res, time_dict), "plain" — (boxes, rec_res)
+        старых версий, "ocr" — только штатный ocr() без разбивки по этапам.
+        """
         try:
-            arr = np.frombuffer(image_bytes, np.uint8)
-            img = cv2.imdecode(arr, cv2.IMREAD_COLOR)
-            
-            if img is None:
-                return AnalyzeResult(found=False, debug_text="Не удалось декодировать изображение")
+            raw = self.ocr(np.zeros((32, 32, 3), dtype=np.uint8), cls=True)
+        except Exception:
+            return "ocr"
+        if isinstance(raw, tuple) and len(raw) == 3 and isinstance(raw[2], dict):
+            return "timed"
+        if isinstance(raw, tuple) and len(raw) == 2:
+            return "plain"
+        return "ocr"
+
+    def _run_ocr(self, img: np.ndarray, timings: Dict[str, float]) -> list:
+        """
+        Запускает PaddleOCR (один раз на кадр) и возвращает страницы в формате ocr():
+        [[[box, (text, score)], ...], ...]
+        Время det/cls/rec берётся из time_dict TextSystem, если версия PaddleOCR его отдаёт.
+        """
+        if self._ocr_api == "ocr":
+            with _timed(timings, "ocr"):
+                return self.ocr.ocr(img, cls=True)
+        
+        with _timed(timings, "ocr"):
+            raw = self.ocr(img, cls=True)
+        dt_boxes, rec_res = raw[0], raw[1]
+        if self._ocr_api == "timed":
+            for stage in ("det", "cls", "rec"):
+                if stage in raw[2]:
+                    timings[stage] = round(raw[2][stage] * 1000, 2)
+        if dt_boxes is None or rec_res is None:
+            return [[]]
+        return [[[np.asarray(box).tolist(), res] for box, res in zip(dt_boxes, rec_res)]]
 
-            img = preprocess(img)
-            ocr_res = self.ocr.ocr(img, cls=True)
+    def _snap_to_lexicon(self, serials: List[str], confidences: Dict[str, Optional[float]], text: str,
+                         diag: AnalyzeDiagnostics) -> Dict[str, str]:
+        """
+        Сверка со справочником известных серийников: {серийник: как прочитал OCR}.
+        confidences — уверенность OCR по каждому серийнику (от неё зависит, править ли модель).
+        Если валидного серийника в тексте нет, ищется известный среди сырых кандидатов.
+        """
+        lexicon = self.lexicon
+        if lexicon is None or not len(lexicon):
+            return {sn: sn for sn in serials}
+        
+        read_as: Dict[str, str] = {}
+        for sn in serials:
+            read_as.setdefault(lexicon.correct(sn, confidences.get(sn)) or sn, sn)
+        
+        if not read_as:
+            for candidate in find_serial_candidates(text):
+                known = lexicon.correct(candidate)
+                if known:
+                    read_as[known] = candidate
+                    diag.extractor = "lexicon"
+                    break
+        
+        if any(sn != raw for sn, raw in read_as.items()):
+            diag.lexicon_corrected = True
+        return read_as
 
-            texts: List[str] = []
-            if isinstance(ocr_res, list):
-                for page in ocr_res:
-                    if not isinstance(page, list):
+    def _recognize(self, img: np.ndarray, diag: AnalyzeDiagnostics, cache_key: Optional[str] = None) -> AnalyzeResult:
+        """
+        Предобработка, OCR и поиск серийника на декодированном кадре.
+        С cache_key сырой вывод OCR кладётся в кэш (только для полного кадра, не для кропа).
+        """
+        timings = diag.timings_ms
+        diag.input_size = (img.shape[1], img.shape[0])
+        with _timed(timings, "upscale"):
+            img = upscale(img)
+        with _timed(timings, "sharpen"):
+            img = sharpen(img)
+        diag.processed_size = (img.shape[1], img.shape[0])
+        
+        ocr_res = self._run_ocr(img, timings)
+        if cache_key:
+            self._cache_put(cache_key, (ocr_res, diag.input_size, diag.processed_size))
+        return self._parse(ocr_res, diag)
+
+    def _parse(self, ocr_res: list, diag: AnalyzeDiagnostics) -> AnalyzeResult:
+        """Серийники из вывода OCR со сверкой по справочнику; рамки — в пикселях исходного кадра"""
+        timings = diag.timings_ms
+        texts: List[str] = []
+        boxes: List[Tuple[list, str, float]] = []
+        if isinstance(ocr_res, list):
+            for page in ocr_res:
+                if not isinstance(page, list):
+                    continue
+                words = []
+                for det in page:
+                    try:
+                        t = det[1][0]
+                        if t:
+                            words.append(str(t))
+                            boxes.append((det[0], str(t), float(det[1][1])))
+                    except (IndexError, TypeError, KeyError):
                         continue
-                    words = []
-                    for det in page:
-                        try:
-                            t = det[1][0]
-                            if t:
-                                words.append(str(t))
-                        except (IndexError, TypeError, KeyError):
-                            continue
-                    if words:
-                        texts.append(" ".join(words))
-
-            full_text = "\n".join(texts)
-            
-            # Поиск серийного номера
-            serial = find_serial_near_sn_in_text(full_text)
-            if not serial:
-                serial = find_any_serial_in_text(full_text)
+                diag.box_count += len(page)
+                if words:
+                    texts.append(" ".join(words))
 
+        full_text = "\n".join(texts)
+        
+        # Поиск серийного номера
+        with _timed(timings, "parse"):
+            serial, diag.extractor = extract_serial(full_text)
+            # Остальные серийники на том же фото (несколько единиц рядом); основной — первым
+            all_serials = find_all_serials_in_text(full_text) if serial else []
+            if serial in all_serials:
+                all_serials.remove(serial)
             if serial:
-                password = compute_bios_password_string(serial)
-                return AnalyzeResult(found=True, serial=serial, password=password)
-
-            # Не нашли
-            if texts:
-                dbg = "Не найден S/N. Распознанные строки:\n" + "\n".join(f"[{i+1:02d}] {t}" for i, t in enumerate(texts[:10]))
-            else:
-                dbg = "OCR не распознал текст на изображении."
+                all_serials.insert(0, serial)
+            confidences = {sn: min((b[2] for b in serial_boxes(boxes, sn)), default=None) for sn in all_serials}
+            # Серийник → как его прочитал OCR (различаются, если исправлен по справочнику)
+            read_as = self._snap_to_lexicon(all_serials, confidences, full_text, diag)
+            all_serials = list(read_as)
+
+        if all_serials:
+            # Рамки OCR — в координатах после апскейла, наружу отдаём в пикселях исходного кадра
+            kx = diag.input_size[0] / diag.processed_size[0]
+            ky = diag.input_size[1] / diag.processed_size[1]
+            hits = []
+            for sn in all_serials:
+                sn_boxes = serial_boxes(boxes, read_as[sn])
+                box = bounding_box(sn_boxes)
+                hits.append(SerialHit(
+                    serial=sn,
+                    password=compute_bios_password_string(sn),
+                    confidence=round(min(b[2] for b in sn_boxes), 4) if sn_boxes else None,
+                    box=[int(box[0] * kx), int(box[1] * ky), int(box[2] * kx), int(box[3] * ky)] if box else None,
+                    corrected_from=read_as[sn] if read_as[sn] != sn else None,
+                ))
+            return AnalyzeResult(
+                found=True,
+                serial=hits[0].serial,
+                password=hits[0].password,
+                confidence=hits[0].confidence,
+                serials=hits,
+                corrected_from=hits[0].corrected_from,
+            )
+
+        # Не нашли
+        if texts:
+            dbg = "Не найден S/N. Распознанные строки:\n" + "\n".join(f"[{i+1:02d}] {t}" for i, t in enumerate(texts[:10]))
+        else:
+            dbg = "OCR не распознал текст на изображении."
+        
+        return AnalyzeResult(found=False, debug_text=dbg)
+
+    def _recognize_with_prior(self, img: np.ndarray, diag: AnalyzeDiagnostics, user_id: int,
+                              single: bool = False, cache_key: Optional[str] = None) -> AnalyzeResult:
+        """
+        Сначала кроп по ROI-подсказке пользователя, при промахе — весь кадр.
+        Пробуем одну (самую свежую) подсказку: промах стоит лишний прогон OCR по кропу.
+        Кроп видит только один юнит: без single (нужны все S/N на фото) подсказка
+        применяется, только если на прошлом фото пользователя S/N был один, —
+        после фото с несколькими юнитами сразу весь кадр. Подсказка обновляется всегда.
+        """
+        h, w = img.shape[:2]
+        use_prior = single or self.roi_priors.expects_single(user_id)
+        prior = self.roi_priors.latest(user_id) if use_prior else None
+        if prior:
+            prefix, frac_box = prior
+            x0, y0, x1, y1 = expand_box(frac_box, w, h)
+            crop_diag = AnalyzeDiagnostics()
+            with _timed(diag.timings_ms, "roi"):
+                res = self._recognize(img[y0:y1, x0:x1], crop_diag)
+            hit = res.found and res.serial.startswith(prefix)
+            self.roi_priors.record(user_id, prefix, hit)
+            diag.roi = "hit" if hit else "miss"
+            diag.roi_box = [x0, y0, x1, y1]
+            if hit:
+                diag.timings_ms.update(crop_diag.timings_ms)
+                diag.input_size = (w, h)
+                diag.processed_size = crop_diag.processed_size
+                diag.box_count = crop_diag.box_count
+                diag.extractor = crop_diag.extractor
+                # Рамки из координат кропа → координаты кадра
+                for sh in res.serials:
+                    if sh.box:
+                        sh.box = [sh.box[0] + x0, sh.box[1] + y0, sh.box[2] + x0, sh.box[3] + y0]
+                self._remember_roi(user_id, res, w, h)
+                return res
+        
+        res = self._recognize(img, diag, cache_key)
+        self._remember_roi(user_id, res, w, h)
+        return res
+
+    def _remember_roi(self, user_id: int, res: AnalyzeResult, w: int, h: int):
+        """Подсказка на следующее фото: рамка основного S/N в долях кадра"""
+        if res.found and res.serials[0].box:
+            box = res.serials[0].box
+            self.roi_priors.remember(user_id, res.serial, (box[0] / w, box[1] / h, box[2] / w, box[3] / h),
+                                     count=len(res.serials))
+
+    def analyze_bytes(self, image_bytes: bytes, user_id: Optional[int] = None, single: bool = False) -> AnalyzeResult:
+        """
+        Анализирует изображение и ищет серийный номер.
+        С user_id сначала пробуется область, где S/N был на прошлом фото пользователя:
+        всегда при single=True (нужен один S/N), иначе — если на прошлом фото S/N был один.
+        """
+        diag = AnalyzeDiagnostics()
+        timings = diag.timings_ms
+        t_start = time.perf_counter()
+        
+        def finish(res: AnalyzeResult) -> AnalyzeResult:
+            timings["total"] = round((time.perf_counter() - t_start) * 1000, 2)
+            res.diagnostics = diag
+            return res
+        
+        try:
+            key = hashlib.sha1(image_bytes).hexdigest()
+            cached = self._cache_get(key)
+            if cached is not None:
+                # OCR уже был — заново только разбор и справочник
+                ocr_res, diag.input_size, diag.processed_size = cached
+                diag.cache_hit = True
+                return finish(self._parse(ocr_res, diag))
+            
+            with _timed(timings, "decode"):
+                arr = np.frombuffer(image_bytes, np.uint8)
+                img = cv2.imdecode(arr, cv2.IMREAD_COLOR)
+            
+            if img is None:
+                return finish(AnalyzeResult(found=False, debug_text="Не удалось декодировать изображение"))
+
+            if user_id is not None:
+                return finish(self._recognize_with_prior(img, diag, user_id, single=single, cache_key=key))
+            return finish(self._recognize(img, diag, key))
+            
+        except Exception as e:
+            return finish(AnalyzeResult(found=False, debug_text=f"Ошибка при анализе: {str(e)}"))
+
+    def analyze_video(self, path: str, top_k: int = VIDEO_TOP_FRAMES, sample_fps: float = VIDEO_SAMPLE_FPS,
+                      min_confidence: float = VIDEO_MIN_CONFIDENCE) -> AnalyzeResult:
+        """
+        Ищет серийник на видео / анимации: кадры отбираются по резкости,
+        OCR идёт от самого резкого кадра и останавливается на первом валидном S/N
+        с уверенностью не ниже min_confidence. Иначе — лучший из найденных.
+        Кадр с найденным S/N возвращается в frame_jpeg.
+        """
+        diag = AnalyzeDiagnostics()
+        timings = diag.timings_ms
+        t_start = time.perf_counter()
+        
+        def finish(res: AnalyzeResult, frame_diag: Optional[AnalyzeDiagnostics] = None,
+                   frame: Optional[np.ndarray] = None) -> AnalyzeResult:
+            if frame is not None:
+                ok, buf = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, 92])
+                if ok:
+                    res.frame_jpeg = buf.tobytes()
+            if frame_diag:
+                diag.input_size = frame_diag.input_size
+                diag.processed_size = frame_diag.processed_size
+                diag.box_count = frame_diag.box_count
+                diag.extractor = frame_diag.extractor
+            timings["total"] = round((time.perf_counter() - t_start) * 1000, 2)
+            res.diagnostics = diag
+            return res
+        
+        try:
+            with _timed(timings, "sample"):
+                frames, diag.frames_sampled = sample_sharp_frames(path, top_k, sample_fps)
+            
+            if not frames:
+                return finish(AnalyzeResult(found=False, debug_text="Не удалось декодировать видео"))
             
-            return AnalyzeResult(found=False, debug_text=dbg)
+            best: Optional[Tuple[AnalyzeResult, AnalyzeDiagnostics, np.ndarray]] = None
+            for score, index, frame in frames:
+                frame_diag = AnalyzeDiagnostics()
+                res = self._recognize(frame, frame_diag)
+                diag.frames_ocr += 1
+                for stage, ms in frame_diag.timings_ms.items():
+                    timings[stage] = round(timings.get(stage, 0.0) + ms, 2)
+                
+                if not res.found:
+                    continue
+                if is_valid_serial(res.serial) and (res.confidence or 0) >= min_confidence:
+                    return finish(res, frame_diag, frame)
+                if best is None or (res.confidence or 0) > (best[0].confidence or 0):
+                    best = (res, frame_diag, frame)
             
+            if best:
+                return finish(*best)
+            return finish(AnalyzeResult(
+                found=False,
+                debug_text=f"S/N не найден ни на одном из {len(frames)} самых резких кадров"
+            ))
+        
         except Exception as e:
-            return AnalyzeResult(found=False, debug_text=f"Ошибка при анализе: {str(e)}")
+            return finish(AnalyzeResult(found=False, debug_text=f"Ошибка при анализе видео: {str(e)}"))
+
+def create_service() -> AnalyzerSNService:
+    """Создаёт сервис с настройками из переменных окружения"""
+    cpu_threads = os.getenv("OCR_CPU_THREADS")
+    return AnalyzerSNService(
+        use_gpu=bool(int(os.getenv("OCR_USE_GPU", "0"))),
+        cache_size=int(os.getenv("OCR_CACHE_SIZE", "32")),
+        cpu_threads=int(cpu_threads) if cpu_threads else None,
+        roi_ttl=ROI_PRIOR_TTL_SEC,
+        roi_max_misses=ROI_PRIOR_MAX_MISSES,
+    )
+
+# ===================== ПАКЕТНАЯ ОБРАБОТКА (CLI) =====================
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff", ".webp")
+RESULT_FIELDS = ["path", "found", "serial", "password", "confidence", "timings_ms", "error"]
+
+def collect_images(inputs: Iterable[str], recursive: bool = False) -> List[str]:
+    """Раскрывает каталоги и glob-шаблоны в отсортированный список изображений"""
+    paths = []
+    for item in inputs:
+        if os.path.isdir(item):
+            pattern = os.path.join(item, "**", "*") if recursive else os.path.join(item, "*")
+            candidates = glob.glob(pattern, recursive=recursive)
+        else:
+            candidates = glob.glob(item, recursive=recursive) or [item]
+        for path in candidates:
+            if os.path.isfile(path) and path.lower().endswith(IMAGE_EXTENSIONS):
+                paths.append(os.path.abspath(path))
+    return sorted(set(paths))
+
+def analyze_file(path: str) -> dict:
+    """Анализирует один файл (выполняется в процессе-воркере)"""
+    try:
+        with open(path, "rb") as f:
+            res = service.analyze_bytes(f.read())
+    except OSError as e:
+        return {"path": path, "found": False, "error": str(e)}
+    
+    return {
+        "path": path,
+        "found": res.found,
+        "serial": res.serial,
+        "password": res.password,
+        "confidence": res.confidence,
+        "timings_ms": res.diagnostics.timings_ms if res.diagnostics else None,
+        "error": None if res.found else res.debug_text,
+    }
+
+def load_checkpoint(path: Optional[str]) -> set:
+    """Возвращает множество уже обработанных файлов"""
+    if not path or not os.path.exists(path):
+        return set()
+    with open(path, "r", encoding="utf-8") as f:
+        return {line.rstrip("\n") for line in f if line.strip()}
+
+class ResultWriter:
+    """Потоковая запись результатов в JSONL или CSV (в файл или stdout)"""
+    
+    def __init__(self, output: str, fmt: str):
+        self.fmt = fmt
+        if output == "-":
+            self.file = sys.stdout
+            write_header = True
+        else:
+            write_header = not os.path.exists(output) or os.path.getsize(output) == 0
+            self.file = open(output, "a", encoding="utf-8", newline="")
+        self.csv = None
+        if fmt == "csv":
+            self.csv = csv.DictWriter(self.file, fieldnames=RESULT_FIELDS, extrasaction="ignore")
+            if write_header:
+                self.csv.writeheader()
+    
+    def write(self, row: dict):
+        if self.csv:
+            self.csv.writerow({**row, "timings_ms": json.dumps(row.get("timings_ms"))})
+        else:
+            self.file.write(json.dumps(row, ensure_ascii=False) + "\n")
+        self.file.flush()
+    
+    def close(self):
+        if self.file is not sys.stdout:
+            self.file.close()
+
+def run_batch(paths: List[str], writer: ResultWriter, workers: int, checkpoint: Optional[str] = None) -> dict:
+    """Обрабатывает файлы в пуле процессов, пишет результаты по мере готовности"""
+    done = load_checkpoint(checkpoint)
+    pending = [p for p in paths if p not in done]
+    stats = {"total": len(paths), "skipped": len(paths) - len(pending), "found": 0, "failed": 0}
+    if not pending:
+        return stats
+    
+    # Каждый воркер грузит свою модель; ограничиваем потоки Paddle, чтобы не было переподписки ядер
+    os.environ.setdefault("OCR_CPU_THREADS", "1")
+    ckpt = open(checkpoint, "a", encoding="utf-8") if checkpoint else None
+    try:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=get_context("spawn")) as pool:
+            futures = {pool.submit(analyze_file, p): p for p in pending}
+            for idx, fut in enumerate(as_completed(futures), 1):
+                path = futures[fut]
+                try:
+                    row = fut.result()
+                except Exception as e:
+                    row = {"path": path, "found": False, "error": f"Ошибка воркера: {e}"}
+                
+                writer.write(row)
+                if ckpt:
+                    ckpt.write(path + "\n")
+                    ckpt.flush()
+                
+                stats["found" if row.get("found") else "failed"] += 1
+                print(f"[{idx}/{len(pending)}] {os.path.basename(path)}: {row.get('serial') or '-'}", file=sys.stderr)
+    finally:
+        if ckpt:
+            ckpt.close()
+    return stats
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="analyzer_service_sn",
+        description="Пакетное распознавание S/N и паролей BIOS по фото этикеток",
+    )
+    parser.add_argument("inputs", nargs="+", help="каталоги, файлы или glob-шаблоны")
+    parser.add_argument("-o", "--output", default="-", help="файл результатов (по умолчанию stdout)")
+    parser.add_argument("-f", "--format", choices=("jsonl", "csv"), help="формат (по умолчанию по расширению output)")
+    parser.add_argument("-j", "--workers", type=int, default=os.cpu_count() or 1, help="число процессов")
+    parser.add_argument("-r", "--recursive", action="store_true", help="обходить подкаталоги")
+    parser.add_argument("--checkpoint", help="файл прогресса для продолжения после прерывания "
+                                             "(по умолчанию <output>.ckpt)")
+    args = parser.parse_args(argv)
+    
+    fmt = args.format or ("csv" if args.output.lower().endswith(".csv") else "jsonl")
+    checkpoint = args.checkpoint or (f"{args.output}.ckpt" if args.output != "-" else None)
+    
+    paths = collect_images(args.inputs, recursive=args.recursive)
+    if not paths:
+        print("Изображения не найдены", file=sys.stderr)
+        return 1
+    
+    writer = ResultWriter(args.output, fmt)
+    try:
+        stats = run_batch(paths, writer, max(1, args.workers), checkpoint)
+    except KeyboardInterrupt:
+        print("Прервано, прогресс сохранён в checkpoint", file=sys.stderr)
+        return 130
+    finally:
+        writer.close()
+    
+    print(f"Готово: {stats}", file=sys.stderr)
+    return 0
 
-# Создаём синглтон сервиса
-service = AnalyzerSNService(use_gpu=bool(int(os.getenv("OCR_USE_GPU", "0"))))
\ No newline at end of file
+if __name__ == "__main__":
+    sys.exit(main())
+else:
+    # Создаём синглтон сервиса (в CLI — отдельно в каждом процессе-воркере)
+    service = create_service()
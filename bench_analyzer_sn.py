@@ -0,0 +1,195 @@
+"""
+Бенчмарк точности и производительности AnalyzerSNService.
+
+Корпус задаётся манифестом (CSV с колонками path,serial или JSONL с теми же ключами).
+Пути — относительно каталога манифеста. Пустой serial — негативный пример
+(на фото нет валидного S/N).
+
+    python bench_analyzer_sn.py corpus.csv -c 1,2,4 -o run.json --baseline baseline.json
+"""
+import os
+import sys
+import csv
+import json
+import time
+import argparse
+import resource
+import platform
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from typing import Optional, List, Dict
+
+def load_manifest(path: str) -> List[dict]:
+    """Читает манифест корпуса: [{"path": abs_path, "serial": "PC..." или None}, ...]"""
+    base = os.path.dirname(os.path.abspath(path))
+    rows = []
+    with open(path, "r", encoding="utf-8") as f:
+        if path.lower().endswith(".jsonl"):
+            raw = [json.loads(line) for line in f if line.strip()]
+        else:
+            raw = list(csv.DictReader(f))
+
+    for item in raw:
+        img_path = (item.get("path") or "").strip()
+        if not img_path:
+            continue
+        serial = (item.get("serial") or "").strip().upper() or None
+        rows.append({"path": os.path.join(base, img_path), "serial": serial})
+    return rows
+
+def _bench_one(path: str) -> dict:
+    """Выполняется в воркере: импорт здесь, чтобы родительский процесс не грузил модель"""
+    from analyzer_service_sn import analyze_file
+    return analyze_file(path)
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * pct / 100
+    lo = int(k)
+    hi = min(lo + 1, len(ordered) - 1)
+    return round(ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo), 2)
+
+def score(corpus: List[dict], results: Dict[str, dict]) -> dict:
+    """
+    Точность по корпусу:
+    - exact_match_accuracy — доля позитивных примеров, где S/N распознан в точности;
+    - false_positive_rate — доля всех примеров, где выдан неверный S/N
+      (любой S/N на негативном примере или чужой на позитивном).
+    """
+    positives = [c for c in corpus if c["serial"]]
+    correct = 0
+    false_positives = 0
+    misses = []
+    for item in corpus:
+        res = results.get(item["path"], {})
+        predicted = res.get("serial") if res.get("found") else None
+        if predicted and predicted == item["serial"]:
+            correct += 1
+        elif predicted:
+            false_positives += 1
+            misses.append({"path": item["path"], "expected": item["serial"], "got": predicted})
+        elif item["serial"]:
+            misses.append({"path": item["path"], "expected": item["serial"], "got": None})
+
+    return {
+        "images": len(corpus),
+        "positives": len(positives),
+        "exact_match_accuracy": round(correct / len(positives), 4) if positives else None,
+        "false_positive_rate": round(false_positives / len(corpus), 4) if corpus else None,
+        "misses": misses,
+    }
+
+def run_level(paths: List[str], workers: int) -> dict:
+    """Прогон корпуса на пуле из workers процессов; модель прогревается до старта таймера"""
+    with ProcessPoolExecutor(max_workers=workers, mp_context=get_context("spawn")) as pool:
+        # Прогрев: загрузка модели в каждом воркере не должна попадать в замер
+        list(pool.map(_bench_one, paths[:1] * workers * 2))
+
+        t0 = time.perf_counter()
+        results = list(pool.map(_bench_one, paths))
+        elapsed = time.perf_counter() - t0
+
+    latencies = [r["timings_ms"]["total"] for r in results if r.get("timings_ms")]
+    return {
+        "workers": workers,
+        "elapsed_s": round(elapsed, 3),
+        "images_per_sec": round(len(paths) / elapsed, 3) if elapsed else None,
+        "latency_ms": {
+            "p50": percentile(latencies, 50),
+            "p95": percentile(latencies, 95),
+            "p99": percentile(latencies, 99),
+        },
+        "results": {r["path"]: r for r in results},
+    }
+
+def compare(current: dict, baseline: dict, tolerance: float) -> List[str]:
+    """Возвращает список регрессий относительно baseline"""
+    regressions = []
+    cur_acc = current["accuracy"]["exact_match_accuracy"]
+    base_acc = baseline["accuracy"]["exact_match_accuracy"]
+    if cur_acc is not None and base_acc is not None and cur_acc < base_acc:
+        regressions.append(f"точность {base_acc} → {cur_acc}")
+
+    cur_fp = current["accuracy"]["false_positive_rate"]
+    base_fp = baseline["accuracy"]["false_positive_rate"]
+    if cur_fp is not None and base_fp is not None and cur_fp > base_fp:
+        regressions.append(f"false positive rate {base_fp} → {cur_fp}")
+
+    base_levels = {lvl["workers"]: lvl for lvl in baseline.get("levels", [])}
+    for lvl in current["levels"]:
+        base = base_levels.get(lvl["workers"])
+        if not base:
+            continue
+        for pct in ("p50", "p95", "p99"):
+            cur_v, base_v = lvl["latency_ms"][pct], base["latency_ms"][pct]
+            if cur_v and base_v and cur_v > base_v * (1 + tolerance):
+                regressions.append(f"{pct} при {lvl['workers']} воркерах: {base_v} → {cur_v} мс")
+        cur_t, base_t = lvl["images_per_sec"], base["images_per_sec"]
+        if cur_t and base_t and cur_t < base_t * (1 - tolerance):
+            regressions.append(f"пропускная способность при {lvl['workers']} воркерах: {base_t} → {cur_t} изобр/с")
+
+    return regressions
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Бенчмарк точности и скорости распознавания S/N")
+    parser.add_argument("manifest", help="CSV/JSONL манифест корпуса (path,serial)")
+    parser.add_argument("-c", "--concurrency", default="1,2,4", help="уровни параллелизма через запятую")
+    parser.add_argument("-o", "--output", help="куда сохранить результаты (JSON)")
+    parser.add_argument("--baseline", help="JSON предыдущего прогона для сравнения")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="допустимое ухудшение latency/throughput")
+    args = parser.parse_args(argv)
+
+    corpus = load_manifest(args.manifest)
+    if not corpus:
+        print("Манифест пуст", file=sys.stderr)
+        return 1
+    paths = [c["path"] for c in corpus]
+    levels = [int(x) for x in args.concurrency.split(",") if x.strip()]
+
+    # Кэш результатов исказил бы замеры на повторяющихся файлах; потоки Paddle — по одному на воркер
+    os.environ["OCR_CACHE_SIZE"] = "0"
+    os.environ.setdefault("OCR_CPU_THREADS", "1")
+
+    level_reports = []
+    for workers in levels:
+        print(f"Прогон: {len(paths)} изображений, воркеров: {workers}...", file=sys.stderr)
+        level_reports.append(run_level(paths, workers))
+
+    # Точность считаем по первому уровню (результат распознавания от параллелизма не зависит)
+    accuracy = score(corpus, level_reports[0]["results"])
+    for lvl in level_reports:
+        lvl.pop("results")
+
+    report = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "host": platform.node(),
+        "manifest": os.path.abspath(args.manifest),
+        "accuracy": accuracy,
+        "levels": level_reports,
+        # ru_maxrss на Linux — в килобайтах; RUSAGE_CHILDREN — максимум среди завершённых воркеров
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1),
+    }
+
+    summary = {k: v for k, v in accuracy.items() if k != "misses"}
+    print(json.dumps({"accuracy": summary, "levels": level_reports, "peak_rss_mb": report["peak_rss_mb"]},
+                     ensure_ascii=False, indent=2))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.tolerance)
+        if regressions:
+            print("❌ Регрессии относительно baseline:\n" + "\n".join(f"  - {r}" for r in regressions), file=sys.stderr)
+            return 2
+        print("✅ Регрессий относительно baseline нет", file=sys.stderr)
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,255 @@
+"""
+Генератор синтетического «шумного» текста OCR и бенчмарк парсеров серийника
+(normalize_line, compact, find_serial_near_sn_in_text, find_any_serial_in_text).
+
+Шум имитирует реальные ошибки распознавания этикеток: путаница O/0, I/1, B/8, S/5,
+разбиение токенов, лишние разделители, варианты метки S/N, многострочные дампы
+с мусором и ложными кандидатами. Генератор детерминирован по seed, поэтому
+результаты двух версий парсера сравнимы на одном и том же корпусе.
+
+    python bench_serial_parsers.py -n 5000 --seed 42 -o parsers.json --baseline parsers_base.json
+"""
+import sys
+import json
+import time
+import random
+import string
+import argparse
+from typing import Optional, List, Dict, Callable
+
+from serial_text import (
+    ALLOWED_SERIAL_PREFIXES,
+    normalize_line,
+    compact,
+    find_serial_near_sn_in_text,
+    find_any_serial_in_text,
+    extract_serial,
+)
+
+# Обратные замены к DIGIT_SUBS: цифра → как её путает OCR
+DIGIT_CONFUSIONS = {"0": "OoD", "1": "Il|i", "8": "B", "5": "S", "2": "Z"}
+# Путаница в буквенной части (парсер её не исправляет — проверяем, что не выдаёт мусор)
+LETTER_CONFUSIONS = {"O": "0", "I": "1", "B": "8", "S": "5", "Z": "2"}
+
+SN_LABELS = ["S/N", "S/N:", "SN", "SN:", "S/N :", "S N", "S\\N", "S.N.", "S-N", "5N", "S5N", "5/N", "s/n"]
+SEPARATORS = [" ", "  ", "-", ".", ":", "/", " - ", "–"]
+JUNK_LINES = [
+    "MADE IN CHINA", "Model: WS-PRO 7400", "P/N: 90MB0XYZ-M0EAY0", "AC 220-240V 50/60Hz 5A",
+    "Rev 1.02", "CE FC ROHS", "www.example.ru", "Date: 2024/03", "QC PASS", "MAC 00:1A:2B:3C:4D:5E",
+    "EAN 4607012345678", "BIOS v2.17.1254", "Intel Xeon Silver 4310",
+]
+
+class NoisyOcrGenerator:
+    """Генерирует пары (текст OCR, ожидаемый серийник или None)"""
+
+    def __init__(self, seed: int = 42, negative_rate: float = 0.1, letter_noise_rate: float = 0.05):
+        self.rng = random.Random(seed)
+        self.negative_rate = negative_rate
+        self.letter_noise_rate = letter_noise_rate
+
+    def serial(self) -> str:
+        prefix = self.rng.choice(ALLOWED_SERIAL_PREFIXES)
+        letters = "".join(self.rng.choice(string.ascii_uppercase) for _ in range(5 - len(prefix)))
+        digits = "".join(self.rng.choice(string.digits) for _ in range(9))
+        return prefix + letters + digits
+
+    def decoy(self) -> str:
+        """14-символьный токен, похожий на серийник, но с чужим префиксом"""
+        while True:
+            letters = "".join(self.rng.choice(string.ascii_uppercase) for _ in range(5))
+            if letters[:2] not in ALLOWED_SERIAL_PREFIXES:
+                return letters + "".join(self.rng.choice(string.digits) for _ in range(9))
+
+    def confuse_digits(self, serial: str, rate: float) -> str:
+        out = list(serial)
+        for i in range(5, len(out)):
+            if out[i] in DIGIT_CONFUSIONS and self.rng.random() < rate:
+                out[i] = self.rng.choice(DIGIT_CONFUSIONS[out[i]])
+        return "".join(out)
+
+    def confuse_letters(self, serial: str) -> str:
+        out = list(serial)
+        candidates = [i for i in range(5) if out[i] in LETTER_CONFUSIONS]
+        if candidates:
+            i = self.rng.choice(candidates)
+            out[i] = LETTER_CONFUSIONS[out[i]]
+        return "".join(out)
+
+    def split(self, token: str) -> str:
+        """Разбивает токен 1–2 разделителями (OCR разнёс серийник на несколько боксов)"""
+        cuts = sorted(self.rng.sample(range(1, len(token)), self.rng.randint(1, 2)))
+        parts, prev = [], 0
+        for cut in cuts:
+            parts.append(token[prev:cut])
+            prev = cut
+        parts.append(token[prev:])
+        return "".join(p + self.rng.choice(SEPARATORS) for p in parts[:-1]) + parts[-1]
+
+    def junk(self, count: int) -> List[str]:
+        lines = []
+        for _ in range(count):
+            if self.rng.random() < 0.2:
+                lines.append(f"P/N {self.decoy()}")
+            else:
+                lines.append(self.rng.choice(JUNK_LINES))
+        return lines
+
+    def sample(self) -> dict:
+        """Один пример: {"text", "expected", "noise": [виды шума]}"""
+        noise = []
+        lines = self.junk(self.rng.randint(0, 6))
+
+        if self.rng.random() < self.negative_rate:
+            noise.append("negative")
+            self.rng.shuffle(lines)
+            return {"text": "\n".join(lines) or "NO TEXT", "expected": None, "noise": noise}
+
+        expected = self.serial()
+        token = expected
+        if self.rng.random() < 0.5:
+            token = self.confuse_digits(token, rate=0.25)
+            if token != expected:
+                noise.append("digit_confusion")
+        if self.rng.random() < self.letter_noise_rate:
+            noisy = self.confuse_letters(token)
+            if noisy != token:
+                token = noisy
+                noise.append("letter_confusion")
+        if self.rng.random() < 0.3:
+            token = self.split(token)
+            noise.append("split")
+        if self.rng.random() < 0.2:
+            token = token.lower()
+            noise.append("lowercase")
+
+        if self.rng.random() < 0.8:
+            label = self.rng.choice(SN_LABELS)
+            if label not in ("S/N", "SN", "S/N:", "SN:"):
+                noise.append("label_variant")
+            sep = self.rng.choice(["", " ", ": ", " : ", "\n"])
+            if sep == "\n":
+                noise.append("label_newline")
+            serial_line = f"{label}{sep}{token}"
+        else:
+            noise.append("no_label")
+            serial_line = token
+
+        if self.rng.random() < 0.2:
+            serial_line = self.rng.choice(["|", "*", "[", "#", "~"]) + serial_line + self.rng.choice([".", ")", "|", ""])
+            noise.append("stray_chars")
+
+        lines.insert(self.rng.randint(0, len(lines)), serial_line)
+        if len(lines) > 1:
+            noise.append("multiline")
+        return {"text": "\n".join(lines), "expected": expected, "noise": noise or ["clean"]}
+
+    def corpus(self, n: int) -> List[dict]:
+        return [self.sample() for _ in range(n)]
+
+def time_per_kb(func: Callable[[str], object], texts: List[str], repeat: int) -> float:
+    """Среднее время функции в микросекундах на килобайт текста"""
+    total_bytes = sum(len(t.encode("utf-8")) for t in texts)
+    best = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        for text in texts:
+            func(text)
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    return round(best * 1e6 / (total_bytes / 1024), 2)
+
+def evaluate(corpus: List[dict]) -> dict:
+    """Точность extract_serial по корпусу, в целом и по видам шума"""
+    correct = false_positives = misses = 0
+    by_noise: Dict[str, Dict[str, int]] = {}
+    for item in corpus:
+        got, _ = extract_serial(item["text"])
+        ok = got == item["expected"]
+        if ok:
+            correct += 1
+        elif got:
+            false_positives += 1
+        else:
+            misses += 1
+        for kind in item["noise"]:
+            bucket = by_noise.setdefault(kind, {"total": 0, "correct": 0})
+            bucket["total"] += 1
+            bucket["correct"] += int(ok)
+
+    return {
+        "samples": len(corpus),
+        "accuracy": round(correct / len(corpus), 4),
+        "false_positives": false_positives,
+        "misses": misses,
+        "by_noise": {
+            kind: round(b["correct"] / b["total"], 4) for kind, b in sorted(by_noise.items())
+        },
+    }
+
+def compare(current: dict, baseline: dict, tolerance: float) -> List[str]:
+    """Регрессии: точность ниже baseline или время на КБ выросло больше допуска"""
+    regressions = []
+    if current["accuracy"]["accuracy"] < baseline["accuracy"]["accuracy"]:
+        regressions.append(f"точность {baseline['accuracy']['accuracy']} → {current['accuracy']['accuracy']}")
+    if current["accuracy"]["false_positives"] > baseline["accuracy"]["false_positives"]:
+        regressions.append(
+            f"ложные срабатывания {baseline['accuracy']['false_positives']} → {current['accuracy']['false_positives']}"
+        )
+    for name, us in current["us_per_kb"].items():
+        base = baseline.get("us_per_kb", {}).get(name)
+        if base and us > base * (1 + tolerance):
+            regressions.append(f"{name}: {base} → {us} мкс/КБ")
+    return regressions
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Бенчмарк парсеров серийного номера на синтетическом шуме OCR")
+    parser.add_argument("-n", "--samples", type=int, default=5000, help="размер корпуса")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--repeat", type=int, default=5, help="повторов замера (берётся лучший)")
+    parser.add_argument("--dump", help="сохранить сгенерированный корпус в JSONL")
+    parser.add_argument("-o", "--output", help="куда сохранить результаты (JSON)")
+    parser.add_argument("--baseline", help="JSON предыдущего прогона для сравнения")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="допустимое замедление")
+    args = parser.parse_args(argv)
+
+    corpus = NoisyOcrGenerator(seed=args.seed).corpus(args.samples)
+    texts = [item["text"] for item in corpus]
+
+    if args.dump:
+        with open(args.dump, "w", encoding="utf-8") as f:
+            for item in corpus:
+                f.write(json.dumps(item, ensure_ascii=False) + "\n")
+
+    report = {
+        "seed": args.seed,
+        "corpus_kb": round(sum(len(t.encode("utf-8")) for t in texts) / 1024, 1),
+        "accuracy": evaluate(corpus),
+        "us_per_kb": {
+            "normalize_line": time_per_kb(normalize_line, texts, args.repeat),
+            "compact": time_per_kb(compact, texts, args.repeat),
+            "find_serial_near_sn_in_text": time_per_kb(find_serial_near_sn_in_text, texts, args.repeat),
+            "find_any_serial_in_text": time_per_kb(find_any_serial_in_text, texts, args.repeat),
+            "extract_serial": time_per_kb(extract_serial, texts, args.repeat),
+        },
+    }
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline.get("seed") != args.seed:
+            print("⚠️ seed отличается от baseline — корпуса несравнимы", file=sys.stderr)
+        regressions = compare(report, baseline, args.tolerance)
+        if regressions:
+            print("❌ Регрессии относительно baseline:\n" + "\n".join(f"  - {r}" for r in regressions), file=sys.stderr)
+            return 2
+        print("✅ Регрессий относительно baseline нет", file=sys.stderr)
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,20 +1,21 @@
 import logging
 import sys
 import re
-import aiohttp
 import asyncio
+import hashlib
 import mimetypes
-import xml.etree.ElementTree as ET
 import json
+import os
+import tempfile
+import time
 
 from pathlib import Path
-from typing import Optional, Callable, Dict, Any, Awaitable
+from typing import Optional, Callable, Dict, Any, Awaitable, List, Tuple
 from aiogram import Bot, Dispatcher, types, BaseMiddleware
 from aiogram.filters import Command
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery, TelegramObject
 from aiogram.fsm.state import StatesGroup, State
 from aiogram.fsm.context import FSMContext
-from urllib.parse import quote
 from config import (
     TELEGRAM_TOKEN, 
     REDMINE_URL, 
@@ -41,9 +42,44 @@ from config import (
     CHECKLIST_SUBTASK_MOVE_TO_PROD,
     CHECKLIST_SUBTASK_FIX_PREFIX,
     CHECKLIST_SUBTASK_CHECK,
-    CHECKLIST_SUBTASK_MOVE_TO_TEST
+    CHECKLIST_SUBTASK_MOVE_TO_TEST,
+    OCR_STATS_LOG_EVERY,
+    CONSENSUS_WINDOW_SEC,
+    CONSENSUS_QUORUM,
+    CONSENSUS_MAX_FRAMES,
+    CONSENSUS_SINGLE_FRAME_CONFIDENCE,
+    VIDEO_MAX_SIZE_MB,
+    REDMINE_POOL_LIMIT,
+    REDMINE_KEEPALIVE_SEC,
+    REDMINE_DNS_TTL_SEC,
+    REDMINE_TIMEOUT_SEC,
+    REDMINE_UPLOAD_TIMEOUT_SEC,
+    REDMINE_UPLOAD_CHUNK_KB,
+    REDMINE_RETRIES,
+    REDMINE_VERIFY_SSL,
+    REDMINE_FANOUT_LIMIT,
+    CHECKLIST_WRITE_LIMIT,
+    CHECKLIST_PROGRESS_EDIT_SEC,
+    CHECKLIST_CACHE_TTL_SEC,
+    LOCAL_DB_PATH,
+    SERIAL_INDEX_SYNC_SEC,
+    LEXICON_SNAP_CONFIDENCE,
+    REDMINE_MIRROR_SYNC_SEC,
+    REDMINE_MIRROR_BACKFILL_DAYS,
+    REDMINE_MIRROR_PRUNE_SEC,
+    TG_FILE_CACHE_MB,
+    TG_FILE_CACHE_TTL_SEC,
+    TG_FILE_PATH_TTL_SEC,
+    TG_DOWNLOAD_TIMEOUT_SEC
 )
-from analyzer_service_sn import service as sn_service, AnalyzeResult
+from analyzer_service_sn import service as sn_service, AnalyzeResult, compute_bios_password_string
+from serial_text import vote_serial
+from serial_lexicon import SerialLexicon
+from serial_index import SerialIndex
+from redmine_mirror import RedmineMirror
+from telegram_file_cache import TelegramFileCache
+from redmine_client import RedmineClient, RedmineError, IssueTree, gather_limited
+from checklist_model import Checklist, ChecklistItem, ChecklistTemplate, plan_positions
 
 # Загрузка справочника несоответствий
 DEFECTS = []
@@ -171,6 +207,263 @@ dp.callback_query.middleware(AuthMiddleware(ALLOWED_USERS))
 OCR_SEMAPHORE = asyncio.Semaphore(1)
 last_uploaded = {}
 
+# Одна сессия с пулом соединений на все запросы к Redmine (и скачивание файлов Telegram)
+redmine = RedmineClient(
+    REDMINE_URL,
+    limit_per_host=REDMINE_POOL_LIMIT,
+    keepalive_timeout=REDMINE_KEEPALIVE_SEC,
+    dns_ttl=REDMINE_DNS_TTL_SEC,
+    timeout=REDMINE_TIMEOUT_SEC,
+    upload_timeout=REDMINE_UPLOAD_TIMEOUT_SEC,
+    retries=REDMINE_RETRIES,
+    checklist_ttl=CHECKLIST_CACHE_TTL_SEC,
+    verify_ssl=REDMINE_VERIFY_SSL,
+)
+
+# Известные серийники из Redmine: OCR исправляет по ним ошибки в модели (PCPPF → PCPPP)
+serial_lexicon = SerialLexicon(snap_confidence=LEXICON_SNAP_CONFIDENCE)
+sn_service.lexicon = serial_lexicon
+
+def learn_serials(*values: str):
+    """Пополняет справочник серийников (значение поля может содержать несколько S/N через пробел)"""
+    added = serial_lexicon.add_many(sn for value in values for sn in (value or "").split())
+    if added:
+        logging.info(f"[LEXICON] +{added} S/N, всего {len(serial_lexicon)}")
+
+# Серийник → задача контроля: "." и "Х" обходятся без search.json, если S/N уже встречался
+serial_index = SerialIndex(LOCAL_DB_PATH)
+# Зеркало задач: обработчики читают его раньше, чем ходят в Redmine
+redmine_mirror = RedmineMirror(LOCAL_DB_PATH, FIELD_SERIAL_NUMBER)
+# Фото из Telegram: одно скачивание на OCR, загрузку в Redmine и повтор
+tg_files = TelegramFileCache(TG_FILE_CACHE_MB * 1024 * 1024, TG_FILE_CACHE_TTL_SEC, TG_FILE_PATH_TTL_SEC)
+background_tasks: List[asyncio.Task] = []
+
+def index_checklist_serials(issue_id, checklist: Checklist):
+    """Заголовки "Проверка оборудования <S/N>" чек-листа → индекс"""
+    serial_index.remember([block.serial for block in checklist.serial_blocks()], issue_id, "checklist")
+
+def index_field_serials(issue: dict, control_task_id):
+    """Поле «Серийный номер» задачи производства → задача контроля, рядом с которой она лежит"""
+    for cf in issue.get("custom_fields", []):
+        if cf.get("id") == FIELD_SERIAL_NUMBER and isinstance(cf.get("value"), str):
+            serial_index.remember(cf["value"].split(), control_task_id, "field")
+
+async def sync_serial_index():
+    """
+    Фоновая синхронизация индекса: чек-листы задач контроля, изменённых с прошлого прохода.
+    Отметка времени сдвигается, только если все чек-листы прочитаны. Задачи идут по
+    возрастанию updated_on: если выдача обрезана на лимите страниц, отметка ставится
+    на последнюю обработанную задачу и следующий проход продолжит с неё.
+    """
+    watermark = serial_index.get_meta("checklists_synced_at")
+    started_at = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+    params = {"subject": "~контроль", "status_id": "*", "sort": "updated_on"}
+    if watermark:
+        params["updated_on"] = f">={watermark}"
+    
+    issues, total = await redmine.list_issues_counted(REDMINE_API_TOKEN, params)
+    truncated = len(issues) < total
+    controls = [i for i in issues if "контроль" in (i.get("subject") or "").lower()]
+    
+    async def index_one(issue: dict):
+        checklist = await redmine.get_checklist(issue["id"], REDMINE_API_TOKEN, fresh=True)
+        serial_index.remember_task(issue["id"], issue.get("subject"), f"{REDMINE_URL}/issues/{issue['id']}")
+        index_checklist_serials(issue["id"], checklist)
+    
+    results = await gather_limited(index_one, controls, REDMINE_FANOUT_LIMIT)
+    failed = [r for r in results if isinstance(r, Exception) and not (isinstance(r, RedmineError) and r.not_found)]
+    if not failed:
+        if truncated:
+            newest = max((issue.get("updated_on") or "" for issue in issues), default="")
+            if newest:
+                serial_index.set_meta("checklists_synced_at", newest)
+        else:
+            serial_index.set_meta("checklists_synced_at", started_at)
+    if truncated:
+        logging.info(f"[SN_INDEX] Получено {len(issues)} из {total} изменённых задач, остальные — в следующий проход")
+    logging.info(f"[SN_INDEX] Синхронизация: задач контроля {len(controls)}, ошибок {len(failed)}, "
+                 f"индекс {serial_index.stats()}")
+
+async def sync_redmine_mirror():
+    """
+    Забирает задачи, изменённые с последней отметки (при первом запуске — за
+    REDMINE_MIRROR_BACKFILL_DAYS дней), и обновляет зеркало. Задачи идут по
+    возрастанию updated_on, так что при обрыве на лимите страниц следующий проход
+    продолжит с последней записанной.
+    """
+    watermark = redmine_mirror.watermark() or time.strftime(
+        "%Y-%m-%dT%H:%M:%SZ", time.gmtime(time.time() - REDMINE_MIRROR_BACKFILL_DAYS * 86400)
+    )
+    issues = await redmine.list_issues(
+        REDMINE_API_TOKEN, {"status_id": "*", "updated_on": f">={watermark}", "sort": "updated_on"}
+    )
+    if not issues:
+        return
+    redmine_mirror.upsert(issues)
+    newest = max(issue.get("updated_on") or "" for issue in issues)
+    if newest:
+        redmine_mirror.set_watermark(newest)
+    # Задачи ровно на отметке приходят повторно (фильтр >=) — в лог только новые
+    changed = sum(1 for issue in issues if (issue.get("updated_on") or "") > watermark)
+    if changed:
+        logging.info(f"[MIRROR] Обновлено задач: {changed}, отметка {newest}")
+
+async def prune_redmine_mirror(chunk_size: int = 100):
+    """
+    Полная сверка зеркала: все его id запрашиваются пачками (issues.json?issue_id=...&status_id=*).
+    Задачи, которых Redmine в ответе не вернул, удалены или скрыты от ключа синхронизации —
+    их убираем. Пачка с ошибкой пропускается: удаляется только то, чего нет в успешном ответе.
+    """
+    ids = redmine_mirror.ids()
+    chunks = [ids[i:i + chunk_size] for i in range(0, len(ids), chunk_size)]
+    
+    async def check(chunk: List[int]) -> List[int]:
+        issues = await redmine.list_issues(
+            REDMINE_API_TOKEN, {"issue_id": ",".join(map(str, chunk)), "status_id": "*"}
+        )
+        present = {int(issue["id"]) for issue in issues}
+        return [issue_id for issue_id in chunk if issue_id not in present]
+    
+    results = await gather_limited(check, chunks, REDMINE_FANOUT_LIMIT)
+    gone = [issue_id for r in results if not isinstance(r, Exception) for issue_id in r]
+    failed = sum(1 for r in results if isinstance(r, Exception))
+    removed = redmine_mirror.delete(gone)
+    logging.info(f"[MIRROR] Сверка: задач {len(ids)}, удалено из зеркала {removed}, пачек с ошибкой {failed}")
+
+async def run_periodically(job: Callable[[], Awaitable[None]], interval: float, tag: str):
+    """Фоновая задача: job() раз в interval секунд; ошибки логируются и не останавливают цикл"""
+    while True:
+        try:
+            await job()
+        except Exception as e:
+            logging.error(f"[{tag}] Ошибка синхронизации: {e}")
+        await asyncio.sleep(interval)
+
+async def seed_serial_lexicon():
+    """Начальное наполнение справочника: поле "Серийный номер" открытых задач"""
+    try:
+        issues = await redmine.list_issues(REDMINE_API_TOKEN, {f"cf_{FIELD_SERIAL_NUMBER}": "*"})
+        for issue in issues:
+            for cf in issue.get("custom_fields", []):
+                if cf.get("id") == FIELD_SERIAL_NUMBER and isinstance(cf.get("value"), str):
+                    learn_serials(cf["value"])
+        logging.info(f"[LEXICON] Справочник загружен: {serial_lexicon.stats()}")
+    except RedmineError as e:
+        logging.error(f"[LEXICON] Ошибка загрузки справочника: {e}")
+
+@dp.startup()
+async def on_startup():
+    await redmine.start()
+    asyncio.create_task(seed_serial_lexicon())
+    if SERIAL_INDEX_SYNC_SEC > 0:
+        background_tasks.append(asyncio.create_task(
+            run_periodically(sync_serial_index, SERIAL_INDEX_SYNC_SEC, "SN_INDEX")))
+    if REDMINE_MIRROR_SYNC_SEC > 0:
+        background_tasks.append(asyncio.create_task(
+            run_periodically(sync_redmine_mirror, REDMINE_MIRROR_SYNC_SEC, "MIRROR")))
+        if REDMINE_MIRROR_PRUNE_SEC > 0:
+            background_tasks.append(asyncio.create_task(
+                run_periodically(prune_redmine_mirror, REDMINE_MIRROR_PRUNE_SEC, "MIRROR")))
+
+@dp.shutdown()
+async def on_shutdown():
+    for task in background_tasks:
+        task.cancel()
+    await redmine.close()
+    serial_index.close()
+    redmine_mirror.close()
+
+class OcrStats:
+    """Агрегированная статистика OCR: время этапов, попадания в кэш, доля найденных S/N"""
+    
+    def __init__(self, log_every: int = 20):
+        self.log_every = log_every
+        self.reset()
+    
+    def reset(self):
+        self.count = 0
+        self.found = 0
+        self.cache_hits = 0
+        self.stage_sum: Dict[str, float] = {}
+        self.stage_max: Dict[str, float] = {}
+        self.extractors: Dict[str, int] = {}
+        self.roi: Dict[str, int] = {}
+    
+    def add(self, res: AnalyzeResult):
+        self.count += 1
+        if res.found:
+            self.found += 1
+        diag = res.diagnostics
+        if diag:
+            if diag.cache_hit:
+                self.cache_hits += 1
+            if diag.extractor:
+                self.extractors[diag.extractor] = self.extractors.get(diag.extractor, 0) + 1
+            if diag.roi:
+                self.roi[diag.roi] = self.roi.get(diag.roi, 0) + 1
+            for stage, ms in diag.timings_ms.items():
+                self.stage_sum[stage] = self.stage_sum.get(stage, 0.0) + ms
+                self.stage_max[stage] = max(self.stage_max.get(stage, 0.0), ms)
+        
+        if self.log_every and self.count % self.log_every == 0:
+            logging.info(f"[OCR_STATS] {self.summary()}")
+    
+    def summary(self) -> str:
+        if not self.count:
+            return "нет данных"
+        stages = ", ".join(
+            f"{stage}={self.stage_sum[stage] / self.count:.0f}/{self.stage_max[stage]:.0f}мс"
+            for stage in sorted(self.stage_sum)
+        )
+        roi_tries = sum(self.roi.values())
+        roi = f"{self.roi.get('hit', 0)}/{roi_tries}" if roi_tries else "—"
+        return (
+            f"запросов={self.count}, найдено={self.found}, кэш={self.cache_hits}, "
+            f"ROI попаданий={roi}, экстракторы={self.extractors}, этапы (ср/макс): {stages}"
+        )
+
+ocr_stats = OcrStats(log_every=OCR_STATS_LOG_EVERY)
+
+async def ocr_in_thread(func: Callable[..., AnalyzeResult], *args) -> AnalyzeResult:
+    """
+    Вызов анализатора в потоке под OCR_SEMAPHORE. Отмена корутины не останавливает поток
+    PaddleOCR, поэтому семафор отпускается, когда поток закончил, а не когда корутину
+    отменили: иначе следующий вызов попал бы на тот же экземпляр OCR параллельно.
+    """
+    await OCR_SEMAPHORE.acquire()
+    job = asyncio.ensure_future(asyncio.to_thread(func, *args))
+    job.add_done_callback(lambda _: OCR_SEMAPHORE.release())
+    return await asyncio.shield(job)
+
+async def run_ocr(img_bytes: bytes, user_id: Optional[int] = None, single: bool = False) -> AnalyzeResult:
+    """
+    Запускает распознавание S/N в отдельном потоке и учитывает диагностику в статистике.
+    single=True — нужен один S/N (не все на фото): тогда с user_id анализатор сначала
+    смотрит туда, где S/N был на прошлом фото пользователя.
+    """
+    res: AnalyzeResult = await ocr_in_thread(sn_service.analyze_bytes, img_bytes, user_id, single)
+    ocr_stats.add(res)
+    if res.diagnostics:
+        logging.info(f"[OCR] found={res.found} {res.diagnostics.to_dict()}")
+    return res
+
+async def run_video_ocr(file_id: str) -> AnalyzeResult:
+    """
+    Распознавание S/N на видео / анимации. Файл скачивается потоком во временный файл
+    (OpenCV читает кадры с диска по одному), после анализа удаляется.
+    """
+    fd, path = tempfile.mkstemp(suffix=".mp4")
+    os.close(fd)
+    try:
+        await bot.download(file_id, destination=path)
+        res: AnalyzeResult = await ocr_in_thread(sn_service.analyze_video, path)
+    finally:
+        os.remove(path)
+    ocr_stats.add(res)
+    if res.diagnostics:
+        logging.info(f"[OCR_VIDEO] found={res.found} {res.diagnostics.to_dict()}")
+    return res
+
 # ===================== ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ =====================
 
 async def check_existing_defect(issue_id: str, serial: str, user_id: int) -> bool:
@@ -178,42 +471,51 @@ async def check_existing_defect(issue_id: str, serial: str, user_id: int) -> boo
     Проверяет есть ли уже зарегистрированное несоответствие для серийника.
     Возвращает True если есть (блокируем регистрацию).
     """
-    headers = {"X-Redmine-API-Key": get_user_api_token(user_id)}
-    url = f"{REDMINE_URL}/issues/{issue_id}/checklists.xml"
-    
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, headers=headers, ssl=False) as resp:
-                if resp.status != 200:
-                    return False
-                xml_text = await resp.text()
-        
-        root = ET.fromstring(xml_text)
-        
-        # Ищем блок серийника
-        in_serial_block = False
-        for cl in root.findall("checklist"):
-            subj = (cl.findtext("subject") or "").strip().lower()
-            
-            # Начало блока серийника
-            if "проверка оборудования" in subj and serial.upper() in subj.upper():
-                in_serial_block = True
-                continue
-            
-            # Конец блока (новый серийник)
-            if in_serial_block and "проверка оборудования" in subj:
-                break
-            
-            # Проверяем наличие пункта "Завести подзадачу"
-            if in_serial_block and "завести подзадачу" in subj:
-                return True
+        checklist = await redmine.get_checklist(issue_id, get_user_api_token(user_id))
         
-        return False
+        # Проверяем наличие пункта "Завести подзадачу" в блоке серийника
+        return any("завести подзадачу" in item.subject.lower() for item in checklist.block_items(serial))
     
     except Exception as e:
         logging.error(f"Ошибка check_existing_defect: {e}")
         return False
-        
+
+def issue_has_serial(issue: dict, serial: str) -> bool:
+    """Есть ли S/N в поле «Серийный номер» задачи (данные из списка issues.json тоже подходят)"""
+    for cf in issue.get("custom_fields", []):
+        if cf.get("id") == FIELD_SERIAL_NUMBER and isinstance(cf.get("value"), str):
+            return serial.upper() in cf["value"].upper()
+    return False
+
+async def find_equipment_in_mirror(control_task_id: str, serial: str, user_id: int) -> Optional[dict]:
+    """
+    Та же логика, что в find_equipment_name, но по зеркалу: родитель, затем siblings.
+    Зеркало синхронизируется общим ключом, поэтому найденная задача перечитывается ключом
+    пользователя: ответ строится по свежим данным, к которым у него есть доступ.
+    """
+    api_key = get_user_api_token(user_id)
+    control_issue = redmine_mirror.get(control_task_id)
+    parent = (control_issue or {}).get("parent")
+    if not parent:
+        return None
+    parent_id = str(parent["id"])
+    candidates = [redmine_mirror.get(parent_id)] + redmine_mirror.children(parent_id)
+    for task in candidates:
+        if not task or str(task["id"]) == str(control_task_id) or not issue_has_serial(task, serial):
+            continue
+        try:
+            task = await redmine.get_issue(task["id"], api_key)
+        except RedmineError as e:
+            logging.warning(f"[MIRROR] Задача #{task['id']} для S/N {serial} недоступна пользователю: {e}")
+            if e.not_found:
+                redmine_mirror.delete([task["id"]])
+            return None
+        result = await check_task_for_serial({"issue": task}, str(task["id"]), serial, user_id)
+        if result:
+            return result
+    return None
+
 async def find_equipment_name(control_task_id: str, serial: str, user_id: int) -> dict:
     """
     Находит задачу производства с серийником.
@@ -224,27 +526,29 @@ async def find_equipment_name(control_task_id: str, serial: str, user_id: int) -
     3. Проверяем САМОГО РОДИТЕЛЯ
     4. Если не нашли - ищем среди siblings (подзадач родителя)
     """
-    headers = {"X-Redmine-API-Key": get_user_api_token(user_id)}
+    api_key = get_user_api_token(user_id)
     
     try:
         logging.info(f"[FIND] Ищем оборудование для S/N: {serial} в задаче контроля #{control_task_id}")
         
+        # Сначала зеркало: если S/N уже синхронизирован, Redmine не нужен
+        result = await find_equipment_in_mirror(control_task_id, serial, user_id)
+        if result:
+            logging.info(f"[FIND] ✅ Найдено в зеркале Redmine")
+            return result
+        
         # Получаем задачу контроля
-        async with aiohttp.ClientSession() as session:
-            async with session.get(
-                f"{REDMINE_URL}/issues/{control_task_id}.json",
-                headers=headers,
-                ssl=False
-            ) as resp:
-                if resp.status != 200:
-                    logging.error(f"[FIND] Ошибка получения задачи контроля: HTTP {resp.status}")
-                    return None
-                control_data = await resp.json()
-        
-        logging.info(f"[FIND] Задача контроля получена: {control_data.get('issue', {}).get('subject', 'N/A')}")
+        try:
+            control_issue = await redmine.get_issue(control_task_id, api_key)
+        except RedmineError as e:
+            logging.error(f"[FIND] Ошибка получения задачи контроля: {e}")
+            return None
+        
+        logging.info(f"[FIND] Задача контроля получена: {control_issue.get('subject', 'N/A')}")
+        serial_index.remember_task(control_task_id, control_issue.get("subject"), f"{REDMINE_URL}/issues/{control_task_id}")
         
         # Получаем родителя
-        parent = control_data.get("issue", {}).get("parent")
+        parent = control_issue.get("parent")
         if not parent:
             logging.error(f"[FIND] У задачи контроля нет родителя!")
             return None
@@ -256,66 +560,44 @@ async def find_equipment_name(control_task_id: str, serial: str, user_id: int) -
         
         logging.info(f"[FIND] Проверяю родителя #{parent_id}...")
         
-        async with aiohttp.ClientSession() as session:
-            async with session.get(
-                f"{REDMINE_URL}/issues/{parent_id}.json",
-                headers=headers,
-                ssl=False
-            ) as resp:
-                if resp.status == 200:
-                    parent_data = await resp.json()
-                    
-                    # Проверяем серийник у родителя
-                    result = await check_task_for_serial(parent_data, parent_id, serial, user_id)
-                    if result:
-                        return result
-                    else:
-                        logging.info(f"[FIND] Родитель не содержит S/N {serial}")
+        try:
+            parent_issue = await redmine.get_issue(parent_id, api_key)
+            index_field_serials(parent_issue, control_task_id)
+            result = await check_task_for_serial({"issue": parent_issue}, parent_id, serial, user_id)
+            if result:
+                return result
+            logging.info(f"[FIND] Родитель не содержит S/N {serial}")
+        except RedmineError as e:
+            logging.warning(f"[FIND] Ошибка получения родителя: {e}")
         
         # ===== ЕСЛИ НЕ НАШЛИ У РОДИТЕЛЯ - ИЩЕМ СРЕДИ SIBLINGS =====
         
         logging.info(f"[FIND] Ищу среди siblings (подзадач родителя)...")
         
-        async with aiohttp.ClientSession() as session:
-            async with session.get(
-                f"{REDMINE_URL}/issues.json?parent_id={parent_id}&status_id=*&limit=100",
-                headers=headers,
-                ssl=False
-            ) as resp:
-                if resp.status != 200:
-                    logging.error(f"[FIND] Ошибка получения подзадач родителя: HTTP {resp.status}")
-                    return None
-                siblings_data = await resp.json()
-        
-        siblings = siblings_data.get("issues", [])
+        try:
+            siblings = await redmine.list_children(parent_id, api_key)
+        except RedmineError as e:
+            logging.error(f"[FIND] Ошибка получения подзадач родителя: {e}")
+            return None
+        
         logging.info(f"[FIND] Найдено подзадач родителя (siblings): {len(siblings)}")
         
-        # Проверяем каждую подзадачу родителя
-        for idx, sibling in enumerate(siblings):
+        # Список уже содержит custom_fields: сверяем серийник по нему,
+        # полную задачу запрашиваем только для совпавших
+        for sibling in siblings:
+            index_field_serials(sibling, control_task_id)
+        matches = [s for s in siblings if str(s["id"]) != control_task_id and issue_has_serial(s, serial)]
+        logging.info(f"[FIND] Совпадений по полю 'Серийный номер': {len(matches)}")
+        
+        for sibling in matches:
             sibling_id = str(sibling["id"])
-            sibling_subject = sibling.get("subject", "")
-            
-            logging.info(f"[FIND] Проверяю sibling [{idx+1}/{len(siblings)}] #{sibling_id}: {sibling_subject[:60]}...")
-            
-            # Пропускаем саму задачу контроля
-            if sibling_id == control_task_id:
-                logging.info(f"[FIND] → Пропускаю (это задача контроля)")
-                continue
-            
-            # Получаем полную информацию о задаче
-            async with aiohttp.ClientSession() as session:
-                async with session.get(
-                    f"{REDMINE_URL}/issues/{sibling_id}.json",
-                    headers=headers,
-                    ssl=False
-                ) as resp:
-                    if resp.status != 200:
-                        logging.warning(f"[FIND] → Ошибка получения задачи: HTTP {resp.status}")
-                        continue
-                    task_data = await resp.json()
+            try:
+                task_issue = await redmine.get_issue(sibling_id, api_key)
+            except RedmineError as e:
+                logging.warning(f"[FIND] → Ошибка получения задачи #{sibling_id}, беру данные списка: {e}")
+                task_issue = sibling
             
-            # Проверяем серийник
-            result = await check_task_for_serial(task_data, sibling_id, serial, user_id)
+            result = await check_task_for_serial({"issue": task_issue}, sibling_id, serial, user_id)
             if result:
                 return result
         
@@ -326,7 +608,6 @@ async def find_equipment_name(control_task_id: str, serial: str, user_id: int) -
         logging.error(f"[FIND] Ошибка find_equipment_name: {e}", exc_info=True)
         return None
 
-
 async def check_task_for_serial(task_data: dict, task_id: str, serial: str, user_id: int) -> dict:
     """
     Проверяет содержит ли задача нужный серийный номер.
@@ -344,6 +625,7 @@ async def check_task_for_serial(task_data: dict, task_id: str, serial: str, user
         
         serial_value = serial_field.get("value", "").strip()
         logging.info(f"[CHECK] → Серийный номер: '{serial_value}'")
+        learn_serials(serial_value)
         
         # Проверяем вхождение (может быть несколько серийников через пробел)
         if serial.upper() not in serial_value.upper():
@@ -401,92 +683,174 @@ async def check_task_for_serial(task_data: dict, task_id: str, serial: str, user
         logging.error(f"[CHECK] Ошибка check_task_for_serial: {e}", exc_info=True)
         return None
        
-async def recalculate_done_ratio(issue_id: str, user_id: int):
-    """Пересчитывает и обновляет процент готовности задачи"""
-    headers = {"X-Redmine-API-Key": get_user_api_token(user_id)}
+def checklist_done_ratio(items: Checklist) -> Optional[int]:
+    """Процент отмеченных пунктов чек-листа без заголовков; None — пунктов нет"""
+    total = 0
+    done = 0
+    
+    for item in items:
+        subj = item.subject.lower()
+        # Пропускаем заголовки (все варианты!)
+        if ("проверка оборудования" in subj or 
+            "комплектация оборудования" in subj or 
+            "выдача готового" in subj or
+            "переместить изделие в изолятор брака" in subj):
+            continue
+        
+        total += 1
+        if item.is_done:
+            done += 1
+    
+    return int((done / total) * 100) if total > 0 else None
+
+async def recalculate_done_ratio(issue_id: str, user_id: int, checklist: Optional[Checklist] = None):
+    """
+    Пересчитывает и обновляет процент готовности задачи.
+    checklist — уже известное состояние после отметок: тогда чек-лист не перечитывается.
+    """
+    api_key = get_user_api_token(user_id)
     
     try:
-        # Получаем текущие чек-листы
-        async with aiohttp.ClientSession() as session:
-            async with session.get(
-                f"{REDMINE_URL}/issues/{issue_id}/checklists.xml",
-                headers=headers,
-                ssl=False
-            ) as resp:
-                if resp.status != 200:
-                    return
-                xml_text = await resp.text()
-        
-        root = ET.fromstring(xml_text)
-        total = 0
-        done = 0
-        
-        for cl in root.findall("checklist"):
-            subj = (cl.findtext("subject") or "").strip().lower()
-            # Пропускаем заголовки (все варианты!)
-            if ("проверка оборудования" in subj or 
-                "комплектация оборудования" in subj or 
-                "выдача готового" in subj or
-                "переместить изделие в изолятор брака" in subj):
-                continue
-            
-            total += 1
-            is_done = cl.findtext("is_done") or "0"
-            if is_done in ("1", "true"):
-                done += 1
-        
-        # Вычисляем процент
-        if total > 0:
-            done_ratio = int((done / total) * 100)
-            
+        if checklist is None:
+            checklist = await redmine.get_checklist(issue_id, api_key)
+        done_ratio = checklist_done_ratio(checklist)
+        
+        if done_ratio is not None:
             # Обновляем задачу
-            payload = {
-                "issue": {
-                    "done_ratio": done_ratio
-                }
-            }
-            
-            async with aiohttp.ClientSession() as session:
-                async with session.put(
-                    f"{REDMINE_URL}/issues/{issue_id}.json",
-                    headers={**headers, "Content-Type": "application/json"},
-                    json=payload,
-                    ssl=False
-                ) as resp:
-                    if resp.status in (200, 204):
-                        logging.info(f"Done ratio обновлён: {done_ratio}% для задачи #{issue_id}")
-                    else:
-                        logging.error(f"Ошибка обновления done_ratio: HTTP {resp.status}")
+            await redmine.update_issue(issue_id, api_key, {"done_ratio": done_ratio})
+            logging.info(f"Done ratio обновлён: {done_ratio}% для задачи #{issue_id}")
     
     except Exception as e:
         logging.error(f"Ошибка recalculate_done_ratio: {e}")
 
+async def set_checklist_item_done(item: ChecklistItem, api_key: str, issue_id) -> bool:
+    """
+    Ставит галочку на пункт чек-листа (через клиент — с обновлением кэша).
+    422 от плагина считается успехом, как и раньше.
+    """
+    try:
+        await redmine.update_checklist_item(
+            item.id, api_key, subject=item.subject, is_done=True, issue_id=item.issue_id or issue_id
+        )
+        return True
+    except RedmineError as e:
+        if e.status == 422:
+            return True
+        logging.error(f"Ошибка отметки пункта #{item.id}: {e}")
+        return False
+
+async def set_checklist_items_done(items: List[ChecklistItem], api_key: str, issue_id,
+                                   checklist: Optional[Checklist] = None) -> Dict[int, bool]:
+    """
+    Ставит галочки на несколько пунктов параллельно (не больше CHECKLIST_WRITE_LIMIT запросов сразу).
+    Возвращает исход по каждому пункту: id → отмечен ли. Успешные отметки применяются
+    к checklist, чтобы процент готовности считался без повторной загрузки чек-листа.
+    """
+    results = await gather_limited(
+        lambda item: set_checklist_item_done(item, api_key, issue_id), items, CHECKLIST_WRITE_LIMIT
+    )
+    outcomes = {}
+    for item, result in zip(items, results):
+        if isinstance(result, Exception):
+            logging.error(f"Ошибка отметки пункта #{item.id}: {result}")
+        outcomes[item.id] = result is True
+        if outcomes[item.id] and checklist is not None:
+            checklist.update_item(item.id, is_done=True)
+    
+    failed = sum(1 for ok in outcomes.values() if not ok)
+    if failed:
+        logging.warning(f"[CHECKLIST] #{issue_id}: не отмечено {failed} из {len(items)} пунктов")
+    return outcomes
+
+async def delete_checklist_items(issue_id, api_key: str, item_ids: List[int],
+                                 progress: Optional[Callable[[int, int], Awaitable[None]]] = None) -> List[int]:
+    """
+    Удаляет пункты чек-листа параллельно (CHECKLIST_WRITE_LIMIT). Временные ошибки
+    повторяет клиент (DELETE идемпотентен); 404 — пункт уже удалён, это успех.
+    progress(обработано, всего) вызывается из отдельной задачи, а не внутри слота записи:
+    медленный edit_text не задерживает удаление, а накопившиеся шаги схлопываются в один вызов.
+    Из копии чек-листа в кэше удалённые убираются одной пачкой в конце.
+    Возвращает id неудалённых.
+    """
+    processed = 0
+    changed = asyncio.Event()
+    deleted: List[int] = []
+    
+    async def delete(item_id):
+        nonlocal processed
+        try:
+            await redmine.delete_checklist_item(item_id, api_key, forget=False)
+            deleted.append(item_id)
+        except RedmineError as e:
+            if not e.not_found:
+                raise
+            deleted.append(item_id)
+        finally:
+            processed += 1
+            changed.set()
+    
+    async def report():
+        while True:
+            await changed.wait()
+            changed.clear()
+            await progress(processed, len(item_ids))
+    
+    reporter = asyncio.create_task(report()) if progress else None
+    try:
+        results = await gather_limited(delete, item_ids, CHECKLIST_WRITE_LIMIT)
+    finally:
+        if reporter:
+            reporter.cancel()
+        redmine.checklists.remove_items(deleted)
+    failed = []
+    for item_id, result in zip(item_ids, results):
+        if isinstance(result, Exception):
+            failed.append(item_id)
+            logging.error(f"Не удалось удалить пункт ID={item_id} из задачи #{issue_id}: {result}")
+    return failed
+
+async def write_checklist_order(issue_id, api_key: str, target: List) -> bool:
+    """
+    Приводит чек-лист к порядку target (ChecklistItem — существующие пункты, dict — новые).
+    Вместо пересоздания всего чек-листа: PUT позиции только для сдвинутых пунктов, затем
+    POST новых, каждый шаг — параллельно в пределах CHECKLIST_WRITE_LIMIT.
+    Чек-лист ни в какой момент не пустеет. True — все запросы прошли.
+    """
+    moves, creates = plan_positions(target)
+    
+    async def move(change):
+        item, position = change
+        await redmine.update_checklist_item(item.id, api_key, position=position)
+    
+    async def create(change):
+        new, position = change
+        await redmine.create_checklist_item(
+            issue_id, api_key, new["subject"], is_done=new["is_done"],
+            position=position, is_section=new["is_section"]
+        )
+    
+    # Сначала освобождаем позиции, потом занимаем их новыми пунктами
+    failed = 0
+    for step, apply, changes in (("перемещение", move, moves), ("создание", create, creates)):
+        results = await gather_limited(apply, changes, CHECKLIST_WRITE_LIMIT)
+        for (entry, position), result in zip(changes, results):
+            if isinstance(result, Exception):
+                failed += 1
+                subject = entry["subject"] if isinstance(entry, dict) else entry.subject
+                logging.error(f"[CHECKLIST] #{issue_id}: {step} pos={position} '{subject[:40]}' не удалось: {result}")
+    
+    logging.info(f"[CHECKLIST] #{issue_id}: сдвинуто {len(moves)}, создано {len(creates)}, ошибок {failed} "
+                 f"(пунктов в чек-листе {len(target)})")
+    return failed == 0
+
 async def count_equipment_in_checklist(issue_id: str, user_id: int) -> int:
     """
     Считает количество единиц оборудования в чек-листе задачи.
     Логика: количество пунктов "Проверка оборудования <серийник>" (без "указать серийный номер").
     """
-    headers = {"X-Redmine-API-Key": get_user_api_token(user_id)}
-    url = f"{REDMINE_URL}/issues/{issue_id}/checklists.xml"
-    
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, headers=headers, ssl=False) as resp:
-                if resp.status != 200:
-                    return 0
-                xml_text = await resp.text()
-        
-        root = ET.fromstring(xml_text)
-        count = 0
-        
-        for cl in root.findall("checklist"):
-            subj = (cl.findtext("subject") or "").strip().lower()
-            
-            # Проверяем: "Проверка оборудования" + НЕ содержит "указать серийный номер"
-            if "проверка оборудования" in subj and "указать серийный номер" not in subj:
-                count += 1
-        
-        return count
+        checklist = await redmine.get_checklist(issue_id, get_user_api_token(user_id))
+        return len(checklist.serial_blocks())
     
     except Exception as e:
         logging.error(f"Ошибка count_equipment_in_checklist: {e}")
@@ -497,18 +861,9 @@ async def get_custom_field_id(issue_id: str, field_name: str, user_id: int) -> O
     Получает ID кастомного поля по его названию.
     Возвращает ID или None, если не найдено.
     """
-    headers = {"X-Redmine-API-Key": get_user_api_token(user_id)}
-    url = f"{REDMINE_URL}/issues/{issue_id}.json"
-    
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, headers=headers, ssl=False) as resp:
-                if resp.status != 200:
-                    logging.error(f"Ошибка получения задачи: HTTP {resp.status}")
-                    return None
-                data = await resp.json()
-        
-        custom_fields = data.get("issue", {}).get("custom_fields", [])
+        issue = await redmine.get_issue(issue_id, get_user_api_token(user_id))
+        custom_fields = issue.get("custom_fields", [])
         
         for field in custom_fields:
             if field.get("name", "").strip().lower() == field_name.strip().lower():
@@ -521,22 +876,52 @@ async def get_custom_field_id(issue_id: str, field_name: str, user_id: int) -> O
         logging.error(f"Ошибка get_custom_field_id: {e}")
         return None
 
-async def download_file_bytes(file_id: str) -> bytes:
-    """Скачивает файл из Telegram по file_id."""
+async def resolve_telegram_file(file_id: str) -> Tuple[str, str, Optional[int]]:
+    """(file_unique_id, file_path, размер) файла; getFile — только если в кэше нет"""
+    cached = tg_files.path(file_id)
+    if cached:
+        return cached
     file = await bot.get_file(file_id)
-    file_url = f"https://api.telegram.org/file/bot{TELEGRAM_TOKEN}/{file.file_path}"
-    async with aiohttp.ClientSession() as session:
-        async with session.get(file_url, ssl=False) as resp:
-            if resp.status != 200:
-                raise RuntimeError(f"Не удалось загрузить файл (HTTP {resp.status})")
-            return await resp.read()
+    tg_files.put_path(file_id, file.file_unique_id, file.file_path, file.file_size)
+    return file.file_unique_id, file.file_path, file.file_size
+
+async def download_file_bytes(file_id: str) -> bytes:
+    """Скачивает файл из Telegram по file_id (повторно — из кэша по file_unique_id)."""
+    unique_id, file_path, _ = await resolve_telegram_file(file_id)
+    data = tg_files.get(unique_id)
+    if data is not None:
+        return data
+    # Через сессию самого бота: проверка TLS и свой пул соединений, не общий с Redmine
+    data = (await bot.download_file(file_path, timeout=TG_DOWNLOAD_TIMEOUT_SEC)).getvalue()
+    tg_files.put(unique_id, data)
+    return data
+
+async def upload_telegram_file(file_id: str, api_key: str) -> Tuple[str, str]:
+    """
+    Перекладывает файл из Telegram в Redmine. Если файл уже скачан для OCR — загружается
+    из кэша без обращения к Telegram; иначе потоком: куски ответа Telegram сразу
+    уходят в /uploads.json, целиком файл в памяти не собирается.
+    Возвращает (токен загрузки, имя файла).
+    """
+    unique_id, file_path, size = await resolve_telegram_file(file_id)
+    filename = file_path.split("/")[-1]
+    data = tg_files.get(unique_id)
+    if data is not None:
+        token = await redmine.upload(data, api_key, filename=filename)
+        logging.info(f"Файл {filename} ({len(data)} байт) загружен в Redmine из кэша")
+        return token, filename
+    file_url = bot.session.api.file_url(bot.token, file_path)
+    chunks = bot.session.stream_content(file_url, timeout=TG_DOWNLOAD_TIMEOUT_SEC,
+                                        chunk_size=REDMINE_UPLOAD_CHUNK_KB * 1024)
+    token = await redmine.upload_stream(chunks, api_key, filename=filename, size=size)
+    logging.info(f"Файл {filename} ({size or '?'} байт) загружен в Redmine потоком")
+    return token, filename
 
 async def ocr_sn_text_by_file_id(file_id: str) -> str:
     """Распознаёт S/N и пароль BIOS из изображения."""
     try:
         img_bytes = await download_file_bytes(file_id)
-        async with OCR_SEMAPHORE:
-            res: AnalyzeResult = await asyncio.to_thread(sn_service.analyze_bytes, img_bytes)
+        res: AnalyzeResult = await run_ocr(img_bytes)
         if res.found:
             return f"🔍 Найден S/N: {res.serial}\n\n🔑 Пароль BIOS: {res.password}"
         else:
@@ -545,38 +930,234 @@ async def ocr_sn_text_by_file_id(file_id: str) -> str:
         logging.error(f"OCR error: {e}")
         return f"🔍 Ошибка распознавания S/N: {e}"
         
-async def get_all_serials_from_checklist(issue_id: str, user_id: int) -> list:
+# ===================== КОНСЕНСУС ПО НЕСКОЛЬКИМ КАДРАМ =====================
+
+class FrameBurst:
     """
-    Возвращает список ВСЕХ серийников из чек-листа задачи контроля.
-    Формат: ["ABC001", "ABC002", "ABC003", ...]
+    Кадры одной этикетки: альбом Telegram или серия фото от пользователя в коротком окне.
+    Альбом целиком считается одной этикеткой. В серии пользователя в общий ответ идут
+    только кадры с тем же S/N: быстро снятая вторая единица получает свой результат
+    через verdict своего кадра и отвечается отдельно.
     """
-    headers = {"X-Redmine-API-Key": get_user_api_token(user_id)}
-    url = f"{REDMINE_URL}/issues/{issue_id}/checklists.xml"
     
+    def __init__(self, key: str, window: float, max_frames: int):
+        self.key = key
+        self.window = window
+        self.max_frames = max_frames
+        self.merge_all = key.startswith("album:")
+        self.frames: asyncio.Queue = asyncio.Queue()      # (номер кадра, file_id)
+        self.verdicts: List[asyncio.Future] = []
+        self.count = 0
+        self.deadline = 0.0
+        self.closed = False
+    
+    def add(self, file_id: str) -> Optional[asyncio.Future]:
+        if self.closed or self.count >= self.max_frames:
+            return None
+        verdict = asyncio.get_running_loop().create_future()
+        self.verdicts.append(verdict)
+        self.frames.put_nowait((self.count, file_id))
+        self.count += 1
+        self.deadline = asyncio.get_running_loop().time() + self.window
+        return verdict
+    
+    def time_left(self) -> float:
+        return max(0.0, self.deadline - asyncio.get_running_loop().time())
+
+class BurstCollector:
+    """Группирует входящие кадры по media_group_id или по пользователю и режиму подписи"""
+    
+    def __init__(self, window: float, max_frames: int):
+        self.window = window
+        self.max_frames = max_frames
+        self._bursts: Dict[str, FrameBurst] = {}
+    
+    @staticmethod
+    def key_for(message: types.Message, mode: Optional[str]) -> str:
+        if message.media_group_id:
+            return f"album:{message.media_group_id}"
+        return f"user:{message.from_user.id}:{mode}"
+    
+    def join(self, key: str, file_id: str) -> Optional[asyncio.Future]:
+        """
+        Добавляет кадр к уже идущей серии. None — серии нет (или она закрыта).
+        Иначе future: None — кадр вошёл в общий ответ, (результат, file_id) — на кадре
+        другой S/N, отвечать на это сообщение нужно отдельно.
+        """
+        burst = self._bursts.get(key)
+        return burst.add(file_id) if burst else None
+    
+    def start(self, key: str, file_id: str) -> FrameBurst:
+        burst = FrameBurst(key, self.window, self.max_frames)
+        burst.add(file_id)
+        self._bursts[key] = burst
+        return burst
+    
+    def close(self, burst: FrameBurst):
+        burst.closed = True
+        if self._bursts.get(burst.key) is burst:
+            del self._bursts[burst.key]
+
+burst_collector = BurstCollector(window=CONSENSUS_WINDOW_SEC, max_frames=CONSENSUS_MAX_FRAMES)
+
+async def ocr_frame(frame: Tuple[int, str], user_id: Optional[int] = None,
+                    single: bool = False) -> Tuple[int, str, AnalyzeResult]:
+    frame_no, file_id = frame
+    img_bytes = await download_file_bytes(file_id)
+    return frame_no, file_id, await run_ocr(img_bytes, user_id, single)
+
+def _consensus_reached(results: List[Tuple[int, str, AnalyzeResult]], burst: FrameBurst, pending: int) -> Optional[str]:
+    """S/N, о котором уже договорились кадры, или None"""
+    # Кворум досрочно закрывает только альбом: в серии пользователя ещё не
+    # распознанный кадр может оказаться другой единицей
+    if burst.merge_all:
+        counts: Dict[str, int] = {}
+        for _, _, res in results:
+            if res.found:
+                counts[res.serial] = counts.get(res.serial, 0) + 1
+                if counts[res.serial] >= CONSENSUS_QUORUM:
+                    return res.serial
+    
+    # Одиночное фото с уверенным распознаванием не ждёт окна серии
+    if burst.count == 1 and not pending and len(results) == 1:
+        res = results[0][2]
+        if res.found and (res.confidence or 0) >= CONSENSUS_SINGLE_FRAME_CONFIDENCE:
+            return res.serial
+    return None
+
+def _split_series(burst: FrameBurst, found: List[Tuple[int, str, AnalyzeResult]]) -> List[Tuple[int, str, AnalyzeResult]]:
+    """
+    Серия пользователя: в общий ответ — кадры с S/N первого распознанного кадра.
+    Каждый другой S/N отдаётся лучшим кадром своей группы в verdict первого кадра
+    группы — на то сообщение бот ответит отдельно. Возвращает кадры общего ответа.
+    """
+    groups: Dict[str, List[Tuple[int, str, AnalyzeResult]]] = {}
+    for frame in sorted(found, key=lambda f: f[0]):
+        groups.setdefault(frame[2].serial, []).append(frame)
+    main_serial = next(iter(groups))
+    for serial, frames in groups.items():
+        if serial == main_serial:
+            continue
+        _, best_fid, best = max(frames, key=lambda f: f[2].confidence or 0)
+        verdict = burst.verdicts[frames[0][0]]
+        if not verdict.done():
+            verdict.set_result((best, best_fid))
+    return groups[main_serial]
+
+async def consensus_ocr(burst: FrameBurst, user_id: Optional[int] = None, single: bool = False) -> Tuple[AnalyzeResult, str]:
+    """
+    Распознаёт кадры серии по мере поступления (скачивание параллельно, OCR — через OCR_SEMAPHORE)
+    и объединяет их посимвольным голосованием с весом по уверенности распознавания.
+    Альбом: как только CONSENSUS_QUORUM кадров дали одинаковый S/N — отвечает сразу, оставшиеся
+    кадры отменяются. Серия пользователя распознаётся целиком, кадры с другими S/N отвечаются
+    отдельно (см. _split_series).
+    Возвращает (результат, file_id кадра для загрузки в Redmine).
+    """
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, headers=headers, ssl=False) as resp:
-                if resp.status != 200:
-                    return []
-                xml_text = await resp.text()
-        
-        root = ET.fromstring(xml_text)
-        serials = []
-        
-        for cl in root.findall("checklist"):
-            subj = (cl.findtext("subject") or "").strip()
-            subj_l = subj.lower()
+        return await _consensus_ocr(burst, user_id, single)
+    finally:
+        # Кадры, не получившие отдельного результата, вошли в общий ответ
+        for verdict in burst.verdicts:
+            if not verdict.done():
+                verdict.set_result(None)
+
+async def _consensus_ocr(burst: FrameBurst, user_id: Optional[int], single: bool) -> Tuple[AnalyzeResult, str]:
+    pending = set()
+    results: List[Tuple[int, str, AnalyzeResult]] = []
+    getter = asyncio.ensure_future(burst.frames.get())
+    agreed = None
+    
+    try:
+        while getter or pending:
+            waiters = set(pending)
+            if getter:
+                waiters.add(getter)
+            done, _ = await asyncio.wait(
+                waiters,
+                timeout=burst.time_left() if getter else None,
+                return_when=asyncio.FIRST_COMPLETED
+            )
             
-            # Ищем заголовки "Проверка оборудования <S/N>"
-            if ("проверка оборудования" in subj_l and 
-                "указать серийный номер" not in subj_l):
-                
-                # Извлекаем серийник из названия
-                serial = subj.replace("Проверка оборудования", "").strip()
+            if not done:
+                # Окно серии закрылось — новых кадров не принимаем
+                burst_collector.close(burst)
+                getter.cancel()
+                getter = None
+                while not burst.frames.empty():
+                    pending.add(asyncio.create_task(ocr_frame(burst.frames.get_nowait(), user_id, single)))
+                continue
+            
+            for fut in done:
+                if fut is getter:
+                    pending.add(asyncio.create_task(ocr_frame(fut.result(), user_id, single)))
+                    getter = asyncio.ensure_future(burst.frames.get())
+                    continue
                 
-                if serial and serial not in serials:
-                    serials.append(serial)
+                pending.discard(fut)
+                try:
+                    results.append(fut.result())
+                except Exception as e:
+                    logging.error(f"[CONSENSUS] Ошибка кадра: {e}")
+            
+            agreed = _consensus_reached(results, burst, len(pending))
+            if agreed:
+                break
+    finally:
+        burst_collector.close(burst)
+        if getter:
+            getter.cancel()
+        # Отмена безопасна: поток OCR доработает под семафором (ocr_in_thread)
+        for task in pending:
+            task.cancel()
+    
+    found = [frame for frame in results if frame[2].found]
+    recognised = len(found)
+    if found and not burst.merge_all:
+        found = _split_series(burst, found)
+    logging.info(
+        f"[CONSENSUS] {burst.key}: кадров {burst.count}, распознано {len(results)}, "
+        f"с S/N {recognised}, в ответе {len(found)}, кворум: {agreed or 'нет'}"
+    )
+    
+    if not found:
+        if results:
+            return results[-1][2], results[-1][1]
+        return AnalyzeResult(found=False, debug_text="Ни один кадр не распознан"), ""
+    
+    if len(found) == 1:
+        return found[0][2], found[0][1]
+    
+    if agreed:
+        serial, agreement = agreed, 1.0
+    else:
+        serial, agreement = vote_serial([(res.serial, res.confidence) for _, _, res in found])
+    
+    if not serial:
+        # Голосование дало невалидный номер — берём самый уверенный кадр
+        _, best_fid, best = max(found, key=lambda item: item[2].confidence or 0)
+        return best, best_fid
+    
+    matching = [frame for frame in found if frame[2].serial == serial] or found
+    _, best_fid, best = max(matching, key=lambda item: item[2].confidence or 0)
+    return AnalyzeResult(
+        found=True,
+        serial=serial,
+        password=compute_bios_password_string(serial),
+        confidence=agreement,
+        diagnostics=best.diagnostics
+    ), best_fid
+
+async def get_all_serials_from_checklist(issue_id: str, user_id: int) -> list:
+    """
+    Возвращает список ВСЕХ серийников из чек-листа задачи контроля.
+    Формат: ["ABC001", "ABC002", "ABC003", ...]
+    """
+    try:
+        checklist = await redmine.get_checklist(issue_id, get_user_api_token(user_id))
+        serials = list(dict.fromkeys(block.serial for block in checklist.serial_blocks()))
+        index_checklist_serials(issue_id, checklist)
         
+        learn_serials(*serials)
         return serials
     
     except Exception as e:
@@ -614,6 +1195,46 @@ async def search_global(message: types.Message):
     await perform_search(message, query_text)
             
 # ===== /s5 — умный поиск задач "Контроль" =====
+
+def search_issue_ids(results: List[dict]) -> List[str]:
+    """ID задач из ответа search.json (без повторов, в порядке выдачи)"""
+    issue_ids = []
+    for res in results:
+        rel_url = res.get("url") or ""
+        full_url = rel_url if rel_url.startswith("http") else f"{REDMINE_URL}{rel_url}"
+        m = re.search(r"/issues/(\d+)", full_url)
+        if m and m.group(1) not in issue_ids:
+            issue_ids.append(m.group(1))
+    return issue_ids
+
+def control_tasks_in(issues: List[dict]) -> List[dict]:
+    """Задачи с "контроль" в названии: [{"id", "subject", "url"}, ...]"""
+    found = []
+    for issue in issues:
+        subj = (issue.get("subject") or "").strip()
+        if "контроль" in subj.lower():
+            cid = str(issue.get("id"))
+            found.append({"id": cid, "subject": subj, "url": f"{REDMINE_URL}/issues/{cid}"})
+    return found
+
+def parent_ids_of(issues: List[dict]) -> List[str]:
+    parent_ids = []
+    for issue in issues:
+        parent = issue.get("parent")
+        if parent:
+            pid = str(parent.get("id"))
+            if pid and pid not in parent_ids:
+                parent_ids.append(pid)
+    return parent_ids
+
+async def answer_control_tasks(message: types.Message, found_controls: List[dict]):
+    for item in found_controls:
+        text = f"🔎 {item['subject']} #{item['id']}"
+        kb = InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text=item['id'], url=item['url'])]
+        ])
+        await message.answer(text, reply_markup=kb)
+
 @dp.message(Command("s5"))
 async def search_control(message: types.Message):
     query_text = message.text[len("/s5 "):].strip()
@@ -621,422 +1242,488 @@ async def search_control(message: types.Message):
         await message.answer("Укажи фразу: /s5 <фраза>")
         return
 
-    headers = {"X-Redmine-API-Key": get_user_api_token(message.from_user.id)}
-    search_url = f"{REDMINE_URL}/search.json?q={quote(query_text)}&limit=10&scope=issues"
+    api_key = get_user_api_token(message.from_user.id)
 
-    async with aiohttp.ClientSession() as session:
+    try:
+        # 1) Базовый поиск задач
         try:
-            # 1) Базовый поиск задач
-            async with session.get(search_url, headers=headers, ssl=False) as resp:
-                if resp.status != 200:
-                    await message.answer(f"Ошибка поиска: HTTP {resp.status}")
-                    return
-                data = await resp.json()
-
-            results = data.get("results", [])
-            if not results:
-                await message.answer("Ничего не найдено.")
-                return
+            results = await redmine.search(query_text, api_key, limit=10)
+        except RedmineError as e:
+            await message.answer(f"Ошибка поиска: HTTP {e.status}")
+            return
 
-            # Собираем ID найденных задач
-            issue_ids = []
-            for res in results:
-                rel_url = res.get("url") or ""
-                full_url = rel_url if rel_url.startswith("http") else f"{REDMINE_URL}{rel_url}"
-                m = re.search(r"/issues/(\d+)", full_url)
-                if m:
-                    issue_id = m.group(1)
-                    if issue_id not in issue_ids:
-                        issue_ids.append(issue_id)
-
-            if not issue_ids:
-                await message.answer("Ничего не найдено.")
-                return
+        if not results:
+            await message.answer("Ничего не найдено.")
+            return
 
-            found_controls = []
-            reported_ids = set()
-
-            # === ПРОХОД 1: Подзадачи найденных задач ===
-            for iid in issue_ids:
-                url_children = f"{REDMINE_URL}/issues.json?parent_id={iid}&status_id=*&limit=100"
-                async with session.get(url_children, headers=headers, ssl=False) as r:
-                    if r.status != 200:
-                        continue
-                    j = await r.json()
-
-                for ch in j.get("issues", []):
-                    subj = (ch.get("subject") or "").strip()
-                    if "контроль" in subj.lower():
-                        cid = str(ch.get("id"))
-                        if cid not in reported_ids:
-                            found_controls.append({
-                                "id": cid,
-                                "subject": subj,
-                                "url": f"{REDMINE_URL}/issues/{cid}",
-                            })
-                            reported_ids.add(cid)
-
-            # Если нашли — выводим
-            if found_controls:
-                for item in found_controls:
-                    text = f"🔎 {item['subject']} #{item['id']}"
-                    kb = InlineKeyboardMarkup(inline_keyboard=[
-                        [InlineKeyboardButton(text=item['id'], url=item['url'])]
-                    ])
-                    await message.answer(text, reply_markup=kb)
-                return
+        # Собираем ID найденных задач
+        issue_ids = search_issue_ids(results)
+        if not issue_ids:
+            await message.answer("Ничего не найдено.")
+            return
 
-            # === ПРОХОД 2: Подзадачи родителя найденных задач ===
-            parent_ids = []
-            for iid in issue_ids:
-                issue_url = f"{REDMINE_URL}/issues/{iid}.json"
-                async with session.get(issue_url, headers=headers, ssl=False) as r:
-                    if r.status != 200:
-                        continue
-                    issue_data = await r.json()
-
-                parent = (issue_data.get("issue") or {}).get("parent")
-                if parent:
-                    parent_id = str(parent.get("id"))
-                    if parent_id and parent_id not in parent_ids:
-                        parent_ids.append(parent_id)
-
-            # Ищем подзадачи родителей с "контроль"
-            for pid in parent_ids:
-                url_parent_children = f"{REDMINE_URL}/issues.json?parent_id={pid}&status_id=*&limit=100"
-                async with session.get(url_parent_children, headers=headers, ssl=False) as r:
-                    if r.status != 200:
-                        continue
-                    j = await r.json()
-
-                for ch in j.get("issues", []):
-                    subj = (ch.get("subject") or "").strip()
-                    if "контроль" in subj.lower():
-                        cid = str(ch.get("id"))
-                        if cid not in reported_ids:
-                            found_controls.append({
-                                "id": cid,
-                                "subject": subj,
-                                "url": f"{REDMINE_URL}/issues/{cid}",
-                            })
-                            reported_ids.add(cid)
-
-            # Если нашли — выводим
-            if found_controls:
-                for item in found_controls:
-                    text = f"🔎 {item['subject']} #{item['id']}"
-                    kb = InlineKeyboardMarkup(inline_keyboard=[
-                        [InlineKeyboardButton(text=item['id'], url=item['url'])]
-                    ])
-                    await message.answer(text, reply_markup=kb)
-                return
+        found_controls = []
+        reported_ids = set()
+        tree = redmine.issue_tree(api_key, REDMINE_FANOUT_LIMIT)
 
-            # === ПРОХОД 3: Сам родитель с "контроль" в названии ===
-            for pid in parent_ids:
-                parent_url = f"{REDMINE_URL}/issues/{pid}.json"
-                async with session.get(parent_url, headers=headers, ssl=False) as r:
-                    if r.status != 200:
-                        continue
-                    pd = await r.json()
-
-                parent_issue = pd.get("issue") or {}
-                parent_subject = (parent_issue.get("subject") or "").strip()
-
-                if "контроль" in parent_subject.lower():
-                    cid = str(parent_issue.get("id"))
-                    if cid not in reported_ids:
-                        found_controls.append({
-                            "id": cid,
-                            "subject": parent_subject,
-                            "url": f"{REDMINE_URL}/issues/{cid}",
-                        })
-                        reported_ids.add(cid)
-
-            # Финальный вывод
-            if found_controls:
-                for item in found_controls:
-                    text = f"🔎 {item['subject']} #{item['id']}"
-                    kb = InlineKeyboardMarkup(inline_keyboard=[
-                        [InlineKeyboardButton(text=item['id'], url=item['url'])]
-                    ])
-                    await message.answer(text, reply_markup=kb)
-            else:
-                await message.answer("Задачи контроля не найдены.")
+        def collect(candidates: List[dict]):
+            for item in candidates:
+                if item["id"] not in reported_ids:
+                    found_controls.append(item)
+                    reported_ids.add(item["id"])
 
-        except Exception as e:
-            logging.error(f"Ошибка /s5: {e}")
-            await message.answer(f"Ошибка при поиске задач контроля:\n{e}")
+        # === ПРОХОД 1: Подзадачи найденных задач ===
+        for children in await tree.children(issue_ids):
+            collect(control_tasks_in(children))
+
+        # Если нашли — выводим
+        if found_controls:
+            await answer_control_tasks(message, found_controls)
+            return
+
+        # === ПРОХОД 2: Подзадачи родителя найденных задач ===
+        # Родители уже известны из ответов прохода 1
+        parent_ids = await tree.parent_ids(issue_ids)
+
+        # Ищем подзадачи родителей с "контроль"
+        for children in await tree.children(parent_ids):
+            collect(control_tasks_in(children))
+
+        # Если нашли — выводим
+        if found_controls:
+            await answer_control_tasks(message, found_controls)
+            return
+
+        # === ПРОХОД 3: Сам родитель с "контроль" в названии ===
+        collect(control_tasks_in(await tree.issues(parent_ids)))
+        logging.info(f"[S5] '{query_text}': запросов к дереву задач {tree.total_requests}")
+
+        # Финальный вывод
+        if found_controls:
+            await answer_control_tasks(message, found_controls)
+        else:
+            await message.answer("Задачи контроля не найдены.")
+
+    except Exception as e:
+        logging.error(f"Ошибка /s5: {e}")
+        await message.answer(f"Ошибка при поиске задач контроля:\n{e}")
 
 # ===================== Поиск задачи контроля (как /s5) =====================
 
-async def find_control_task(serial: str, user_id: int) -> Optional[dict]:
+async def find_control_task(serial: str, user_id: int, tree: Optional[IssueTree] = None) -> Optional[dict]:
     """
-    Ищет задачу контроля по серийному номеру (логика /s5).
+    Ищет задачу контроля по серийному номеру: сначала локальный индекс, затем
+    зеркало задач, затем поиск Redmine (логика /s5). Найденное попадает в индекс.
+    Индекс и зеркало заполняются общим ключом, поэтому их находка проверяется
+    ключом пользователя (GET задачи) — чужие задачи не отдаются.
+    tree — граф задач запроса: его же потом использует find_and_get_tz_file.
     Возвращает: {"id": "12345", "subject": "...", "url": "..."}
     или None, если не найдено
     """
-    headers = {"X-Redmine-API-Key": get_user_api_token(user_id)}
-    search_url = f"{REDMINE_URL}/search.json?q={quote(serial)}&limit=10&scope=issues"
+    api_key = get_user_api_token(user_id)
+    if tree is None:
+        tree = redmine.issue_tree(api_key, REDMINE_FANOUT_LIMIT)
+    
+    cached = serial_index.lookup(serial)
+    if cached:
+        # Один GET по id ключом пользователя; заодно узнаём название, если привязка из чек-листа или поля
+        try:
+            issue = await tree.node(cached["id"])
+            if cached["subject"] is None:
+                cached["subject"] = (issue.get("subject") or "").strip()
+                cached["url"] = f"{REDMINE_URL}/issues/{cached['id']}"
+                serial_index.remember_task(cached["id"], cached["subject"], cached["url"])
+            return cached
+        except RedmineError as e:
+            logging.warning(f"[SN_INDEX] Задача #{cached['id']} для S/N {serial} недоступна: {e}")
+            if e.not_found:
+                serial_index.forget_issue(cached["id"])
+    
+    found = find_control_task_in_mirror(serial)
+    if found:
+        try:
+            await tree.node(found["id"])
+            serial_index.remember([serial], found["id"], "field", found["subject"], found["url"])
+            return found
+        except RedmineError as e:
+            logging.warning(f"[MIRROR] Задача #{found['id']} для S/N {serial} недоступна пользователю: {e}")
+            if e.not_found:
+                redmine_mirror.delete([found["id"]])
+    
+    found = await search_control_task(serial, tree)
+    if found:
+        serial_index.remember([serial], found["id"], "search", found["subject"], found["url"])
+    return found
+
+def find_control_task_in_mirror(serial: str) -> Optional[dict]:
+    """
+    Проходы search_control_task по зеркалу: вместо полнотекстового поиска — задачи
+    с этим S/N в поле «Серийный номер».
+    """
+    hits = redmine_mirror.issues_with_serial(serial)
+    if not hits:
+        return None
+    
+    controls = control_tasks_in(hits)
+    if controls:
+        return controls[0]
+    
+    # === ПРОХОД 1: Подзадачи найденных задач ===
+    for hit in hits:
+        controls = control_tasks_in(redmine_mirror.children(hit["id"]))
+        if controls:
+            return controls[0]
+    
+    # === ПРОХОД 2: Подзадачи родителей ===
+    parent_ids = parent_ids_of(hits)
+    for pid in parent_ids:
+        controls = control_tasks_in(redmine_mirror.children(pid))
+        if controls:
+            return controls[0]
+    
+    # === ПРОХОД 3: Сам родитель ===
+    controls = control_tasks_in([p for p in map(redmine_mirror.get, parent_ids) if p])
+    return controls[0] if controls else None
 
-    async with aiohttp.ClientSession() as session:
+async def search_control_task(serial: str, tree: IssueTree) -> Optional[dict]:
+    """
+    Поиск задачи контроля через search.json и обход дерева задач.
+    Каждый проход опрашивает Redmine параллельно, но побеждает первая по порядку
+    выдачи поиска задача — как при последовательном обходе.
+    """
+    try:
+        # 1) Базовый поиск
         try:
-            # 1) Базовый поиск
-            async with session.get(search_url, headers=headers, ssl=False) as resp:
-                if resp.status != 200:
-                    return None
-                data = await resp.json()
-
-            results = data.get("results", [])
-            if not results:
-                return None
-
-            # Собираем ID задач
-            issue_ids = []
-            found_issues = []
-            for res in results:
-                title = res.get("title", "")
-                rel_url = res.get("url") or ""
-                full_url = rel_url if rel_url.startswith("http") else f"{REDMINE_URL}{rel_url}"
-                m = re.search(r"/issues/(\d+)", full_url)
-                if m:
-                    issue_id = m.group(1)
-                    if issue_id not in issue_ids:
-                        issue_ids.append(issue_id)
-                        found_issues.append({
-                            "id": issue_id,
-                            "title": title,
-                            "url": full_url
-                        })
-
-            if not issue_ids:
-                return None
-
-            # === ПРОВЕРКА 0: Есть ли "Контроль" в найденных задачах? ===
-            for issue in found_issues:
-                if "контроль" in issue["title"].lower():
-                    return {
-                        "id": issue["id"],
-                        "subject": issue["title"],
-                        "url": issue["url"]
-                    }
-
-            # === ПРОХОД 1: Подзадачи найденных задач ===
-            for iid in issue_ids:
-                url_children = f"{REDMINE_URL}/issues.json?parent_id={iid}&status_id=*&limit=100"
-                async with session.get(url_children, headers=headers, ssl=False) as r:
-                    if r.status == 200:
-                        j = await r.json()
-                        for ch in j.get("issues", []):
-                            subj = (ch.get("subject") or "").strip()
-                            if "контроль" in subj.lower():
-                                return {
-                                    "id": str(ch["id"]),
-                                    "subject": subj,
-                                    "url": f"{REDMINE_URL}/issues/{ch['id']}"
-                                }
-
-            # === ПРОХОД 2: Подзадачи родителей ===
-            parent_ids = []
-            for iid in issue_ids:
-                issue_url = f"{REDMINE_URL}/issues/{iid}.json"
-                async with session.get(issue_url, headers=headers, ssl=False) as r:
-                    if r.status == 200:
-                        issue_data = await r.json()
-                        parent = (issue_data.get("issue") or {}).get("parent")
-                        if parent:
-                            pid = str(parent.get("id"))
-                            if pid and pid not in parent_ids:
-                                parent_ids.append(pid)
-
-            for pid in parent_ids:
-                url_pc = f"{REDMINE_URL}/issues.json?parent_id={pid}&status_id=*&limit=100"
-                async with session.get(url_pc, headers=headers, ssl=False) as r:
-                    if r.status == 200:
-                        j = await r.json()
-                        for ch in j.get("issues", []):
-                            subj = (ch.get("subject") or "").strip()
-                            if "контроль" in subj.lower():
-                                return {
-                                    "id": str(ch["id"]),
-                                    "subject": subj,
-                                    "url": f"{REDMINE_URL}/issues/{ch['id']}"
-                                }
-
-            # === ПРОХОД 3: Сам родитель ===
-            for pid in parent_ids:
-                parent_url = f"{REDMINE_URL}/issues/{pid}.json"
-                async with session.get(parent_url, headers=headers, ssl=False) as r:
-                    if r.status == 200:
-                        pd = await r.json()
-                        parent_issue = pd.get("issue") or {}
-                        parent_subject = (parent_issue.get("subject") or "").strip()
-                        if "контроль" in parent_subject.lower():
-                            return {
-                                "id": str(parent_issue["id"]),
-                                "subject": parent_subject,
-                                "url": f"{REDMINE_URL}/issues/{pid}"
-                            }
+            results = await redmine.search(serial, tree.api_key, limit=10)
+        except RedmineError:
+            return None
 
+        if not results:
             return None
 
-        except Exception as e:
-            logging.error(f"Ошибка find_control_task: {e}")
+        # Собираем ID задач
+        issue_ids = search_issue_ids(results)
+        if not issue_ids:
             return None
 
+        # === ПРОВЕРКА 0: Есть ли "Контроль" в найденных задачах? ===
+        for res in results:
+            title = res.get("title", "")
+            rel_url = res.get("url") or ""
+            full_url = rel_url if rel_url.startswith("http") else f"{REDMINE_URL}{rel_url}"
+            m = re.search(r"/issues/(\d+)", full_url)
+            if m and "контроль" in title.lower():
+                return {
+                    "id": m.group(1),
+                    "subject": title,
+                    "url": full_url
+                }
+
+        # === ПРОХОД 1: Подзадачи найденных задач ===
+        for children in await tree.children(issue_ids):
+            controls = control_tasks_in(children)
+            if controls:
+                return controls[0]
+
+        # === ПРОХОД 2: Подзадачи родителей ===
+        parent_ids = await tree.parent_ids(issue_ids)
+
+        for children in await tree.children(parent_ids):
+            controls = control_tasks_in(children)
+            if controls:
+                return controls[0]
+
+        # === ПРОХОД 3: Сам родитель ===
+        controls = control_tasks_in(await tree.issues(parent_ids))
+        if controls:
+            return controls[0]
+
+        return None
+
+    except Exception as e:
+        logging.error(f"Ошибка search_control_task: {e}")
+        return None
+
 # Функция поиска и скачивания ТЗ
 
-async def find_and_get_tz_file(issue_id: str, user_id: int) -> Optional[dict]:
+def latest_tz_attachment(issue: dict) -> Optional[dict]:
+    """Самый свежий ТЗ*.xlsx среди вложений задачи"""
+    tz_files = []
+    for att in issue.get("attachments", []):
+        filename = att.get("filename", "").strip()
+        if filename.upper().startswith("ТЗ") and filename.lower().endswith(".xlsx"):
+            file_url = att.get("content_url", "")
+            if not file_url.startswith("http"):
+                file_url = f"{REDMINE_URL}{file_url}"
+            
+            tz_files.append({
+                "filename": filename,
+                "file_url": file_url,
+                "id": att.get("id"),
+                "created_on": att.get("created_on", "")  # Дата создания
+            })
+    
+    if not tz_files:
+        return None
+    # Самый новый — с наибольшей датой создания
+    latest_tz = max(tz_files, key=lambda x: x.get("created_on", ""))
+    logging.info(f"Найден самый свежий файл ТЗ: {latest_tz['filename']} в задаче #{issue.get('id')}")
+    return latest_tz
+
+async def find_and_get_tz_file(issue_id: str, user_id: int, tree: Optional[IssueTree] = None) -> Optional[dict]:
     """
     Ищет самый свежий файл ТЗ*.xlsx в задаче контроля, если не находит — ищет в родительской задаче.
+    Задачи берутся из графа tree (include=children,attachments): родитель, уже раскрытый
+    при поиске задачи контроля, повторно не запрашивается.
     Возвращает: {"filename": "ТЗ_123.xlsx", "file_url": "https://..."} или None
     """
-    headers = {"X-Redmine-API-Key": get_user_api_token(user_id)}
-    
-    async def search_tz_in_issue(task_id: str) -> Optional[dict]:
-        """Ищет самый свежий ТЗ*.xlsx в конкретной задаче"""
-        url = f"{REDMINE_URL}/issues/{task_id}.json?include=attachments"
-        
-        try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url, headers=headers, ssl=False) as resp:
-                    if resp.status != 200:
-                        return None
-                    data = await resp.json()
-            
-            attachments = data.get("issue", {}).get("attachments", [])
-            
-            # Собираем все файлы ТЗ
-            tz_files = []
-            for att in attachments:
-                filename = att.get("filename", "").strip()
-                if filename.upper().startswith("ТЗ") and filename.lower().endswith(".xlsx"):
-                    file_url = att.get("content_url", "")
-                    if not file_url.startswith("http"):
-                        file_url = f"{REDMINE_URL}{file_url}"
-                    
-                    tz_files.append({
-                        "filename": filename,
-                        "file_url": file_url,
-                        "id": att.get("id"),
-                        "created_on": att.get("created_on", "")  # Дата создания
-                    })
-            
-            # Если найдены файлы ТЗ - возвращаем самый свежий
-            if tz_files:
-                # Сортируем по дате создания (самый новый - последний)
-                latest_tz = max(tz_files, key=lambda x: x.get("created_on", ""))
-                logging.info(f"Найден самый свежий файл ТЗ: {latest_tz['filename']} в задаче #{task_id}")
-                return latest_tz
-            
-            return None
-        
-        except Exception as e:
-            logging.error(f"Ошибка поиска ТЗ в задаче #{task_id}: {e}")
-            return None
+    if tree is None:
+        tree = redmine.issue_tree(get_user_api_token(user_id), REDMINE_FANOUT_LIMIT)
     
     try:
         # 1) Ищем в задаче контроля
-        tz_file = await search_tz_in_issue(issue_id)
+        tz_file = latest_tz_attachment(await tree.node(issue_id))
         if tz_file:
             return tz_file
         
         # 2) Если не нашли — ищем в родительской задаче
-        async with aiohttp.ClientSession() as session:
-            async with session.get(f"{REDMINE_URL}/issues/{issue_id}.json", headers=headers, ssl=False) as resp:
-                if resp.status != 200:
-                    return None
-                data = await resp.json()
-        
-        parent = data.get("issue", {}).get("parent")
-        if parent:
-            parent_id = str(parent.get("id"))
+        parent_id = tree.parent_of(issue_id)
+        if parent_id:
             logging.info(f"Задача контроля #{issue_id} имеет родителя #{parent_id}, ищу ТЗ там")
-            tz_file = await search_tz_in_issue(parent_id)
+            tz_file = latest_tz_attachment(await tree.node(parent_id))
             if tz_file:
                 return tz_file
         
         logging.warning(f"Файл ТЗ не найден ни в задаче #{issue_id}, ни в родительской")
         return None
     
+    except RedmineError as e:
+        logging.error(f"Ошибка поиска ТЗ в задаче #{issue_id}: {e}")
+        return None
     except Exception as e:
         logging.error(f"Ошибка find_and_get_tz_file: {e}")
         return None
 
 async def download_tz_file(file_url: str, filename: str, user_id: int) -> Optional[bytes]:
     """Скачивает файл ТЗ из Redmine"""
-    headers = {"X-Redmine-API-Key": get_user_api_token(user_id)}
-    
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(file_url, headers=headers, ssl=False) as resp:
-                if resp.status != 200:
-                    logging.error(f"Ошибка скачивания ТЗ: HTTP {resp.status}")
-                    return None
-                
-                file_data = await resp.read()
-                logging.info(f"Файл {filename} успешно скачан ({len(file_data)} байт)")
-                return file_data
+        file_data = await redmine.request("GET", file_url, get_user_api_token(user_id),
+                                          expect="bytes", timeout=redmine.upload_timeout)
+        logging.info(f"Файл {filename} успешно скачан ({len(file_data)} байт)")
+        return file_data
     
+    except RedmineError as e:
+        logging.error(f"Ошибка скачивания ТЗ: {e}")
+        return None
     except Exception as e:
         logging.error(f"Ошибка скачивания файла ТЗ: {e}")
         return None
 
+async def send_tz_file(message: types.Message, control_task_id: str, user_id: int,
+                       tree: Optional[IssueTree] = None):
+    """Ищет файл ТЗ для задачи контроля и отправляет его пользователю"""
+    tz_status_msg = await message.answer("⏳ Ищу файл ТЗ...")
+    
+    tz_file = await find_and_get_tz_file(control_task_id, user_id, tree)
+    
+    if tz_file:
+        # Скачиваем файл
+        file_data = await download_tz_file(tz_file["file_url"], tz_file["filename"], user_id)
+        
+        if file_data:
+            await tz_status_msg.delete()
+            
+            # Отправляем файл пользователю
+            from aiogram.types import BufferedInputFile
+            
+            document = BufferedInputFile(file_data, filename=tz_file["filename"])
+            await message.answer_document(
+                document=document,
+                #caption=f"📄 Техническое задание: {tz_file['filename']}"
+            )
+            logging.info(f"Файл ТЗ {tz_file['filename']} отправлен пользователю {user_id}")
+        else:
+            await tz_status_msg.edit_text("⚠️ Не удалось скачать файл ТЗ")
+    else:
+        await tz_status_msg.edit_text("📄 ТЗ не найдено")
+
+async def answer_serial(message: types.Message, state: FSMContext, res: AnalyzeResult, file_id: str, mime_type: str, status_msg: types.Message):
+    """Ответ на "." с распознанным S/N: задача контроля, BIOS, чек-лист, кнопка "ВЕРНО?" и ТЗ"""
+    # Несколько единиц на одном фото
+    if len(res.serials) > 1:
+        await status_msg.delete()
+        await answer_multiple_serials(message, state, res, file_id, mime_type)
+        return
+    
+    serial = res.serial
+    password = res.password
+    
+    # Поиск задачи контроля; граф задач пригодится и для поиска ТЗ
+    tree = redmine.issue_tree(get_user_api_token(message.from_user.id), REDMINE_FANOUT_LIMIT)
+    control_task = await find_control_task(serial, message.from_user.id, tree)
+    
+    if not control_task:
+        await status_msg.delete()
+        await message.answer(f"❌ Задача контроля для S/N {serial} не найдена.")
+        return
+    
+    # Удаляем сообщение "Распознаю..."
+    await status_msg.delete()
+    
+    # Сохраняем данные для callback
+    await state.update_data(
+        photo_id=file_id,
+        serial=serial,
+        password=password,
+        control_task_id=control_task["id"],
+        mime_type=mime_type
+    )
+    await remember_serial_confirmations(state, {
+        photo_key(file_id): {"photo_id": file_id, "serial": serial, "control_task_id": control_task["id"], "mime_type": mime_type}
+    })
+    
+    evangelion_serials = [
+       "PCPPP033000349", "PCPPP033000350", "PCPPP033000351", 
+       "PCPPP033000352", "PCPPP033000353", "PCPPP033000354", "PCPPP033000355"
+    ]
+    text = f"🔹 S/N: {serial}"
+    if res.corrected_from:
+        text += f"\n✏️ Исправлено по справочнику: {res.corrected_from} → {serial}"
+    if serial in evangelion_serials:
+        text += "\n🤮 Evangelion 🤮"
+    text += f"\n\n🔐 BIOS: {password}"
+    
+    if "CETOE2300" in serial.upper() or "CETOE2600" in serial.upper():
+        text += "\n⚠️ Напоминание: необходимо наклеить транспортировочные пломбы!"
+    
+    # === НОВАЯ ЛОГИКА: ПОЛУЧАЕМ ЧЕК-ЛИСТ ===
+    checklist_text = await get_checklist_for_serial(control_task["id"], serial, message.from_user.id)
+    if checklist_text:
+        text += f"\n\n{checklist_text}"
+    
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[
+        [
+            InlineKeyboardButton(text=control_task["id"], url=control_task["url"]),
+            InlineKeyboardButton(text="ВЕРНО?", callback_data=f"confirm_sn:{message.from_user.id}:{photo_key(file_id)}")
+        ]
+    ])
+    
+    await message.answer(text, reply_markup=keyboard)
+    
+    # === ПОИСК И ОТПРАВКА ТЗ ===
+    await send_tz_file(message, control_task["id"], message.from_user.id, tree)
+
+async def answer_multiple_serials(message: types.Message, state: FSMContext, res: AnalyzeResult, file_id: str, mime_type: str):
+    """
+    На одном фото несколько единиц оборудования (стеллаж, ряд юнитов).
+    Задачи контроля и чек-листы для всех S/N ищутся в Redmine параллельно,
+    по каждому S/N — отдельное сообщение со своей кнопкой "ВЕРНО?".
+    """
+    user_id = message.from_user.id
+    # Общий граф: единицы на одном фото обычно висят под одной задачей
+    tree = redmine.issue_tree(get_user_api_token(user_id), REDMINE_FANOUT_LIMIT)
+    
+    async def resolve(hit):
+        control_task = await find_control_task(hit.serial, user_id, tree)
+        checklist_text = None
+        if control_task:
+            checklist_text = await get_checklist_for_serial(control_task["id"], hit.serial, user_id)
+        return hit, control_task, checklist_text
+    
+    resolved = await asyncio.gather(*(resolve(hit) for hit in res.serials))
+    logging.info(f"[MULTI] На фото {len(resolved)} S/N: {[hit.serial for hit in res.serials]}")
+    
+    # Состояние сохраняем до отправки кнопок, чтобы "ВЕРНО?" не опередило запись
+    await state.update_data(photo_id=file_id, mime_type=mime_type)
+    await remember_serial_confirmations(state, {
+        f"{photo_key(file_id)}:{hit.serial}": {
+            "photo_id": file_id, "serial": hit.serial, "control_task_id": control_task["id"], "mime_type": mime_type
+        }
+        for hit, control_task, _ in resolved if control_task
+    })
+    
+    await message.answer(f"📷 На фото найдено S/N: {len(resolved)} шт.")
+    
+    task_ids = []
+    for hit, control_task, checklist_text in resolved:
+        if not control_task:
+            await message.answer(f"❌ Задача контроля для S/N {hit.serial} не найдена.")
+            continue
+        
+        text = f"🔹 S/N: {hit.serial}"
+        if hit.corrected_from:
+            text += f"\n✏️ Исправлено по справочнику: {hit.corrected_from} → {hit.serial}"
+        text += f"\n\n🔐 BIOS: {hit.password}"
+        if "CETOE2300" in hit.serial.upper() or "CETOE2600" in hit.serial.upper():
+            text += "\n⚠️ Напоминание: необходимо наклеить транспортировочные пломбы!"
+        if checklist_text:
+            text += f"\n\n{checklist_text}"
+        
+        keyboard = InlineKeyboardMarkup(inline_keyboard=[
+            [
+                InlineKeyboardButton(text=control_task["id"], url=control_task["url"]),
+                InlineKeyboardButton(text="ВЕРНО?", callback_data=f"confirm_sn:{user_id}:{photo_key(file_id)}:{hit.serial}")
+            ]
+        ])
+        await message.answer(text, reply_markup=keyboard)
+        
+        if control_task["id"] not in task_ids:
+            task_ids.append(control_task["id"])
+    
+    for task_id in task_ids:
+        await send_tz_file(message, task_id, user_id, tree)
+
+# Сколько неподтверждённых "ВЕРНО?" держать в FSM пользователя
+PENDING_CONFIRMATIONS_MAX = 20
+
+def photo_key(file_id: str) -> str:
+    """Короткий ключ фото для callback "ВЕРНО?": кнопка подтверждает именно своё фото"""
+    return hashlib.sha1(file_id.encode()).hexdigest()[:8]
+
+async def remember_serial_confirmations(state: FSMContext, entries: Dict[str, dict]):
+    """
+    Данные кнопок "ВЕРНО?" по ключу из callback (фото или фото:S/N): photo_id, serial,
+    control_task_id, mime_type. Ответы на разные фото (серия с разными S/N, фото с
+    несколькими S/N) не затирают друг друга; хранятся последние PENDING_CONFIRMATIONS_MAX.
+    """
+    data = await state.get_data()
+    pending = dict(data.get("pending_sn") or {})
+    pending.update(entries)
+    while len(pending) > PENDING_CONFIRMATIONS_MAX:
+        pending.pop(next(iter(pending)))
+    await state.update_data(pending_sn=pending)
+
+async def clear_confirmed_serial(state: FSMContext, key: str):
+    """Очищает FSM после "ВЕРНО?" — когда подтверждены все ожидающие кнопки"""
+    data = await state.get_data()
+    pending = dict(data.get("pending_sn") or {})
+    pending.pop(key, None)
+    if pending:
+        await state.update_data(pending_sn=pending)
+    else:
+        await state.clear()
+
 async def get_checklist_for_serial(issue_id: str, serial: str, user_id: int) -> Optional[str]:
     """
     Возвращает отформатированный чек-лист для конкретного серийника.
     Если все пункты отмечены → возвращает "✅ Данное оборудование прошло ОТК!"
     Если серийник не найден → возвращает None
     """
-    headers = {"X-Redmine-API-Key": get_user_api_token(user_id)}
-    url = f"{REDMINE_URL}/issues/{issue_id}/checklists.xml"
-    
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, headers=headers, ssl=False) as resp:
-                if resp.status != 200:
-                    return None
-                xml_text = await resp.text()
-        
-        root = ET.fromstring(xml_text)
-        checklist_items = []
-        
-        for cl in root.findall("checklist"):
-            checklist_items.append({
-                "subject": (cl.findtext("subject") or "").strip(),
-                "is_done": cl.findtext("is_done") or "0",
-            })
+        checklist = await redmine.get_checklist(issue_id, get_user_api_token(user_id))
         
-        # Найти блок серийника
-        serial_idx = None
-        for idx, item in enumerate(checklist_items):
-            subj = item["subject"]
-            if ("проверка оборудования" in subj.lower() and 
-                serial.upper() in subj.upper() and 
-                "указать" not in subj.lower()):
-                serial_idx = idx
-                break
-        
-        if serial_idx is None:
+        if checklist.block(serial) is None:
             # Серийник не найден в чек-листе
             return None
         
-        # Найти конец блока
-        block_end_idx = len(checklist_items) - 1
-        for idx in range(serial_idx + 1, len(checklist_items)):
-            subj_l = checklist_items[idx]["subject"].lower()
-            if "проверка оборудования" in subj_l:
-                block_end_idx = idx - 1
-                break
-        
         # Собираем пункты блока (без заголовков)
         checklist_lines = []
         all_checked = True
         
-        for idx in range(serial_idx + 1, block_end_idx + 1):
-            item = checklist_items[idx]
-            subj = item["subject"]
+        for item in checklist.block_items(serial):
+            subj = item.subject
             subj_l = subj.lower()
-            is_done = item["is_done"] in ("1", "true")
+            is_done = item.is_done
             
             # Пропускаем заголовки
             if ("проверка оборудования" in subj_l or 
@@ -1098,18 +1785,14 @@ async def handle_defect_photo(message: types.Message, state: FSMContext):
     photo = message.photo[-1]
     
     # Валидация задачи
-    headers = {"X-Redmine-API-Key": get_user_api_token(message.from_user.id)}
-    
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(
-                f"{REDMINE_URL}/issues/{issue_id}.json",
-                headers=headers,
-                ssl=False
-            ) as resp:
-                if resp.status != 200:
-                    await message.answer(f"❌ Задача #{issue_id} не найдена или нет доступа")
-                    return
+        await redmine.get_issue(issue_id, get_user_api_token(message.from_user.id))
+    except RedmineError as e:
+        if e.status in (403, 404):
+            await message.answer(f"❌ Задача #{issue_id} не найдена или нет доступа")
+        else:
+            await message.answer(f"❌ Ошибка проверки задачи: {e}")
+        return
     except Exception as e:
         await message.answer(f"❌ Ошибка проверки задачи: {e}")
         return
@@ -1160,113 +1843,66 @@ async def test_defects_command(message: types.Message):
             f"{d['code']}: {d['description']}" 
             for d in DEFECTS[:5]
         ])
-    )
-
-@dp.message(lambda msg: msg.photo)
-async def handle_photo(message: types.Message, state: FSMContext):
-    """Фото (Telegram сжимает). OCR -> логика по подписи."""
-    photo = message.photo[-1]
-    caption = (message.caption or "").strip()
-
-    # === СЦЕНАРИЙ 1: Фото + "." → поиск задачи контроля ===
-    if caption == ".":
-        status_msg = await message.answer("⏳ Распознаю серийный номер...")
-        
-        # OCR
-        img_bytes = await download_file_bytes(photo.file_id)
-        async with OCR_SEMAPHORE:
-            res: AnalyzeResult = await asyncio.to_thread(sn_service.analyze_bytes, img_bytes)
-        
-        if not res.found:
-            await status_msg.delete()
-            await message.answer("❌ Серийный номер на фото не распознан.")
-            return
-        
-        serial = res.serial
-        password = res.password
-        
-        # Поиск задачи контроля
-        control_task = await find_control_task(serial, message.from_user.id)
-        
-        if not control_task:
-            await status_msg.delete()
-            await message.answer(f"❌ Задача контроля для S/N {serial} не найдена.")
-            return
-        
-        # Удаляем сообщение "Распознаю..."
-        await status_msg.delete()
-        
-        # Сохраняем данные для callback
-        await state.update_data(
-            photo_id=photo.file_id,
-            serial=serial,
-            password=password,
-            control_task_id=control_task["id"],
-            mime_type="image/jpeg"
-        )
-        
-        evangelion_serials = [
-           "PCPPP033000349", "PCPPP033000350", "PCPPP033000351", 
-           "PCPPP033000352", "PCPPP033000353", "PCPPP033000354", "PCPPP033000355"
-        ]
-        text = f"🔹 S/N: {serial}"
-        if serial in evangelion_serials:
-            text += "\n🤮 Evangelion 🤮"
-        text += f"\n\n🔐 BIOS: {password}"
-        
-        if "CETOE2300" in serial.upper() or "CETOE2600" in serial.upper():
-            text += "\n⚠️ Напоминание: необходимо наклеить транспортировочные пломбы!"
-        
-        # === НОВАЯ ЛОГИКА: ПОЛУЧАЕМ ЧЕК-ЛИСТ ===
-        checklist_text = await get_checklist_for_serial(control_task["id"], serial, message.from_user.id)
-        if checklist_text:
-            text += f"\n\n{checklist_text}"
-        
-        keyboard = InlineKeyboardMarkup(inline_keyboard=[
-            [
-                InlineKeyboardButton(text=control_task["id"], url=control_task["url"]),
-                InlineKeyboardButton(text="ВЕРНО?", callback_data=f"confirm_sn:{message.from_user.id}")
-            ]
-        ])
-        
-        await message.answer(text, reply_markup=keyboard)
+    )
+
+@dp.message(Command("ocr_stats"))
+async def ocr_stats_command(message: types.Message):
+    """Сводка по времени этапов OCR с момента запуска"""
+    roi = sn_service.roi_priors.stats()
+    checklists = redmine.checklists.stats()
+    await message.answer(
+        f"📊 OCR: {ocr_stats.summary()}\n\n"
+        f"🎯 ROI-подсказки: попаданий {roi['hits']} из {roi['attempts']} "
+        f"(hit rate {roi['hit_rate']}), активных {roi['active']}\n"
+        f"📚 Справочник S/N: {serial_lexicon.stats()}\n"
+        f"🗂 Кэш чек-листов: сэкономлено GET {checklists['saved_gets']}, запросов {checklists['fetches']} "
+        f"(hit rate {checklists['hit_rate']}), задач в кэше {checklists['issues']}\n"
+        f"🗄 Индекс S/N: {serial_index.stats()}\n"
+        f"🪞 Зеркало Redmine: {redmine_mirror.stats()}\n"
+        f"📤 Потоковые загрузки: {redmine.upload_counters}\n"
+        f"🖼 Кэш файлов Telegram: {tg_files.stats()}"
+    )
+
+@dp.message(lambda msg: msg.photo)
+async def handle_photo(message: types.Message, state: FSMContext):
+    """Фото (Telegram сжимает). OCR -> логика по подписи."""
+    photo = message.photo[-1]
+    caption = (message.caption or "").strip()
+    mode = "." if caption == "." else ("Х" if caption.upper() == "Х" else None)
+    
+    # Кадр альбома или повторное фото той же этикетки — добавляем к идущей серии.
+    # Если на кадре окажется другой S/N, серия вернёт его результат — отвечаем на это сообщение
+    series = None
+    if mode or message.media_group_id:
+        verdict = burst_collector.join(BurstCollector.key_for(message, mode), photo.file_id)
+        if verdict is not None:
+            series = await verdict
+            if series is None:
+                return
+
+    # === СЦЕНАРИЙ 1: Фото + "." → поиск задачи контроля ===
+    if caption == ".":
+        burst = None if series else burst_collector.start(BurstCollector.key_for(message, mode), photo.file_id)
+        status_msg = await message.answer("⏳ Распознаю серийный номер...")
         
-        # === ПОИСК И ОТПРАВКА ТЗ ===
-        tz_status_msg = await message.answer("⏳ Ищу файл ТЗ...")
+        # OCR (с консенсусом по кадрам серии)
+        res, file_id = series or await consensus_ocr(burst, message.from_user.id)
         
-        tz_file = await find_and_get_tz_file(control_task["id"], message.from_user.id)
+        if not res.found:
+            await status_msg.delete()
+            await message.answer("❌ Серийный номер на фото не распознан.")
+            return
         
-        if tz_file:
-            # Скачиваем файл
-            file_data = await download_tz_file(tz_file["file_url"], tz_file["filename"], message.from_user.id)
-            
-            if file_data:
-                await tz_status_msg.delete()
-                
-                # Отправляем файл пользователю
-                from aiogram.types import BufferedInputFile
-                
-                document = BufferedInputFile(file_data, filename=tz_file["filename"])
-                await message.answer_document(
-                    document=document,
-                    #caption=f"📄 Техническое задание: {tz_file['filename']}"
-                )
-                logging.info(f"Файл ТЗ {tz_file['filename']} отправлен пользователю {message.from_user.id}")
-            else:
-                await tz_status_msg.edit_text("⚠️ Не удалось скачать файл ТЗ")
-        else:
-            await tz_status_msg.edit_text("📄 ТЗ не найдено")
-
+        await answer_serial(message, state, res, file_id, "image/jpeg", status_msg)
         return
 
     # === СЦЕНАРИЙ 1.5: Фото + "Х" (русская) → последнее фото для оборудования ===
     if caption.upper() == "Х":
+        burst = None if series else burst_collector.start(BurstCollector.key_for(message, mode), photo.file_id)
         status_msg = await message.answer("⏳ Распознаю серийный номер...")
         
-        # OCR
-        img_bytes = await download_file_bytes(photo.file_id)
-        async with OCR_SEMAPHORE:
-            res: AnalyzeResult = await asyncio.to_thread(sn_service.analyze_bytes, img_bytes)
+        # OCR (с консенсусом по кадрам серии)
+        res, file_id = series or await consensus_ocr(burst, message.from_user.id, single=True)
         
         if not res.found:
             await status_msg.delete()
@@ -1288,7 +1924,7 @@ async def handle_photo(message: types.Message, state: FSMContext):
         
         # Сохраняем данные для callback с флагом "final_photo"
         await state.update_data(
-            photo_id=photo.file_id,
+            photo_id=file_id,
             serial=serial,
             password=password,
             control_task_id=control_task["id"],
@@ -1326,87 +1962,39 @@ async def handle_image_document(message: types.Message, state: FSMContext):
     """Документ-картинка (оригинал). Та же логика."""
     doc = message.document
     caption = (message.caption or "").strip()
+    mode = "." if caption == "." else ("Х" if caption.upper() == "Х" else None)
+    
+    # Кадр альбома или повторный снимок той же этикетки — добавляем к идущей серии.
+    # Если на кадре окажется другой S/N, серия вернёт его результат — отвечаем на это сообщение
+    series = None
+    if mode or message.media_group_id:
+        verdict = burst_collector.join(BurstCollector.key_for(message, mode), doc.file_id)
+        if verdict is not None:
+            series = await verdict
+            if series is None:
+                return
 
     # === СЦЕНАРИЙ 1: Документ + "." ===
     if caption == ".":
+        burst = None if series else burst_collector.start(BurstCollector.key_for(message, mode), doc.file_id)
         status_msg = await message.answer("⏳ Распознаю серийный номер...")
         
-        img_bytes = await download_file_bytes(doc.file_id)
-        async with OCR_SEMAPHORE:
-            res: AnalyzeResult = await asyncio.to_thread(sn_service.analyze_bytes, img_bytes)
+        res, file_id = series or await consensus_ocr(burst, message.from_user.id)
         
         if not res.found:
             await status_msg.delete()
             await message.answer("❌ Серийный номер на фото не распознан.")
             return
         
-        serial = res.serial
-        password = res.password
-        
-        control_task = await find_control_task(serial, message.from_user.id)
-        
-        if not control_task:
-            await status_msg.delete()
-            await message.answer(f"❌ Задача контроля для S/N {serial} не найдена.")
-            return
-        
-        await status_msg.delete()
-        
-        await state.update_data(
-            photo_id=doc.file_id,
-            serial=serial,
-            password=password,
-            control_task_id=control_task["id"],
-            mime_type=doc.mime_type
-        )
-        
-        text = f"🔹 S/N: {serial}\n\n🔐 BIOS: {password}"
-        
-        if "CETOE2300" in serial.upper() or "CETOE2600" in serial.upper():
-            text += "\n⚠️ Напоминание: необходимо наклеить транспортировочные пломбы!"
-        
-        keyboard = InlineKeyboardMarkup(inline_keyboard=[
-            [
-                InlineKeyboardButton(text=control_task["id"], url=control_task["url"]),
-                InlineKeyboardButton(text="ВЕРНО?", callback_data=f"confirm_sn:{message.from_user.id}")
-            ]
-        ])
-        
-        await message.answer(text, reply_markup=keyboard)
-        
-        # === НОВАЯ ЛОГИКА: ПОИСК И ОТПРАВКА ТЗ ===
-        tz_status_msg = await message.answer("⏳ Ищу файл ТЗ...")
-        
-        tz_file = await find_and_get_tz_file(control_task["id"], message.from_user.id)
-        
-        if tz_file:
-            file_data = await download_tz_file(tz_file["file_url"], tz_file["filename"], message.from_user.id)
-            
-            if file_data:
-                await tz_status_msg.delete()
-                
-                from aiogram.types import BufferedInputFile
-                
-                document = BufferedInputFile(file_data, filename=tz_file["filename"])
-                await message.answer_document(
-                    document=document,
-                    #caption=f"📄 Техническое задание: {tz_file['filename']}"
-                )
-                logging.info(f"Файл ТЗ {tz_file['filename']} отправлен пользователю {message.from_user.id}")
-            else:
-                await tz_status_msg.edit_text("⚠️ Не удалось скачать файл ТЗ")
-        else:
-            await tz_status_msg.edit_text("📄 ТЗ не найдено")
-        
+        await answer_serial(message, state, res, file_id, doc.mime_type, status_msg)
         return
 
     # === СЦЕНАРИЙ 1.5: Документ + "Х" ===
     if caption.upper() == "Х":
+        burst = None if series else burst_collector.start(BurstCollector.key_for(message, mode), doc.file_id)
         status_msg = await message.answer("⏳ Распознаю серийный номер...")
         
-        img_bytes = await download_file_bytes(doc.file_id)
-        async with OCR_SEMAPHORE:
-            res: AnalyzeResult = await asyncio.to_thread(sn_service.analyze_bytes, img_bytes)
+        res, file_id = series or await consensus_ocr(burst, message.from_user.id, single=True)
         
         if not res.found:
             await status_msg.delete()
@@ -1426,7 +2014,7 @@ async def handle_image_document(message: types.Message, state: FSMContext):
         await status_msg.delete()
         
         await state.update_data(
-            photo_id=doc.file_id,
+            photo_id=file_id,
             serial=serial,
             password=password,
             control_task_id=control_task["id"],
@@ -1462,6 +2050,39 @@ async def handle_image_document(message: types.Message, state: FSMContext):
     await message.answer("Укажи номер задачи (цифрами), '.' для автопоиска или 'Х' для последнего фото.")
 
 
+@dp.message(lambda m: (m.caption or "").strip() == "." and (
+    m.video or m.animation or (m.document and (m.document.mime_type or "").startswith("video/"))))
+async def handle_video(message: types.Message, state: FSMContext):
+    """
+    Видео / анимация + ".": S/N ищется на самых резких кадрах ролика.
+    Кадр с S/N отправляется пользователю фотографией — её и прикрепит "ВЕРНО?", а не ролик
+    (ролик — только если кадр не удалось закодировать).
+    """
+    media = message.video or message.animation or message.document
+    if media.file_size and media.file_size > VIDEO_MAX_SIZE_MB * 1024 * 1024:
+        await message.answer(f"❌ Видео больше {VIDEO_MAX_SIZE_MB} МБ — Telegram не отдаёт такие файлы ботам. Сними ролик короче.")
+        return
+    
+    status_msg = await message.answer("⏳ Ищу серийный номер на видео...")
+    res = await run_video_ocr(media.file_id)
+    
+    if not res.found:
+        await status_msg.delete()
+        await message.answer("❌ Серийный номер на видео не распознан.")
+        return
+    
+    if res.frame_jpeg is None:
+        # Кадр не закодировался в JPEG — прикрепляем сам ролик
+        await answer_serial(message, state, res, media.file_id,
+                            media.mime_type or "video/mp4", status_msg)
+        return
+    
+    frame_msg = await message.answer_photo(
+        types.BufferedInputFile(res.frame_jpeg, filename="frame.jpg"),
+        caption="🎞 Кадр с S/N — он будет прикреплён к задаче"
+    )
+    await answer_serial(message, state, res, frame_msg.photo[-1].file_id, "image/jpeg", status_msg)
+
 @dp.message(UploadPhoto.waiting_for_issue)
 async def process_issue_number(message: types.Message, state: FSMContext):
     """Пользователь ввёл номер задачи после фото."""
@@ -1480,8 +2101,7 @@ async def process_issue_number(message: types.Message, state: FSMContext):
         status_msg = await message.answer("⏳ Распознаю серийный номер...")
         
         img_bytes = await download_file_bytes(file_id)
-        async with OCR_SEMAPHORE:
-            res: AnalyzeResult = await asyncio.to_thread(sn_service.analyze_bytes, img_bytes)
+        res: AnalyzeResult = await run_ocr(img_bytes, message.from_user.id, single=True)
         
         if not res.found:
             await status_msg.delete()
@@ -1492,7 +2112,8 @@ async def process_issue_number(message: types.Message, state: FSMContext):
         serial = res.serial
         password = res.password
         
-        control_task = await find_control_task(serial, message.from_user.id)
+        tree = redmine.issue_tree(get_user_api_token(message.from_user.id), REDMINE_FANOUT_LIMIT)
+        control_task = await find_control_task(serial, message.from_user.id, tree)
         
         if not control_task:
             await status_msg.delete()
@@ -1507,6 +2128,10 @@ async def process_issue_number(message: types.Message, state: FSMContext):
             password=password,
             control_task_id=control_task["id"]
         )
+        await remember_serial_confirmations(state, {
+            photo_key(file_id): {"photo_id": file_id, "serial": serial, "control_task_id": control_task["id"],
+                                 "mime_type": data.get("mime_type", "image/jpeg")}
+        })
         
         text = f"🔹 S/N: {serial}\n\n🔐 BIOS: {password}"
         
@@ -1521,35 +2146,14 @@ async def process_issue_number(message: types.Message, state: FSMContext):
         keyboard = InlineKeyboardMarkup(inline_keyboard=[
             [
                 InlineKeyboardButton(text=control_task["id"], url=control_task["url"]),
-                InlineKeyboardButton(text="ВЕРНО?", callback_data=f"confirm_sn:{message.from_user.id}")
+                InlineKeyboardButton(text="ВЕРНО?", callback_data=f"confirm_sn:{message.from_user.id}:{photo_key(file_id)}")
             ]
         ])
         
         await message.answer(text, reply_markup=keyboard)
         
         # === ПОИСК И ОТПРАВКА ТЗ ===
-        tz_status_msg = await message.answer("⏳ Ищу файл ТЗ...")
-        
-        tz_file = await find_and_get_tz_file(control_task["id"], message.from_user.id)
-        
-        if tz_file:
-            file_data = await download_tz_file(tz_file["file_url"], tz_file["filename"], message.from_user.id)
-            
-            if file_data:
-                await tz_status_msg.delete()
-                
-                from aiogram.types import BufferedInputFile
-                
-                document = BufferedInputFile(file_data, filename=tz_file["filename"])
-                await message.answer_document(
-                    document=document,
-                    #caption=f"📄 Техническое задание: {tz_file['filename']}"
-                )
-                logging.info(f"Файл ТЗ {tz_file['filename']} отправлен пользователю {message.from_user.id}")
-            else:
-                await tz_status_msg.edit_text("⚠️ Не удалось скачать файл ТЗ")
-        else:
-            await tz_status_msg.edit_text("📄 ТЗ не найдено")
+        await send_tz_file(message, control_task["id"], message.from_user.id, tree)
 
         return
     
@@ -1566,8 +2170,7 @@ async def process_issue_number(message: types.Message, state: FSMContext):
         status_msg = await message.answer("⏳ Распознаю серийный номер...")
         
         img_bytes = await download_file_bytes(file_id)
-        async with OCR_SEMAPHORE:
-            res: AnalyzeResult = await asyncio.to_thread(sn_service.analyze_bytes, img_bytes)
+        res: AnalyzeResult = await run_ocr(img_bytes, message.from_user.id, single=True)
         
         if not res.found:
             await status_msg.delete()
@@ -1640,93 +2243,42 @@ async def upload_photo_to_redmine(message: types.Message, issue_id: str, photo:
         logging.info(f"API токен (первые 10 символов): {api_token[:10]}...")
         logging.info(f"Загружаю фото в задачу #{issue_id}")
         
-        file = await bot.get_file(photo.file_id)
-        file_url = f"https://api.telegram.org/file/bot{TELEGRAM_TOKEN}/{file.file_path}"
-        filename = file.file_path.split("/")[-1]
-
-        async with aiohttp.ClientSession() as session:
-            async with session.get(file_url, ssl=False) as resp:
-                photo_data = await resp.read()
-                logging.info(f"Размер фото: {len(photo_data)} байт")
+        # Файл идёт из Telegram в /uploads.json потоком
+        try:
+            token, filename = await upload_telegram_file(photo.file_id, api_token)
+        except RedmineError as e:
+            logging.error(f"Redmine вернул ошибку при загрузке фото: {e}")
+            logging.error(f"Ответ сервера (первые 500 символов): {e.body[:500]}")
+            await message.answer(f"❌ Ошибка загрузки фото в Redmine: HTTP {e.status}")
+            return
+        except (ValueError, KeyError, TypeError) as e:
+            # Вместо JSON с токеном пришла HTML-страница (например, логин при неверном токене)
+            logging.error(f"Redmine вернул неожиданный ответ на загрузку: {e}")
+            await message.answer("❌ Ошибка: Redmine вернул неожиданный формат. Проверь API токен!")
+            return
+        logging.info(f"✅ Получен токен загрузки: {token[:20]}...")
 
-            upload_url = f"{REDMINE_URL}/uploads.json"
-            headers = {
-                "X-Redmine-API-Key": api_token,
-                "Content-Type": "application/octet-stream",
-            }
+        logging.info(f"Прикрепляю фото к задаче #{issue_id}")
+        try:
+            await redmine.attach(issue_id, api_token, token, filename, mime_type or "application/octet-stream")
+        except RedmineError as e:
+            logging.error(f"Не удалось прикрепить фото к задаче: {e}")
+            await message.answer(f"❌ Ошибка прикрепления фото: HTTP {e.status}")
+            return
+        logging.info(f"✅ Фото успешно прикреплено к задаче #{issue_id}")
 
-            logging.info(f"Отправляю POST запрос в Redmine: {upload_url}")
-            
-            async with session.post(upload_url, headers=headers, data=photo_data, ssl=False) as resp:
-                logging.info(f"Получен ответ от Redmine: HTTP {resp.status}")
-                logging.info(f"Content-Type ответа: {resp.headers.get('Content-Type', 'неизвестно')}")
-                
-                # ПРОВЕРКА СТАТУСА:
-                if resp.status not in (200, 201):
-                    error_text = await resp.text()
-                    logging.error(f"Redmine вернул ошибку!")
-                    logging.error(f"HTTP статус: {resp.status}")
-                    logging.error(f"Ответ сервера (первые 500 символов):")
-                    logging.error(error_text[:500])
-                    await message.answer(f"❌ Ошибка загрузки фото в Redmine: HTTP {resp.status}")
-                    return
-                
-                # Проверяем content-type перед парсингом JSON:
-                content_type = resp.headers.get('Content-Type', '')
-                if 'application/json' not in content_type:
-                    error_text = await resp.text()
-                    logging.error(f"Redmine вернул HTML вместо JSON!")
-                    logging.error(f"Content-Type: {content_type}")
-                    logging.error(f"Ответ (первые 500 символов):")
-                    logging.error(error_text[:500])
-                    await message.answer("❌ Ошибка: Redmine вернул неожиданный формат. Проверь API токен!")
-                    return
-                
-                upload_info = await resp.json()
-                token = upload_info["upload"]["token"]
-                logging.info(f"✅ Получен токен загрузки: {token[:20]}...")
-
-            ct = mime_type or "application/octet-stream"
-            payload = {
-                "issue": {
-                    "uploads": [{"token": token, "filename": filename, "content_type": ct}]
+        # Сохраняем для /d
+        try:
+            issue = await redmine.get_issue(issue_id, api_token, include="attachments")
+        except RedmineError as e:
+            logging.warning(f"Не удалось получить вложения задачи #{issue_id}: {e}")
+        else:
+            attachments = issue.get("attachments", [])
+            if attachments:
+                last_uploaded[message.from_user.id] = {
+                    "issue_id": issue_id,
+                    "attachment_id": str(attachments[-1]["id"])
                 }
-            }
-
-            logging.info(f"Прикрепляю фото к задаче #{issue_id}")
-            
-            async with session.put(
-                f"{REDMINE_URL}/issues/{issue_id}.json",
-                headers={"X-Redmine-API-Key": api_token, "Content-Type": "application/json"},
-                json=payload,
-                ssl=False
-            ) as resp:
-                logging.info(f"Ответ на прикрепление: HTTP {resp.status}")
-                
-                if resp.status not in (200, 204):
-                    error_text = await resp.text()
-                    logging.error(f"Не удалось прикрепить фото к задаче")
-                    logging.error(f"HTTP статус: {resp.status}")
-                    logging.error(f"Ответ: {error_text[:500]}")
-                    await message.answer(f"❌ Ошибка прикрепления фото: HTTP {resp.status}")
-                    return
-                
-                logging.info(f"✅ Фото успешно прикреплено к задаче #{issue_id}")
-
-            # Сохраняем для /d
-            async with session.get(
-                f"{REDMINE_URL}/issues/{issue_id}.json?include=attachments", 
-                headers=headers, 
-                ssl=False
-            ) as resp2:
-                if resp2.status == 200:
-                    issue_data = await resp2.json()
-                    attachments = issue_data.get("issue", {}).get("attachments", [])
-                    if attachments:
-                        last_uploaded[message.from_user.id] = {
-                            "issue_id": issue_id,
-                            "attachment_id": str(attachments[-1]["id"])
-                        }
 
     except Exception as e:
         logging.error(f"Исключение в upload_photo_to_redmine: {e}", exc_info=True)
@@ -1734,41 +2286,27 @@ async def upload_photo_to_redmine(message: types.Message, issue_id: str, photo:
 
 # ===================== Обновление чек-листа: первый шаг =====================
 
-async def update_checklist_first_step(issue_id: str, serial: str, start_idx: int, checklist_items: list, user_id: int):
+async def update_checklist_first_step(issue_id: str, serial: str, start_idx: int, checklist_items: Checklist, user_id: int):
     """
     1. Переименовать пункт start_idx
     2. Поставить галочку на следующий пункт "Визуальный осмотр..."
     """
-    headers = {"X-Redmine-API-Key": get_user_api_token(user_id)}
+    api_key = get_user_api_token(user_id)
     
     try:
-        async with aiohttp.ClientSession() as session:
-            # Переименовать
-            item = checklist_items[start_idx]
-            checklist_el = ET.Element("checklist")
-            ET.SubElement(checklist_el, "id").text = str(item["id"])
-            ET.SubElement(checklist_el, "issue_id").text = str(item["issue_id"])
-            ET.SubElement(checklist_el, "subject").text = f"Проверка оборудования {serial}"
-            #ET.SubElement(checklist_el, "position").text = str(item["position"])
-            
-            payload = ET.tostring(checklist_el, encoding="utf-8", method="xml")
-            async with session.put(f"{REDMINE_URL}/checklists/{item['id']}.xml", headers={**headers, "Content-Type": "application/xml"}, data=payload, ssl=False):
-                pass
-            
-            # Поставить галочку на следующий
-            if start_idx + 1 < len(checklist_items):
-                next_item = checklist_items[start_idx + 1]
-                if "визуальный осмотр" in next_item["subject"].lower():
-                    checklist_el = ET.Element("checklist")
-                    ET.SubElement(checklist_el, "id").text = str(next_item["id"])
-                    ET.SubElement(checklist_el, "issue_id").text = str(next_item["issue_id"])
-                    ET.SubElement(checklist_el, "subject").text = next_item["subject"]
-                    ET.SubElement(checklist_el, "is_done").text = "1"
-                    #ET.SubElement(checklist_el, "position").text = str(next_item["position"])
-                    
-                    payload = ET.tostring(checklist_el, encoding="utf-8", method="xml")
-                    async with session.put(f"{REDMINE_URL}/checklists/{next_item['id']}.xml", headers={**headers, "Content-Type": "application/xml"}, data=payload, ssl=False):
-                        pass
+        # Переименовать
+        item = checklist_items[start_idx]
+        await redmine.update_checklist_item(
+            item.id, api_key, subject=f"Проверка оборудования {serial}", issue_id=item.issue_id or issue_id
+        )
+        learn_serials(serial)
+        serial_index.remember([serial], issue_id, "checklist")
+        
+        # Поставить галочку на следующий
+        if start_idx + 1 < len(checklist_items):
+            next_item = checklist_items[start_idx + 1]
+            if "визуальный осмотр" in next_item.subject.lower():
+                await set_checklist_item_done(next_item, api_key, issue_id)
     
     except Exception as e:
         logging.error(f"Ошибка update_checklist_first_step: {e}")
@@ -1822,21 +2360,17 @@ async def complete_check_callback(callback: CallbackQuery):
         # 3) Если все отмечены → обновить поля + сменить статус
         if all_complete:
             from config import STATUS_DONE
-            headers = {
-                "X-Redmine-API-Key": get_user_api_token(user_id),
-                "Content-Type": "application/json"
-            }
+            api_key = get_user_api_token(user_id)
             
             # Получаем текущие значения полей
-            async with aiohttp.ClientSession() as session:
-                async with session.get(f"{REDMINE_URL}/issues/{issue_id}.json", headers=headers, ssl=False) as resp:
-                    if resp.status != 200:
-                        logging.error(f"Ошибка получения задачи: HTTP {resp.status}")
-                        return
-                    issue_data = await resp.json()
+            try:
+                issue_data = await redmine.get_issue(issue_id, api_key)
+            except RedmineError as e:
+                logging.error(f"Ошибка получения задачи: {e}")
+                return
             
             custom_fields_to_update = []
-            current_fields = issue_data.get("issue", {}).get("custom_fields", [])
+            current_fields = issue_data.get("custom_fields", [])
             
             # === Поле "Серийный номер" (id=11) ===
             serial_number_field = next((f for f in current_fields if f.get("id") == 11), None)
@@ -1857,34 +2391,21 @@ async def complete_check_callback(callback: CallbackQuery):
                 custom_fields_to_update.append({"id": 150, "value": str(equipment_count)})
             
             # Формируем запрос
-            payload = {
-                "issue": {
-                    "status_id": STATUS_DONE
-                }
-            }
+            fields = {"status_id": STATUS_DONE}
             
             if custom_fields_to_update:
-                payload["issue"]["custom_fields"] = custom_fields_to_update
+                fields["custom_fields"] = custom_fields_to_update
             
-            logging.info(f"Отправляем PUT запрос: {payload}")
+            logging.info(f"Отправляем PUT запрос: {fields}")
             
-            async with aiohttp.ClientSession() as session:
-                async with session.put(
-                    f"{REDMINE_URL}/issues/{issue_id}.json",
-                    headers=headers,
-                    json=payload,
-                    ssl=False
-                ) as resp:
-                    status = resp.status
-                    response_text = await resp.text()
-                    logging.info(f"Ответ Redmine: HTTP {status}, {response_text}")
-                    
-                    if status not in (200, 204):
-                        logging.error(f"Ошибка смены статуса: HTTP {status}, {response_text}")
-                        await bot.send_message(
-                            callback.from_user.id,
-                            f"⚠️ Ошибка смены статуса: HTTP {status}"
-                        )
+            try:
+                await redmine.update_issue(issue_id, api_key, fields)
+            except RedmineError as e:
+                logging.error(f"Ошибка смены статуса: {e}")
+                await bot.send_message(
+                    callback.from_user.id,
+                    f"⚠️ Ошибка смены статуса: HTTP {e.status}"
+                )
                         
         # Пересчитываем процент готовности
         await recalculate_done_ratio(issue_id, user_id)
@@ -1920,8 +2441,7 @@ async def mark_remaining_checklist_items(issue_id: str, serial: str, user_id: in
     
     Возвращает количество отмеченных пунктов.
     """
-    headers = {"X-Redmine-API-Key": get_user_api_token(user_id)}
-    url = f"{REDMINE_URL}/issues/{issue_id}/checklists.xml"
+    api_key = get_user_api_token(user_id)
     
     # Список пунктов для автоотметки (частичное совпадение)
     target_keywords = [
@@ -1940,95 +2460,46 @@ async def mark_remaining_checklist_items(issue_id: str, serial: str, user_id: in
     ]
     
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, headers=headers, ssl=False) as resp:
-                if resp.status != 200:
-                    return 0
-                xml_text = await resp.text()
-        
-        root = ET.fromstring(xml_text)
-        checklist_items = []
-        for cl in root.findall("checklist"):
-            checklist_items.append({
-                "id": cl.findtext("id"),
-                "subject": (cl.findtext("subject") or "").strip(),
-                "is_done": cl.findtext("is_done") or "0",
-                "position": cl.findtext("position") or "0",
-                "issue_id": cl.findtext("issue_id") or issue_id,
-            })
-        
-        # Найти индекс блока серийника
-        serial_idx = None
-        for idx, item in enumerate(checklist_items):
-            subj = item["subject"]
-            if ("проверка оборудования" in subj.lower() and 
-                serial.upper() in subj.upper() and 
-                "указать" not in subj.lower()):
-                serial_idx = idx
-                break
+        checklist = await redmine.get_checklist(issue_id, api_key)
         
-        if serial_idx is None:
+        block = checklist.block(serial)
+        if block is None:
             return 0
         
-        # Найти конец блока
-        block_end_idx = len(checklist_items) - 1
-        for idx in range(serial_idx + 1, len(checklist_items)):
-            subj_l = checklist_items[idx]["subject"].lower()
-            if ("проверка оборудования" in subj_l and 
-                serial.upper() not in checklist_items[idx]["subject"].upper()):
-                block_end_idx = idx - 1
-                break
-        
         # Отметить пункты из списка target_keywords
-        marked = 0
-        async with aiohttp.ClientSession() as session:
-            for idx in range(serial_idx, block_end_idx + 1):
-                item = checklist_items[idx]
-                subj_l = item["subject"].lower()
-                
-                # Пропустить заголовки
-                if ("проверка оборудования" in subj_l or 
-                    "комплектация оборудования" in subj_l or 
-                    "выдача готового" in subj_l or
-                    "переместить изделие в изолятор брака" in subj_l):
-                    continue
-                
-                # Пропустить уже отмеченные
-                if item["is_done"] in ("1", "true"):
-                    continue
-                
-                # Проверить: входит ли в список для автоотметки?
-                should_mark = False
-                for keyword in target_keywords:
-                    if keyword in subj_l:
-                        should_mark = True
-                        break
-                
-                if not should_mark:
-                    continue
-                
-                # Отметить пункт
-                checklist_el = ET.Element("checklist")
-                ET.SubElement(checklist_el, "id").text = str(item["id"])
-                ET.SubElement(checklist_el, "issue_id").text = str(item["issue_id"])
-                ET.SubElement(checklist_el, "subject").text = item["subject"]
-                ET.SubElement(checklist_el, "is_done").text = "1"
-                #ET.SubElement(checklist_el, "position").text = str(item["position"])
-                
-                payload = ET.tostring(checklist_el, encoding="utf-8", method="xml")
-                update_url = f"{REDMINE_URL}/checklists/{item['id']}.xml"
-                
-                async with session.put(
-                    update_url,
-                    headers={**headers, "Content-Type": "application/xml"},
-                    data=payload,
-                    ssl=False
-                ) as resp:
-                    if resp.status in (200, 201, 422):
-                        marked += 1
+        to_mark = []
+        for item in checklist.block_items(serial):
+            subj_l = item.subject.lower()
+            
+            # Пропустить заголовки
+            if ("проверка оборудования" in subj_l or 
+                "комплектация оборудования" in subj_l or 
+                "выдача готового" in subj_l or
+                "переместить изделие в изолятор брака" in subj_l):
+                continue
+            
+            # Пропустить уже отмеченные
+            if item.is_done:
+                continue
+            
+            # Проверить: входит ли в список для автоотметки?
+            should_mark = False
+            for keyword in target_keywords:
+                if keyword in subj_l:
+                    should_mark = True
+                    break
+            
+            if not should_mark:
+                continue
+            
+            to_mark.append(item)
         
-        # Пересчитываем процент готовности
-        await recalculate_done_ratio(issue_id, user_id)
+        # Отметить пункты — параллельно
+        outcomes = await set_checklist_items_done(to_mark, api_key, issue_id, checklist)
+        marked = sum(outcomes.values())
+        
+        # Пересчитываем процент готовности по уже известному состоянию
+        await recalculate_done_ratio(issue_id, user_id, checklist)
         return marked
     
     except Exception as e:
@@ -2042,21 +2513,11 @@ async def check_all_checklists_complete(issue_id: str, user_id: int) -> bool:
     Проверяет: все ли пункты чек-листа отмечены (кроме заголовков).
     Возвращает True, если все отмечены.
     """
-    headers = {"X-Redmine-API-Key": get_user_api_token(user_id)}
-    url = f"{REDMINE_URL}/issues/{issue_id}/checklists.xml"
-    
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, headers=headers, ssl=False) as resp:
-                if resp.status != 200:
-                    return False
-                xml_text = await resp.text()
-        
-        root = ET.fromstring(xml_text)
+        items = await redmine.get_checklist(issue_id, get_user_api_token(user_id))
         
-        for cl in root.findall("checklist"):
-            subj = (cl.findtext("subject") or "").strip().lower()
-            is_done = cl.findtext("is_done") or "0"
+        for item in items:
+            subj = item.subject.lower()
             
             # Пропустить заголовки (все возможные варианты!)
             if ("проверка оборудования" in subj or 
@@ -2066,8 +2527,8 @@ async def check_all_checklists_complete(issue_id: str, user_id: int) -> bool:
                 continue
             
             # Если хоть один пункт не отмечен → False
-            if is_done not in ("1", "true"):
-                logging.info(f"[DEBUG] Неотмеченный пункт: '{cl.findtext('subject')}'")
+            if not item.is_done:
+                logging.info(f"[DEBUG] Неотмеченный пункт: '{item.subject}'")
                 return False
         
         return True
@@ -2085,65 +2546,18 @@ async def get_all_serials_with_unchecked_items(issue_id: str, user_id: int) -> l
     
     НЕ включает серийники, у которых все пункты отмечены.
     """
-    headers = {"X-Redmine-API-Key": get_user_api_token(user_id)}
-    url = f"{REDMINE_URL}/issues/{issue_id}/checklists.xml"
-    
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, headers=headers, ssl=False) as resp:
-                if resp.status != 200:
-                    return []
-                xml_text = await resp.text()
-        
-        root = ET.fromstring(xml_text)
-        checklist_items = []
-        
-        for cl in root.findall("checklist"):
-            checklist_items.append({
-                "subject": (cl.findtext("subject") or "").strip(),
-                "is_done": cl.findtext("is_done") or "0",
-            })
+        checklist = await redmine.get_checklist(issue_id, get_user_api_token(user_id))
+        index_checklist_serials(issue_id, checklist)
         
-        # Найти все серийники в чек-листе
+        # Блоки "Проверка оборудования <S/N>" и их счётчики уже посчитаны при загрузке
         serials_with_unchecked = []
-        
-        for idx, item in enumerate(checklist_items):
-            subj = item["subject"]
+        for block in checklist.serial_blocks():
+            learn_serials(block.serial)
             
-            # Ищем заголовки "Проверка оборудования <S/N>"
-            if ("проверка оборудования" in subj.lower() and 
-                "указать серийный номер" not in subj.lower()):
-                
-                # Извлекаем серийник из названия
-                # Формат: "Проверка оборудования ABC123"
-                serial = subj.replace("Проверка оборудования", "").strip()
-                
-                if not serial:
-                    continue
-                
-                # Проверяем, есть ли неотмеченные пункты у этого серийника
-                # Ищем до следующего заголовка "Проверка оборудования"
-                has_unchecked = False
-                
-                for check_idx in range(idx + 1, len(checklist_items)):
-                    next_subj = checklist_items[check_idx]["subject"].lower()
-                    
-                    # Достигли следующего блока оборудования
-                    if "проверка оборудования" in next_subj:
-                        break
-                    
-                    # Пропускаем заголовки
-                    if "комплектация оборудования" in next_subj or "выдача готового" in next_subj:
-                        continue
-                    
-                    # Если нашли неотмеченный пункт
-                    if checklist_items[check_idx]["is_done"] not in ("1", "true"):
-                        has_unchecked = True
-                        break
-                
-                # ДОБАВЛЯЕМ ТОЛЬКО если есть неотмеченные пункты
-                if has_unchecked:
-                    serials_with_unchecked.append({"serial": serial})
+            # ДОБАВЛЯЕМ ТОЛЬКО если есть неотмеченные пункты
+            if not block.complete:
+                serials_with_unchecked.append({"serial": block.serial})
         
         return serials_with_unchecked
     
@@ -2159,54 +2573,19 @@ async def get_available_buttons_for_serial(issue_id: str, serial: str, user_id:
     
     Возвращает: ["photo_po", "testing"] или подмножество
     """
-    headers = {"X-Redmine-API-Key": get_user_api_token(user_id)}
-    url = f"{REDMINE_URL}/issues/{issue_id}/checklists.xml"
-    
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, headers=headers, ssl=False) as resp:
-                if resp.status != 200:
-                    return []
-                xml_text = await resp.text()
-        
-        root = ET.fromstring(xml_text)
-        checklist_items = []
-        
-        for cl in root.findall("checklist"):
-            checklist_items.append({
-                "subject": (cl.findtext("subject") or "").strip(),
-                "is_done": cl.findtext("is_done") or "0",
-            })
-        
-        # Найти блок серийника
-        serial_idx = None
-        for idx, item in enumerate(checklist_items):
-            subj = item["subject"]
-            if ("проверка оборудования" in subj.lower() and 
-                serial.upper() in subj.upper() and 
-                "указать" not in subj.lower()):
-                serial_idx = idx
-                break
+        checklist = await redmine.get_checklist(issue_id, get_user_api_token(user_id))
         
-        if serial_idx is None:
+        if checklist.block(serial) is None:
             return []
         
-        # Найти конец блока
-        block_end_idx = len(checklist_items) - 1
-        for idx in range(serial_idx + 1, len(checklist_items)):
-            subj_l = checklist_items[idx]["subject"].lower()
-            if "проверка оборудования" in subj_l:
-                block_end_idx = idx - 1
-                break
-        
         # Проверяем статус ключевых пунктов
         photo_po_checked = False
         testing_checked = False
         
-        for idx in range(serial_idx + 1, block_end_idx + 1):
-            item = checklist_items[idx]
-            subj_l = item["subject"].lower()
-            is_done = item["is_done"] in ("1", "true")
+        for item in checklist.block_items(serial):
+            subj_l = item.subject.lower()
+            is_done = item.is_done
             
             if "проверка настройки и лицензирования" in subj_l and is_done:
                 photo_po_checked = True
@@ -2238,8 +2617,7 @@ async def mark_items_up_to_target(issue_id: str, serial: str, target_keyword: st
     
     Возвращает количество отмеченных пунктов.
     """
-    headers = {"X-Redmine-API-Key": get_user_api_token(user_id)}
-    url = f"{REDMINE_URL}/issues/{issue_id}/checklists.xml"
+    api_key = get_user_api_token(user_id)
     
     # Список пунктов для отметки (по порядку)
     items_to_mark = [
@@ -2258,191 +2636,69 @@ async def mark_items_up_to_target(issue_id: str, serial: str, target_keyword: st
     logging.info(f"[DEBUG] Целевые ключевые слова: {items_to_mark}")
     
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, headers=headers, ssl=False) as resp:
-                if resp.status != 200:
-                    return 0
-                xml_text = await resp.text()
-        
-        root = ET.fromstring(xml_text)
-        checklist_items = []
-        
-        for cl in root.findall("checklist"):
-            checklist_items.append({
-                "id": cl.findtext("id"),
-                "subject": (cl.findtext("subject") or "").strip(),
-                "is_done": cl.findtext("is_done") or "0",
-                "position": cl.findtext("position") or "0",
-                "issue_id": cl.findtext("issue_id") or issue_id,
-            })
-        
-        # Найти индекс блока серийника
-        serial_idx = None
-        for idx, item in enumerate(checklist_items):
-            subj = item["subject"]
-            if ("проверка оборудования" in subj.lower() and 
-                serial.upper() in subj.upper() and 
-                "указать" not in subj.lower()):
-                serial_idx = idx
-                logging.info(f"[DEBUG] Найден блок серийника на позиции {idx}: {subj}")
-                break
+        checklist = await redmine.get_checklist(issue_id, api_key)
         
-        if serial_idx is None:
+        block = checklist.block(serial)
+        if block is None:
             logging.error(f"[DEBUG] Серийник {serial} не найден в чек-листе!")
             return 0
         
-        # Найти конец блока
-        block_end_idx = len(checklist_items) - 1
-        for idx in range(serial_idx + 1, len(checklist_items)):
-            subj_l = checklist_items[idx]["subject"].lower()
-            if ("проверка оборудования" in subj_l and 
-                serial.upper() not in checklist_items[idx]["subject"].upper()):
-                block_end_idx = idx - 1
-                break
-        
-        logging.info(f"[DEBUG] Блок серийника: позиции {serial_idx} - {block_end_idx}")
+        logging.info(f"[DEBUG] Блок серийника: позиции {block.start} - {block.end} "
+                     f"(отмечено {block.done}/{block.total})")
         
         # Отметить пункты из списка items_to_mark
-        marked = 0
-        async with aiohttp.ClientSession() as session:
-            for idx in range(serial_idx + 1, block_end_idx + 1):
-                item = checklist_items[idx]
-                subj_l = item["subject"].lower()
-                
-                logging.info(f"[DEBUG] Проверяю пункт [{idx}]: '{item['subject']}' (is_done={item['is_done']})")
-                
-                # Пропустить заголовки
-                if "проверка оборудования" in subj_l or "комплектация оборудования" in subj_l or "выдача готового" in subj_l:
-                    logging.info(f"[DEBUG] → Пропущен (заголовок)")
-                    continue
-                
-                # Проверить: входит ли в список для отметки?
-                should_mark = False
-                matched_keyword = None
-                for keyword in items_to_mark:
-                    if keyword in subj_l:
-                        should_mark = True
-                        matched_keyword = keyword
-                        break
-                
-                if not should_mark:
-                    logging.info(f"[DEBUG] → Пропущен (не входит в список)")
-                    continue
-                
-                logging.info(f"[DEBUG] → Совпадение по ключевому слову: '{matched_keyword}'")
-                
-                # Отметить пункт (даже если уже отмечен)
-                checklist_el = ET.Element("checklist")
-                ET.SubElement(checklist_el, "id").text = str(item["id"])
-                ET.SubElement(checklist_el, "issue_id").text = str(item["issue_id"])
-                ET.SubElement(checklist_el, "subject").text = item["subject"]
-                ET.SubElement(checklist_el, "is_done").text = "1"
-                #ET.SubElement(checklist_el, "position").text = str(item["position"])
-                
-                payload = ET.tostring(checklist_el, encoding="utf-8", method="xml")
-                update_url = f"{REDMINE_URL}/checklists/{item['id']}.xml"
-                
-                async with session.put(
-                    update_url,
-                    headers={**headers, "Content-Type": "application/xml"},
-                    data=payload,
-                    ssl=False
-                ) as resp:
-                    if resp.status in (200, 201, 422):
-                        # Считаем только если реально изменили статус
-                        was_unchecked = item["is_done"] not in ("1", "true")
-                        if was_unchecked:
-                            marked += 1
-                            logging.info(f"[DEBUG] → Отмечен (было не отмечено)")
-                        else:
-                            logging.info(f"[DEBUG] → Переотмечен (уже было отмечено)")
-                    else:
-                        logging.error(f"[DEBUG] → Ошибка отметки: HTTP {resp.status}")
-        
-        # Пересчитываем процент готовности
-        await recalculate_done_ratio(issue_id, user_id)
-        
-        logging.info(f"[DEBUG] ИТОГО отмечено новых пунктов: {marked}")
-        return marked
-    
-    except Exception as e:
-        logging.error(f"Ошибка mark_items_up_to_target: {e}")
-        return 0
-
-async def get_available_buttons_for_serial(issue_id: str, serial: str, user_id: int) -> list:
-    """
-    Возвращает список доступных кнопок для серийника.
-    Если пункт уже отмечен, кнопка не показывается.
-    
-    Возвращает: ["photo_po", "testing"] или подмножество
-    """
-    headers = {"X-Redmine-API-Key": get_user_api_token(user_id)}
-    url = f"{REDMINE_URL}/issues/{issue_id}/checklists.xml"
-    
-    try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, headers=headers, ssl=False) as resp:
-                if resp.status != 200:
-                    return []
-                xml_text = await resp.text()
-        
-        root = ET.fromstring(xml_text)
-        checklist_items = []
-        
-        for cl in root.findall("checklist"):
-            checklist_items.append({
-                "subject": (cl.findtext("subject") or "").strip(),
-                "is_done": cl.findtext("is_done") or "0",
-            })
-        
-        # Найти блок серийника
-        serial_idx = None
-        for idx, item in enumerate(checklist_items):
-            subj = item["subject"]
-            if ("проверка оборудования" in subj.lower() and 
-                serial.upper() in subj.upper() and 
-                "указать" not in subj.lower()):
-                serial_idx = idx
-                break
-        
-        if serial_idx is None:
-            return []
-        
-        # Найти конец блока
-        block_end_idx = len(checklist_items) - 1
-        for idx in range(serial_idx + 1, len(checklist_items)):
-            subj_l = checklist_items[idx]["subject"].lower()
-            if "проверка оборудования" in subj_l:
-                block_end_idx = idx - 1
-                break
-        
-        # Проверяем статус ключевых пунктов
-        photo_po_checked = False
-        testing_checked = False
-        
-        for idx in range(serial_idx + 1, block_end_idx + 1):
-            item = checklist_items[idx]
-            subj_l = item["subject"].lower()
-            is_done = item["is_done"] in ("1", "true")
+        to_mark = []
+        for idx in range(block.start + 1, block.end + 1):
+            item = checklist[idx]
+            subj_l = item.subject.lower()
+            
+            logging.info(f"[DEBUG] Проверяю пункт [{idx}]: '{item.subject}' (is_done={item.is_done})")
+            
+            # Пропустить заголовки
+            if "проверка оборудования" in subj_l or "комплектация оборудования" in subj_l or "выдача готового" in subj_l:
+                logging.info(f"[DEBUG] → Пропущен (заголовок)")
+                continue
+            
+            # Проверить: входит ли в список для отметки?
+            should_mark = False
+            matched_keyword = None
+            for keyword in items_to_mark:
+                if keyword in subj_l:
+                    should_mark = True
+                    matched_keyword = keyword
+                    break
+            
+            if not should_mark:
+                logging.info(f"[DEBUG] → Пропущен (не входит в список)")
+                continue
             
-            if "проверка настройки и лицензирования" in subj_l and is_done:
-                photo_po_checked = True
+            logging.info(f"[DEBUG] → Совпадение по ключевому слову: '{matched_keyword}'")
             
-            if "проведение нагрузочного тестирования" in subj_l and is_done:
-                testing_checked = True
+            # Отметить пункт (даже если уже отмечен)
+            to_mark.append(item)
         
-        # Формируем список доступных кнопок
-        available = []
-        if not photo_po_checked:
-            available.append("photo_po")
-        if not testing_checked:
-            available.append("testing")
+        # Считаем только если реально изменили статус
+        was_unchecked = {item.id for item in to_mark if not item.is_done}
+        outcomes = await set_checklist_items_done(to_mark, api_key, issue_id, checklist)
+        marked = 0
+        for item in to_mark:
+            if not outcomes[item.id]:
+                continue
+            if item.id in was_unchecked:
+                marked += 1
+                logging.info(f"[DEBUG] → #{item.id} отмечен (было не отмечено)")
+            else:
+                logging.info(f"[DEBUG] → #{item.id} переотмечен (уже было отмечено)")
         
-        return available
+        # Пересчитываем процент готовности по уже известному состоянию
+        await recalculate_done_ratio(issue_id, user_id, checklist)
+        
+        logging.info(f"[DEBUG] ИТОГО отмечено новых пунктов: {marked}")
+        return marked
     
     except Exception as e:
-        logging.error(f"Ошибка get_available_buttons_for_serial: {e}")
-        return []
+        logging.error(f"Ошибка mark_items_up_to_target: {e}")
+        return 0
 
 # ===================== Вспомогательная функция: загрузка фото с умной логикой =====================
 
@@ -2495,123 +2751,95 @@ async def handle_photo_with_issue(message: types.Message, photo: object, issue_i
 @dp.callback_query(lambda c: c.data.startswith("confirm_sn:"))
 async def confirm_serial_callback(callback: CallbackQuery, state: FSMContext):
     """Пользователь нажал 'ВЕРНО?' — выполняем все действия."""
-    user_id = int(callback.data.split(":")[1])
+    parts = callback.data.split(":")
+    user_id = int(parts[1])
     
     if callback.from_user.id != user_id:
         await callback.answer("Эта кнопка не для тебя!", show_alert=True)
         return
     
+    # Ключ кнопки: фото (и S/N, если на фото их несколько) — данные именно этой кнопки
+    key = ":".join(parts[2:])
     data = await state.get_data()
-    photo_id = data.get("photo_id")
-    serial = data.get("serial")
-    control_task_id = data.get("control_task_id")
-    mime_type = data.get("mime_type", "image/jpeg")
-    
-    if not all([photo_id, serial, control_task_id]):
-        await callback.answer("Ошибка: данные не найдены", show_alert=True)
+    entry = (data.get("pending_sn") or {}).get(key)
+    if not entry:
+        await callback.answer("Кнопка устарела — отправь фото ещё раз", show_alert=True)
         return
     
+    photo_id = entry["photo_id"]
+    serial = entry["serial"]
+    control_task_id = entry["control_task_id"]
+    mime_type = entry.get("mime_type") or "image/jpeg"
+    
     await callback.answer("⏳ Проверяю серийный номер...")
     
-    headers = {"X-Redmine-API-Key": get_user_api_token(user_id)}
+    api_key = get_user_api_token(user_id)
     
     try:
-        async with aiohttp.ClientSession() as session:
-            # === ПРОВЕРКА ДУБЛИКАТОВ В ЧЕК-ЛИСТЕ ===
-            logging.info(f"Проверка дубликата S/N {serial} в задаче #{control_task_id}")
-            
-            async with session.get(f"{REDMINE_URL}/issues/{control_task_id}/checklists.xml", headers=headers, ssl=False) as resp:
-                if resp.status == 200:
-                    xml_text = await resp.text()
-                    root = ET.fromstring(xml_text)
-                    
-                    # Проверяем, есть ли уже этот серийник в чек-листе
-                    for cl in root.findall("checklist"):
-                        subj = (cl.findtext("subject") or "").strip()
-                        
-                        # Ищем пункты "Проверка оборудования <серийник>"
-                        if ("проверка оборудования" in subj.lower() and 
-                            serial.upper() in subj.upper() and 
-                            "серийный номер" not in subj.lower()):
-                            
-                            logging.warning(f"Дубликат S/N {serial} найден в задаче #{control_task_id}")
-                            
-                            # Удаляем кнопку "ВЕРНО?"
-                            await callback.message.edit_reply_markup(reply_markup=InlineKeyboardMarkup(inline_keyboard=[
-                                [InlineKeyboardButton(text=control_task_id, url=f"{REDMINE_URL}/issues/{control_task_id}")]
-                            ]))
-                            
-                            # Отправляем ошибку
-                            await bot.send_message(
-                                callback.from_user.id,
-                                f"⚠️ Ошибка: оборудование с S/N {serial} уже добавлено в задачу #{control_task_id}!\n\n"
-                                f"Фото не загружено."
-                            )
-                            await state.clear()
-                            return
-            
-            logging.info(f"Дубликат не найден, загружаю фото для S/N {serial}")
-            
-            # === ЗАГРУЗКА ФОТО ===
-            file = await bot.get_file(photo_id)
-            file_url = f"https://api.telegram.org/file/bot{TELEGRAM_TOKEN}/{file.file_path}"
-            filename = file.file_path.split("/")[-1]
-            
-            async with session.get(file_url, ssl=False) as resp:
-                photo_data = await resp.read()
-            
-            upload_url = f"{REDMINE_URL}/uploads.json"
-            async with session.post(upload_url, headers={**headers, "Content-Type": "application/octet-stream"}, data=photo_data, ssl=False) as resp:
-                upload_info = await resp.json()
-                token = upload_info["upload"]["token"]
-            
-            # === ПРИКРЕПЛЕНИЕ К ЗАДАЧЕ + СМЕНА СТАТУСА ===
-            async with session.get(f"{REDMINE_URL}/issues/{control_task_id}.json", headers=headers, ssl=False) as resp:
-                issue_data = await resp.json()
-                status_name = issue_data["issue"]["status"]["name"].lower()
-            
-            payload = {
-                "issue": {
-                    "uploads": [{"token": token, "filename": filename, "content_type": mime_type}]
-                }
-            }
-            if status_name == "новая задача":
-                payload["issue"]["status_id"] = STATUS_IN_PROGRESS
-            
-            async with session.put(f"{REDMINE_URL}/issues/{control_task_id}.json", headers={**headers, "Content-Type": "application/json"}, json=payload, ssl=False) as resp:
-                pass
-            
-            # === ОБНОВЛЕНИЕ ЧЕК-ЛИСТА ===
-            async with session.get(f"{REDMINE_URL}/issues/{control_task_id}/checklists.xml", headers=headers, ssl=False) as resp:
-                if resp.status == 200:
-                    xml_text = await resp.text()
-                    root = ET.fromstring(xml_text)
-                    checklist_items = []
-                    for cl in root.findall("checklist"):
-                        checklist_items.append({
-                            "id": cl.findtext("id"),
-                            "subject": (cl.findtext("subject") or "").strip(),
-                            "is_done": cl.findtext("is_done") or "0",
-                            "position": cl.findtext("position") or "0",
-                            "issue_id": cl.findtext("issue_id") or control_task_id,
-                        })
-                    
-                    # Найти "указать серийный номер"
-                    for idx, item in enumerate(checklist_items):
-                        if ("проверка оборудования" in item["subject"].lower() and 
-                            "указать серийный номер" in item["subject"].lower()):
-                            await update_checklist_first_step(control_task_id, serial, idx, checklist_items, user_id)
-                            break
-            
-            # Удаляем кнопку "ВЕРНО?"
-            await callback.message.edit_reply_markup(reply_markup=InlineKeyboardMarkup(inline_keyboard=[
-                [InlineKeyboardButton(text=control_task_id, url=f"{REDMINE_URL}/issues/{control_task_id}")]
-            ]))
+        # === ПРОВЕРКА ДУБЛИКАТОВ В ЧЕК-ЛИСТЕ ===
+        logging.info(f"Проверка дубликата S/N {serial} в задаче #{control_task_id}")
+        
+        checklist_items = await redmine.get_checklist(control_task_id, api_key, fresh=True)
+        
+        # Проверяем, есть ли уже этот серийник в чек-листе
+        for item in checklist_items:
+            subj = item.subject
             
-            # Отправляем НОВОЕ сообщение
-            await bot.send_message(callback.from_user.id, f"✅ Фото успешно загружено в задачу #{control_task_id}")
-            await state.clear()
-    
+            # Ищем пункты "Проверка оборудования <серийник>"
+            if ("проверка оборудования" in subj.lower() and 
+                serial.upper() in subj.upper() and 
+                "серийный номер" not in subj.lower()):
+                
+                logging.warning(f"Дубликат S/N {serial} найден в задаче #{control_task_id}")
+                
+                # Удаляем кнопку "ВЕРНО?"
+                await callback.message.edit_reply_markup(reply_markup=InlineKeyboardMarkup(inline_keyboard=[
+                    [InlineKeyboardButton(text=control_task_id, url=f"{REDMINE_URL}/issues/{control_task_id}")]
+                ]))
+                
+                # Отправляем ошибку
+                await bot.send_message(
+                    callback.from_user.id,
+                    f"⚠️ Ошибка: оборудование с S/N {serial} уже добавлено в задачу #{control_task_id}!\n\n"
+                    f"Фото не загружено."
+                )
+                await clear_confirmed_serial(state, key)
+                return
+        
+        logging.info(f"Дубликат не найден, загружаю фото для S/N {serial}")
+        
+        # === ЗАГРУЗКА ФОТО (потоком из Telegram) ===
+        token, filename = await upload_telegram_file(photo_id, api_key)
+        
+        # === ПРИКРЕПЛЕНИЕ К ЗАДАЧЕ + СМЕНА СТАТУСА ===
+        issue_data = await redmine.get_issue(control_task_id, api_key)
+        status_name = issue_data["status"]["name"].lower()
+        
+        fields = {}
+        if status_name == "новая задача":
+            fields["status_id"] = STATUS_IN_PROGRESS
+        
+        await redmine.attach(control_task_id, api_key, token, filename, mime_type, fields=fields)
+        
+        # === ОБНОВЛЕНИЕ ЧЕК-ЛИСТА ===
+        checklist_items = await redmine.get_checklist(control_task_id, api_key)
+        
+        # Найти "указать серийный номер"
+        for idx, item in enumerate(checklist_items):
+            if ("проверка оборудования" in item.subject.lower() and 
+                "указать серийный номер" in item.subject.lower()):
+                await update_checklist_first_step(control_task_id, serial, idx, checklist_items, user_id)
+                break
+        
+        # Удаляем кнопку "ВЕРНО?"
+        await callback.message.edit_reply_markup(reply_markup=InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text=control_task_id, url=f"{REDMINE_URL}/issues/{control_task_id}")]
+        ]))
+        
+        # Отправляем НОВОЕ сообщение
+        await bot.send_message(callback.from_user.id, f"✅ Фото успешно загружено в задачу #{control_task_id}")
+        await clear_confirmed_serial(state, key)
+
     except Exception as e:
         logging.error(f"Ошибка confirm_sn: {e}", exc_info=True)
         await bot.send_message(callback.from_user.id, f"❌ Ошибка: {e}")
@@ -2639,32 +2867,14 @@ async def confirm_final_photo_callback(callback: CallbackQuery, state: FSMContex
     
     await callback.answer("⏳ Загружаю фото и завершаю проверку...")
     
-    headers = {"X-Redmine-API-Key": get_user_api_token(user_id)}
+    api_key = get_user_api_token(user_id)
     
     try:
-        async with aiohttp.ClientSession() as session:
-            # 1) Загрузка фото
-            file = await bot.get_file(photo_id)
-            file_url = f"https://api.telegram.org/file/bot{TELEGRAM_TOKEN}/{file.file_path}"
-            filename = file.file_path.split("/")[-1]
-            
-            async with session.get(file_url, ssl=False) as resp:
-                photo_data = await resp.read()
-            
-            upload_url = f"{REDMINE_URL}/uploads.json"
-            async with session.post(upload_url, headers={**headers, "Content-Type": "application/octet-stream"}, data=photo_data, ssl=False) as resp:
-                upload_info = await resp.json()
-                token = upload_info["upload"]["token"]
-            
-            # 2) Прикрепление к задаче
-            payload = {
-                "issue": {
-                    "uploads": [{"token": token, "filename": filename, "content_type": mime_type}]
-                }
-            }
-            
-            async with session.put(f"{REDMINE_URL}/issues/{control_task_id}.json", headers={**headers, "Content-Type": "application/json"}, json=payload, ssl=False) as resp:
-                pass
+        # 1) Загрузка фото (потоком из Telegram)
+        token, filename = await upload_telegram_file(photo_id, api_key)
+        
+        # 2) Прикрепление к задаче
+        await redmine.attach(control_task_id, api_key, token, filename, mime_type)
         
         # 3) Сообщение об успешной загрузке
         await bot.send_message(callback.from_user.id, f"✅ Фото успешно загружено в задачу #{control_task_id}")
@@ -2699,48 +2909,36 @@ async def confirm_final_photo_callback(callback: CallbackQuery, state: FSMContex
         # 7) Если все отмечены → обновить поля + сменить статус + 🎉 САЛЮТ
         if all_complete:
             from config import STATUS_DONE
-            headers_json = {
-                "X-Redmine-API-Key": get_user_api_token(user_id),
-                "Content-Type": "application/json"
-            }
+            api_key = get_user_api_token(user_id)
             
-            async with aiohttp.ClientSession() as session:
-                async with session.get(f"{REDMINE_URL}/issues/{control_task_id}.json", headers=headers_json, ssl=False) as resp:
-                    if resp.status == 200:
-                        issue_data = await resp.json()
-                        
-                        custom_fields_to_update = []
-                        current_fields = issue_data.get("issue", {}).get("custom_fields", [])
-                        
-                        serial_number_field = next((f for f in current_fields if f.get("id") == 11), None)
-                        if serial_number_field:
-                            current_value = serial_number_field.get("value", "").strip()
-                            if not current_value:
-                                custom_fields_to_update.append({"id": 11, "value": "-"})
-                        
-                        equipment_count = await count_equipment_in_checklist(control_task_id, user_id)
-                        if equipment_count > 0:
-                            custom_fields_to_update.append({"id": 150, "value": str(equipment_count)})
-                        
-                        payload = {"issue": {"status_id": STATUS_DONE}}
-                        if custom_fields_to_update:
-                            payload["issue"]["custom_fields"] = custom_fields_to_update
-                        
-                        logging.info(f"Отправляем PUT запрос для завершения задачи: {payload}")
-                        
-                        async with session.put(
-                            f"{REDMINE_URL}/issues/{control_task_id}.json",
-                            headers=headers_json,
-                            json=payload,
-                            ssl=False
-                        ) as resp:
-                            if resp.status in (200, 204):
-                                logging.info(f"Задача #{control_task_id} переведена в статус 'Выполнено'")
-                                # 🎉 САЛЮТ!
-                                await bot.send_message(callback.from_user.id, "🎉 Задача контроля выполнена!")
-                            else:
-                                response_text = await resp.text()
-                                logging.error(f"Ошибка смены статуса: HTTP {resp.status}, {response_text}")
+            try:
+                issue_data = await redmine.get_issue(control_task_id, api_key)
+                
+                custom_fields_to_update = []
+                current_fields = issue_data.get("custom_fields", [])
+                
+                serial_number_field = next((f for f in current_fields if f.get("id") == 11), None)
+                if serial_number_field:
+                    current_value = serial_number_field.get("value", "").strip()
+                    if not current_value:
+                        custom_fields_to_update.append({"id": 11, "value": "-"})
+                
+                equipment_count = await count_equipment_in_checklist(control_task_id, user_id)
+                if equipment_count > 0:
+                    custom_fields_to_update.append({"id": 150, "value": str(equipment_count)})
+                
+                fields = {"status_id": STATUS_DONE}
+                if custom_fields_to_update:
+                    fields["custom_fields"] = custom_fields_to_update
+                
+                logging.info(f"Отправляем PUT запрос для завершения задачи: {fields}")
+                
+                await redmine.update_issue(control_task_id, api_key, fields)
+                logging.info(f"Задача #{control_task_id} переведена в статус 'Выполнено'")
+                # 🎉 САЛЮТ!
+                await bot.send_message(callback.from_user.id, "🎉 Задача контроля выполнена!")
+            except RedmineError as e:
+                logging.error(f"Ошибка смены статуса: {e}")
         
         # 8) Пересчитываем процент готовности
         await recalculate_done_ratio(control_task_id, user_id)
@@ -2768,19 +2966,17 @@ async def delete_command(message: types.Message):
     attachment_id = None
 
     if issue_id:
-        headers = {"X-Redmine-API-Key": get_user_api_token(message.from_user.id)}
-        async with aiohttp.ClientSession() as session:
-            async with session.get(f"{REDMINE_URL}/issues/{issue_id}.json?include=attachments",
-                                   headers=headers, ssl=False) as resp:
-                if resp.status != 200:
-                    await message.answer(f"Не удалось получить вложения задачи #{issue_id} (HTTP {resp.status})")
-                    return
-                issue_data = await resp.json()
-                attachments = issue_data.get("issue", {}).get("attachments", [])
-                if not attachments:
-                    await message.answer(f"В задаче #{issue_id} нет вложений.")
-                    return
-                attachment_id = str(attachments[-1]["id"])
+        try:
+            issue_data = await redmine.get_issue(issue_id, get_user_api_token(message.from_user.id),
+                                                 include="attachments")
+        except RedmineError as e:
+            await message.answer(f"Не удалось получить вложения задачи #{issue_id} (HTTP {e.status})")
+            return
+        attachments = issue_data.get("attachments", [])
+        if not attachments:
+            await message.answer(f"В задаче #{issue_id} нет вложений.")
+            return
+        attachment_id = str(attachments[-1]["id"])
     else:
         user_last = last_uploaded.get(message.from_user.id)
         if not user_last:
@@ -3011,21 +3207,20 @@ async def back_to_serials_callback(callback: CallbackQuery):
 @dp.callback_query(lambda c: c.data.startswith("delete:"))
 async def confirm_delete(callback: CallbackQuery):
     _, issue_id, attachment_id = callback.data.split(":")
-    headers = {"X-Redmine-API-Key": get_user_api_token(callback.from_user.id)}
 
     try:
-        url = f"{REDMINE_URL}/attachments/{attachment_id}.json"
         logging.info(f"Попытка удаления вложения #{attachment_id} из задачи #{issue_id}")
         
-        async with aiohttp.ClientSession() as session:
-            async with session.delete(url, headers=headers, ssl=False) as resp:
-                if resp.status == 200:
-                    logging.info(f"✅ Фото успешно удалено из задачи #{issue_id} (attachment_id: {attachment_id})")
-                    await callback.message.edit_text(f"❌ Фото успешно удалено из задачи #{issue_id}")
-                    last_uploaded.pop(callback.from_user.id, None)
-                else:
-                    logging.error(f"Ошибка удаления фото: HTTP {resp.status}")
-                    await callback.message.edit_text(f"⚠️ Ошибка удаления фото: HTTP {resp.status}")
+        try:
+            await redmine.request("DELETE", f"/attachments/{attachment_id}.json",
+                                  get_user_api_token(callback.from_user.id), expect="none")
+        except RedmineError as e:
+            logging.error(f"Ошибка удаления фото: {e}")
+            await callback.message.edit_text(f"⚠️ Ошибка удаления фото: HTTP {e.status}")
+            return
+        logging.info(f"✅ Фото успешно удалено из задачи #{issue_id} (attachment_id: {attachment_id})")
+        await callback.message.edit_text(f"❌ Фото успешно удалено из задачи #{issue_id}")
+        last_uploaded.pop(callback.from_user.id, None)
     except Exception as e:
         logging.error(f"Исключение при удалении фото: {e}", exc_info=True)
         await callback.message.edit_text(f"⚠️ Ошибка при удалении фото:\n{e}")
@@ -3040,46 +3235,37 @@ async def checklist_command(message: types.Message):
         return
 
     issue_id = args[1]
-    headers = {"X-Redmine-API-Key": get_user_api_token(message.from_user.id)}
-
-    url = f"{REDMINE_URL}/issues/{issue_id}/checklists.xml"
+    api_key = get_user_api_token(message.from_user.id)
     
     try:
-        async with aiohttp.ClientSession() as session:
-            # Получаем чек-лист
-            async with session.get(url, headers=headers, ssl=False) as resp:
-                if resp.status != 200:
-                    await message.answer(f"Не удалось получить чек-лист задачи #{issue_id}: HTTP {resp.status}")
-                    return
-                xml_text = await resp.text()
-
-            root = ET.fromstring(xml_text)
-            checklist_ids = []
-            
-            # Собираем ID всех пунктов чек-листа
-            for cl in root.findall("checklist"):
-                cid = cl.findtext("id")
-                if cid:
-                    checklist_ids.append(cid)
-            
-            if not checklist_ids:
-                await message.answer(f"В задаче #{issue_id} чек-лист пуст.")
-                return
-            
-            # Подтверждение удаления
-            keyboard = InlineKeyboardMarkup(
-                inline_keyboard=[
-                    [InlineKeyboardButton(
-                        text=f"УДАЛИТЬ {len(checklist_ids)} пунктов чек-листа!", 
-                        callback_data=f"delete_checklist:{issue_id}:{message.from_user.id}"
-                    )]
-                ]
-            )
-            
-            await message.answer(
-                f"⚠️ Вы уверены? Будет удалено {len(checklist_ids)} пунктов чек-листа из задачи #{issue_id}",
-                reply_markup=keyboard
-            )
+        # Получаем чек-лист
+        try:
+            items = await redmine.get_checklist(issue_id, api_key)
+        except RedmineError as e:
+            await message.answer(f"Не удалось получить чек-лист задачи #{issue_id}: HTTP {e.status}")
+            return
+
+        # Собираем ID всех пунктов чек-листа
+        checklist_ids = [item.id for item in items if item.id]
+        
+        if not checklist_ids:
+            await message.answer(f"В задаче #{issue_id} чек-лист пуст.")
+            return
+        
+        # Подтверждение удаления
+        keyboard = InlineKeyboardMarkup(
+            inline_keyboard=[
+                [InlineKeyboardButton(
+                    text=f"УДАЛИТЬ {len(checklist_ids)} пунктов чек-листа!", 
+                    callback_data=f"delete_checklist:{issue_id}:{message.from_user.id}"
+                )]
+            ]
+        )
+        
+        await message.answer(
+            f"⚠️ Вы уверены? Будет удалено {len(checklist_ids)} пунктов чек-листа из задачи #{issue_id}",
+            reply_markup=keyboard
+        )
     
     except Exception as e:
         logging.error(f"Ошибка получения чек-листа: {e}")
@@ -3103,56 +3289,60 @@ async def confirm_delete_checklist(callback: CallbackQuery):
     
     await callback.answer("⏳ Удаляю чек-лист...")
     
-    headers = {"X-Redmine-API-Key": get_user_api_token(user_id)}
-    url = f"{REDMINE_URL}/issues/{issue_id}/checklists.xml"
+    api_key = get_user_api_token(user_id)
     
     try:
-        async with aiohttp.ClientSession() as session:
-            # Получаем чек-лист заново
-            async with session.get(url, headers=headers, ssl=False) as resp:
-                if resp.status != 200:
-                    await callback.message.edit_text(f"❌ Ошибка получения чек-листа: HTTP {resp.status}")
-                    return
-                xml_text = await resp.text()
-            
-            root = ET.fromstring(xml_text)
-            checklist_ids = []
-            
-            for cl in root.findall("checklist"):
-                cid = cl.findtext("id")
-                if cid:
-                    checklist_ids.append(cid)
-            
-            if not checklist_ids:
-                await callback.message.edit_text(f"Чек-лист в задаче #{issue_id} уже пуст.")
+        # Получаем чек-лист заново (мимо кэша — удаляем то, что есть в Redmine сейчас)
+        try:
+            items = await redmine.get_checklist(issue_id, api_key, fresh=True)
+        except RedmineError as e:
+            await callback.message.edit_text(f"❌ Ошибка получения чек-листа: HTTP {e.status}")
+            return
+        
+        checklist_ids = [item.id for item in items if item.id]
+        
+        if not checklist_ids:
+            await callback.message.edit_text(f"Чек-лист в задаче #{issue_id} уже пуст.")
+            return
+        
+        # Прогресс в том же сообщении, не чаще CHECKLIST_PROGRESS_EDIT_SEC
+        last_edit = time.monotonic()
+        
+        async def show_progress(processed: int, total: int):
+            nonlocal last_edit
+            now = time.monotonic()
+            if processed >= total or now - last_edit < CHECKLIST_PROGRESS_EDIT_SEC:
                 return
-            
-            # Удаляем все пункты
-            deleted_count = 0
-            failed_count = 0
-            
-            for cid in checklist_ids:
-                delete_url = f"{REDMINE_URL}/checklists/{cid}.xml"
-                async with session.delete(delete_url, headers=headers, ssl=False) as resp:
-                    if resp.status in (200, 204):
-                        deleted_count += 1
-                        logging.info(f"Удалён пункт чек-листа ID={cid} из задачи #{issue_id}")
-                    else:
-                        failed_count += 1
-                        logging.error(f"Не удалось удалить пункт ID={cid}: HTTP {resp.status}")
-            
-            # Пересчитываем процент готовности
-            await recalculate_done_ratio(issue_id, user_id)
-            
-            # Результат
-            result_text = f"✅ Чек-лист задачи #{issue_id} удалён!\n\n"
-            result_text += f"Удалено пунктов: {deleted_count}"
-            
-            if failed_count > 0:
-                result_text += f"\n⚠️ Не удалось удалить: {failed_count}"
-            
-            await callback.message.edit_text(result_text)
-            logging.info(f"Чек-лист задачи #{issue_id} удалён пользователем {user_id}")
+            last_edit = now
+            try:
+                await callback.message.edit_text(f"⏳ Удаляю чек-лист задачи #{issue_id}: {processed}/{total}")
+            except Exception as e:
+                logging.warning(f"Не удалось обновить прогресс удаления: {e}")
+        
+        # Удаляем все пункты — параллельно
+        started = time.perf_counter()
+        failed_ids = await delete_checklist_items(issue_id, api_key, checklist_ids, show_progress)
+        failed_count = len(failed_ids)
+        deleted_count = len(checklist_ids) - failed_count
+        logging.info(f"Чек-лист задачи #{issue_id}: удалено {deleted_count}, ошибок {failed_count} "
+                     f"за {time.perf_counter() - started:.1f}с")
+        
+        if not failed_count:
+            serial_index.forget_issue(issue_id, source="checklist")
+        
+        # Пересчитываем процент готовности. Удалённые пункты клиент уже убрал из копии
+        # в кэше; если копии нет (ошибки сбросили её, кэш выключен) — чек-лист перечитается
+        await recalculate_done_ratio(issue_id, user_id)
+        
+        # Результат
+        result_text = f"✅ Чек-лист задачи #{issue_id} удалён!\n\n"
+        result_text += f"Удалено пунктов: {deleted_count}"
+        
+        if failed_count > 0:
+            result_text += f"\n⚠️ Не удалось удалить: {failed_count}"
+        
+        await callback.message.edit_text(result_text)
+        logging.info(f"Чек-лист задачи #{issue_id} удалён пользователем {user_id}")
     
     except Exception as e:
         logging.error(f"Ошибка удаления чек-листа: {e}", exc_info=True)
@@ -3381,10 +3571,7 @@ async def create_defect_subtask(message: types.Message, state: FSMContext, user_
     deadline = data["deadline"]
     
     try:
-        headers = {
-            "X-Redmine-API-Key": get_user_api_token(user_id),
-            "Content-Type": "application/json"
-        }
+        api_key = get_user_api_token(user_id)
         
         # ===== 1. ФОРМИРУЕМ ДАННЫЕ ПОДЗАДАЧИ =====
         
@@ -3401,48 +3588,39 @@ async def create_defect_subtask(message: types.Message, state: FSMContext, user_
         # Коды через запятую
         defect_codes = ", ".join([d["code"] for d in defects])
         
-        # Payload подзадачи
-        subtask_payload = {
-            "issue": {
-                "project_id": equipment_info["project_id"],
-                "parent_issue_id": int(issue_id),
-                "subject": subject,
-                "description": description,
-                "tracker_id": TRACKER_DEFECT_FIX,
-                "status_id": STATUS_NEW,
-                "priority_id": PRIORITY_HIGH,
-                "due_date": deadline,
-                "custom_fields": [
-                    {"id": FIELD_SERIAL_NUMBER, "value": serial},
-                    {"id": FIELD_DEFECT_CODE, "value": defect_codes},
-                    {"id": FIELD_CATEGORY, "value": equipment_info["category"]}
-                ]
-            }
+        # Поля подзадачи
+        subtask_fields = {
+            "project_id": equipment_info["project_id"],
+            "parent_issue_id": int(issue_id),
+            "subject": subject,
+            "description": description,
+            "tracker_id": TRACKER_DEFECT_FIX,
+            "status_id": STATUS_NEW,
+            "priority_id": PRIORITY_HIGH,
+            "due_date": deadline,
+            "custom_fields": [
+                {"id": FIELD_SERIAL_NUMBER, "value": serial},
+                {"id": FIELD_DEFECT_CODE, "value": defect_codes},
+                {"id": FIELD_CATEGORY, "value": equipment_info["category"]}
+            ]
         }
         
         # Добавляем assigned_to если есть
         if equipment_info.get("assigned_to_id"):
-            subtask_payload["issue"]["assigned_to_id"] = equipment_info["assigned_to_id"]
+            subtask_fields["assigned_to_id"] = equipment_info["assigned_to_id"]
         
         # ===== 2. СОЗДАЁМ ПОДЗАДАЧУ =====
         
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                f"{REDMINE_URL}/issues.json",
-                headers=headers,
-                json=subtask_payload,
-                ssl=False
-            ) as resp:
-                if resp.status not in (200, 201):
-                    error_text = await resp.text()
-                    logging.error(f"Ошибка создания подзадачи: {error_text}")
-                    await message.edit_text(f"❌ Ошибка создания подзадачи: HTTP {resp.status}")
-                    await state.clear()
-                    return
-                
-                subtask_data = await resp.json()
-                subtask_id = str(subtask_data["issue"]["id"])
-                logging.info(f"✅ Создана подзадача #{subtask_id}")
+        try:
+            subtask = await redmine.create_issue(api_key, subtask_fields)
+        except RedmineError as e:
+            logging.error(f"Ошибка создания подзадачи: {e}")
+            await message.edit_text(f"❌ Ошибка создания подзадачи: HTTP {e.status}")
+            await state.clear()
+            return
+        
+        subtask_id = str(subtask["id"])
+        logging.info(f"✅ Создана подзадача #{subtask_id}")
         
         # ===== 3. ЗАГРУЖАЕМ ФОТО В ЗАДАЧУ КОНТРОЛЯ =====
         
@@ -3497,103 +3675,37 @@ async def create_defect_subtask(message: types.Message, state: FSMContext, user_
 async def update_control_task_checklist_with_defect(issue_id: str, serial: str, subtask_id: str, user_id: int):
     """
     Обновляет чек-лист задачи контроля: добавляет блок 'Изолятор брака'
-    МЕТОД: Пересоздаём весь чек-лист с правильным порядком
+    после пункта "Нагрузочное тестирование" в блоке серийника.
+    Создаются только 4 новых пункта; сдвигаются лишь пункты, которым не хватило места.
     """
     try:
         logging.info(f"[CONTROL_CHECKLIST] === СТАРТ ===")
         
-        headers = {
-            "X-Redmine-API-Key": get_user_api_token(user_id),
-            "Content-Type": "application/xml"
-        }
-        
-        # ===== ФУНКЦИЯ ОПРЕДЕЛЕНИЯ СЕКЦИЙ =====
-        
-        def is_section_by_subject(subject: str) -> bool:
-            """Определяет, является ли элемент секцией по названию"""
-            subject_lower = subject.lower().strip()
-            
-            # Список ключевых фраз для секций
-            section_keywords = [
-                "проверка оборудования",
-                "переместить изделие в изолятор",
-                "комплектация оборудования",
-                "выдача готового оборудования"
-            ]
-            
-            # Проверяем наличие ключевых слов
-            for keyword in section_keywords:
-                if keyword in subject_lower:
-                    return True
-            
-            # Дополнительная проверка: если текст начинается с пробела — это секция
-            if subject.startswith(" ") and not subject.strip().startswith("Визуальный"):
-                return True
-            
-            return False
+        api_key = get_user_api_token(user_id)
         
         # ===== 1. ПОЛУЧАЕМ ВЕСЬ ЧЕК-ЛИСТ =====
         
-        async with aiohttp.ClientSession() as session:
-            async with session.get(
-                f"{REDMINE_URL}/issues/{issue_id}/checklists.xml",
-                headers=headers,
-                ssl=False
-            ) as resp:
-                if resp.status != 200:
-                    logging.error(f"[CONTROL_CHECKLIST] Ошибка: HTTP {resp.status}")
-                    return
-                xml_text = await resp.text()
-        
-        root = ET.fromstring(xml_text)
-        checklist_items = []
-        
-        for cl in root.findall("checklist"):
-            subject = (cl.findtext("subject") or "").strip()
-            is_done_text = cl.findtext("is_done")
-            is_section_text = cl.findtext("is_section")
-            
-            # Определяем is_section: берём из XML или определяем по названию
-            if is_section_text == "true":
-                is_section = True
-            elif is_section_text == "false":
-                is_section = False
-            else:
-                # Если в XML нет поля is_section, определяем сами
-                is_section = is_section_by_subject(subject)
-            
-            checklist_items.append({
-                "id": cl.findtext("id"),
-                "subject": subject,
-                "is_done": is_done_text == "true",
-                "is_section": is_section,
-                "position": int(cl.findtext("position") or "0"),
-            })
-        
-        # Сортируем по позиции
-        checklist_items.sort(key=lambda x: x["position"])
-        
-        logging.info(f"[CONTROL_CHECKLIST] Получено {len(checklist_items)} элементов")
+        try:
+            checklist = await redmine.get_checklist(issue_id, api_key, fresh=True)
+        except RedmineError as e:
+            logging.error(f"[CONTROL_CHECKLIST] Ошибка: HTTP {e.status}")
+            return
         
-        # Логируем секции для отладки
-        sections_count = sum(1 for item in checklist_items if item["is_section"])
-        logging.info(f"[CONTROL_CHECKLIST] Найдено {sections_count} секций")
+        logging.info(f"[CONTROL_CHECKLIST] Получено {len(checklist)} элементов")
         
         # ===== 2. ИЩЕМ БЛОК СЕРИЙНИКА =====
         
-        serial_block_start = None
-        insert_after_idx = None
+        block = checklist.block(serial)
+        if block is None:
+            logging.error(f"[CONTROL_CHECKLIST] Блок S/N {serial} не найден")
+            return
+        logging.info(f"[CONTROL_CHECKLIST] Блок серийника начинается с индекса {block.start}")
         
-        for i, item in enumerate(checklist_items):
-            subj = item["subject"]
-            
-            # Начало блока
-            if serial.upper() in subj.upper() and "проверка оборудования" in subj.lower():
-                serial_block_start = i
-                logging.info(f"[CONTROL_CHECKLIST] Блок серийника начинается с индекса {i}")
-            
-            # Пункт "Нагрузочное тестирование" в этом блоке
-            if serial_block_start is not None and "нагрузочн" in subj.lower() and "тестирован" in subj.lower():
+        # Пункт "Нагрузочное тестирование" в этом блоке
+        insert_after_idx = None
+        for i in range(block.start + 1, block.end + 1):
+            subj = checklist[i].subject.lower()
+            if "нагрузочн" in subj and "тестирован" in subj:
                 insert_after_idx = i
                 logging.info(f"[CONTROL_CHECKLIST] 'Нагрузочное тестирование' на индексе {i}")
                 break
@@ -3604,100 +3716,29 @@ async def update_control_task_checklist_with_defect(issue_id: str, serial: str,
         
         # ===== 3. ПРОВЕРЯЕМ, ЕСТЬ ЛИ УЖЕ "ИЗОЛЯТОР БРАКА" =====
         
-        for item in checklist_items:
-            if "изолятор брака" in item["subject"].lower():
+        for item in checklist:
+            if "изолятор брака" in item.subject.lower():
                 logging.info(f"[CONTROL_CHECKLIST] 'Изолятор брака' уже есть")
                 return
         
-        # ===== 4. ВСТАВЛЯЕМ 4 НОВЫХ ЭЛЕМЕНТА В СПИСОК =====
+        # ===== 4. ВСТАВЛЯЕМ 4 НОВЫХ ЭЛЕМЕНТА ПОСЛЕ "НАГРУЗОЧНОЕ ТЕСТИРОВАНИЕ" =====
         
         new_items = [
-            {
-                "id": None,  # Новый элемент
-                "subject": CHECKLIST_DEFECT_HEADER,
-                "is_done": False,
-                "is_section": True,  # СЕКЦИЯ!
-                "position": 0
-            },
-            {
-                "id": None,
-                "subject": CHECKLIST_DEFECT_PHOTO,
-                "is_done": True,
-                "is_section": False,
-                "position": 0
-            },
-            {
-                "id": None,
-                "subject": CHECKLIST_DEFECT_SUBTASK,
-                "is_done": True,
-                "is_section": False,
-                "position": 0
-            },
-            {
-                "id": None,
-                "subject": CHECKLIST_DEFECT_RECHECK,
-                "is_done": False,
-                "is_section": False,
-                "position": 0
-            }
+            {"subject": CHECKLIST_DEFECT_HEADER, "is_done": False, "is_section": True},  # СЕКЦИЯ!
+            {"subject": CHECKLIST_DEFECT_PHOTO, "is_done": True, "is_section": False},
+            {"subject": CHECKLIST_DEFECT_SUBTASK, "is_done": True, "is_section": False},
+            {"subject": CHECKLIST_DEFECT_RECHECK, "is_done": False, "is_section": False},
         ]
         
-        # Вставляем ПОСЛЕ "Нагрузочное тестирование"
-        for i, new_item in enumerate(new_items):
-            checklist_items.insert(insert_after_idx + 1 + i, new_item)
-        
-        logging.info(f"[CONTROL_CHECKLIST] Теперь {len(checklist_items)} элементов (добавлено 4)")
+        target = list(checklist.items)
+        target[insert_after_idx + 1:insert_after_idx + 1] = new_items
         
-        # ===== 5. УДАЛЯЕМ ВСЕ СТАРЫЕ ЭЛЕМЕНТЫ =====
+        # ===== 5. ЗАПИСЫВАЕМ ТОЛЬКО РАЗНИЦУ =====
         
-        logging.info(f"[CONTROL_CHECKLIST] Удаляем старые элементы...")
-        
-        old_ids = [item["id"] for item in checklist_items if item["id"] is not None]
-        
-        async with aiohttp.ClientSession() as session:
-            for old_id in old_ids:
-                async with session.delete(
-                    f"{REDMINE_URL}/checklists/{old_id}.xml",
-                    headers=headers,
-                    ssl=False
-                ) as resp:
-                    if resp.status not in (200, 204):
-                        logging.warning(f"[CONTROL_CHECKLIST] Не удалось удалить ID={old_id}")
-        
-        logging.info(f"[CONTROL_CHECKLIST] Старые элементы удалены")
-        
-        # ===== 6. СОЗДАЁМ ЗАНОВО ВСЕ ЭЛЕМЕНТЫ С ПОЗИЦИЯМИ 0, 1, 2, 3... =====
-        
-        logging.info(f"[CONTROL_CHECKLIST] Создаём новый чек-лист...")
-        
-        async with aiohttp.ClientSession() as session:
-            for position, item in enumerate(checklist_items):
-                # Дополнительная проверка is_section при создании
-                is_section_final = item["is_section"] or is_section_by_subject(item["subject"])
-                
-                section_mark = " [СЕКЦИЯ]" if is_section_final else ""
-                logging.debug(f"[CONTROL_CHECKLIST] pos={position}: {item['subject'][:40]}{section_mark}")
-                
-                checklist_el = ET.Element("checklist")
-                ET.SubElement(checklist_el, "issue_id").text = str(issue_id)
-                ET.SubElement(checklist_el, "subject").text = item["subject"]
-                ET.SubElement(checklist_el, "is_done").text = "1" if item["is_done"] else "0"
-                ET.SubElement(checklist_el, "is_section").text = "1" if is_section_final else "0"
-                ET.SubElement(checklist_el, "position").text = str(position)
-                
-                payload = ET.tostring(checklist_el, encoding="utf-8", method="xml")
-                
-                async with session.post(
-                    f"{REDMINE_URL}/issues/{issue_id}/checklists.xml",
-                    headers=headers,
-                    data=payload,
-                    ssl=False
-                ) as resp:
-                    if resp.status not in (200, 201):
-                        resp_text = await resp.text()
-                        logging.error(f"[CONTROL_CHECKLIST] Ошибка создания pos={position}: {resp_text[:100]}")
-        
-        logging.info(f"[CONTROL_CHECKLIST] ✅ === ГОТОВО: чек-лист пересоздан с секциями ===")
+        if await write_checklist_order(issue_id, api_key, target):
+            logging.info(f"[CONTROL_CHECKLIST] ✅ === ГОТОВО: блок изолятора брака добавлен ===")
+        else:
+            logging.warning(f"[CONTROL_CHECKLIST] ⚠️ Блок изолятора брака добавлен с ошибками")
         
     except Exception as e:
         logging.error(f"[CONTROL_CHECKLIST] ❌ Ошибка: {e}", exc_info=True)
@@ -3709,24 +3750,15 @@ async def update_control_task_defect_fields(issue_id: str, new_defect_codes: str
     - Добавляет новые коды к "Код несоответствия:"
     """
     try:
-        headers = {
-            "X-Redmine-API-Key": get_user_api_token(user_id),
-            "Content-Type": "application/json"
-        }
+        api_key = get_user_api_token(user_id)
         
         # Получаем текущие данные задачи
-        async with aiohttp.ClientSession() as session:
-            async with session.get(
-                f"{REDMINE_URL}/issues/{issue_id}.json",
-                headers=headers,
-                ssl=False
-            ) as resp:
-                if resp.status != 200:
-                    logging.error(f"Не удалось получить данные задачи {issue_id}")
-                    return
-                
-                issue_data = await resp.json()
-                custom_fields = issue_data.get("issue", {}).get("custom_fields", [])
+        try:
+            issue_data = await redmine.get_issue(issue_id, api_key)
+        except RedmineError as e:
+            logging.error(f"Не удалось получить данные задачи {issue_id}: {e}")
+            return
+        custom_fields = issue_data.get("custom_fields", [])
         
         # Ищем нужные поля
         current_count = 0
@@ -3751,155 +3783,77 @@ async def update_control_task_defect_fields(issue_id: str, new_defect_codes: str
             updated_codes = new_defect_codes
         
         # Обновляем задачу
-        update_payload = {
-            "issue": {
+        try:
+            await redmine.update_issue(issue_id, api_key, {
                 "custom_fields": [
                     {"id": FIELD_DEFECT_COUNT, "value": str(new_count)},
                     {"id": FIELD_DEFECT_CODE, "value": updated_codes}
                 ]
-            }
-        }
-        
-        async with aiohttp.ClientSession() as session:
-            async with session.put(
-                f"{REDMINE_URL}/issues/{issue_id}.json",
-                headers=headers,
-                json=update_payload,
-                ssl=False
-            ) as resp:
-                if resp.status in (200, 204):
-                    logging.info(f"✅ Обновлены поля дефектов в задаче {issue_id}: кол-во={new_count}, коды={updated_codes}")
-                else:
-                    error_text = await resp.text()
-                    logging.error(f"Ошибка обновления полей дефектов: {error_text}")
+            })
+        except RedmineError as e:
+            logging.error(f"Ошибка обновления полей дефектов: {e}")
+            return
+        logging.info(f"✅ Обновлены поля дефектов в задаче {issue_id}: кол-во={new_count}, коды={updated_codes}")
     
     except Exception as e:
         logging.error(f"Ошибка update_control_task_defect_fields: {e}", exc_info=True)
 
+# Чек-лист подзадачи на устранение несоответствий
+SUBTASK_CHECKLIST_TEMPLATE = ChecklistTemplate([
+    {"subject": CHECKLIST_SUBTASK_HEADER, "is_section": True},                # {serial}
+    {"subject": CHECKLIST_SUBTASK_MOVE_TO_PROD},
+    {"subject": CHECKLIST_SUBTASK_FIX_PREFIX + "{item[description]}", "repeat": "defects"},
+    {"subject": CHECKLIST_SUBTASK_CHECK},
+    {"subject": CHECKLIST_SUBTASK_MOVE_TO_TEST},
+])
+
+async def create_checklist_from_template(issue_id, api_key: str, template: ChecklistTemplate, **values) -> int:
+    """
+    Создаёт чек-лист по шаблону: все пункты параллельно (CHECKLIST_WRITE_LIMIT),
+    порядок задают явные позиции. В лог — одна итоговая строка. Возвращает число созданных пунктов.
+    """
+    started = time.perf_counter()
+    rendered = template.render(int(issue_id), **values)
+    results = await gather_limited(
+        lambda entry: redmine.create_checklist_payload(issue_id, api_key, entry[2]),
+        rendered, CHECKLIST_WRITE_LIMIT,
+    )
+    failed = [(position, subject, result) for (position, subject, _), result in zip(rendered, results)
+              if isinstance(result, Exception)]
+    elapsed_ms = int((time.perf_counter() - started) * 1000)
+    if failed:
+        details = "; ".join(f"pos={position} '{subject[:40]}': {error}" for position, subject, error in failed)
+        logging.error(f"[CHECKLIST] #{issue_id}: создано {len(rendered) - len(failed)}/{len(rendered)} "
+                      f"пунктов за {elapsed_ms} мс, ошибки: {details}")
+    else:
+        logging.info(f"[CHECKLIST] #{issue_id}: создано {len(rendered)} пунктов за {elapsed_ms} мс")
+    return len(rendered) - len(failed)
+
 async def create_subtask_checklist(subtask_id: str, serial: str, defects: list, user_id: int):
     """Создаёт чек-лист в подзадаче на устранение несоответствий"""
-    headers = {
-        "X-Redmine-API-Key": get_user_api_token(user_id),
-        "Content-Type": "application/xml"
-    }
-    
     try:
-        checklist_items = []
-        position = 0
-        
-        # 1. Заголовок (СЕКЦИЯ!)
-        header = CHECKLIST_SUBTASK_HEADER.format(serial=serial)
-        checklist_items.append({
-            "subject": header,
-            "is_section": "1",  # Изменили True на "1" для XML
-            "is_done": "0",     # Добавили is_done
-            "position": position
-        })
-        position += 1
-        
-        # 2. Переместить на участок производства
-        checklist_items.append({
-            "subject": CHECKLIST_SUBTASK_MOVE_TO_PROD,
-            "is_section": "0",  # Добавили - обычный пункт
-            "is_done": "0",
-            "position": position
-        })
-        position += 1
-        
-        # 3. Исправить несоответствия (для каждого дефекта)
-        for defect in defects:
-            checklist_items.append({
-                "subject": f"{CHECKLIST_SUBTASK_FIX_PREFIX}{defect['description']}",
-                "is_section": "0",  # Добавили - обычный пункт
-                "is_done": "0",
-                "position": position
-            })
-            position += 1
-        
-        # 4. Провести проверку
-        checklist_items.append({
-            "subject": CHECKLIST_SUBTASK_CHECK,
-            "is_section": "0",  # Добавили - обычный пункт
-            "is_done": "0",
-            "position": position
-        })
-        position += 1
-        
-        # 5. Переместить на тестирование
-        checklist_items.append({
-            "subject": CHECKLIST_SUBTASK_MOVE_TO_TEST,
-            "is_section": "0",  # Добавили - обычный пункт
-            "is_done": "0",
-            "position": position
-        })
-        
-        # ДОБАВИМ ЛОГИРОВАНИЕ ПЕРЕД СОЗДАНИЕМ
-        logging.info(f"[CHECKLIST] Создаю чек-лист для подзадачи #{subtask_id}")
-        logging.info(f"[CHECKLIST] Количество пунктов: {len(checklist_items)}")
-        
-        # Создаём все пункты
-        async with aiohttp.ClientSession() as session:
-            for idx, item in enumerate(checklist_items):
-                is_section_label = "СЕКЦИЯ" if item.get("is_section") == "1" else "пункт"
-                logging.info(f"[CHECKLIST] Создаю {is_section_label} {idx+1}/{len(checklist_items)}: {item['subject'][:50]}...")
-                
-                checklist_el = ET.Element("checklist")
-                ET.SubElement(checklist_el, "issue_id").text = subtask_id
-                ET.SubElement(checklist_el, "subject").text = item["subject"]
-                ET.SubElement(checklist_el, "is_done").text = item["is_done"]
-                ET.SubElement(checklist_el, "is_section").text = item.get("is_section", "0")  # ДОБАВИЛИ ЭТО ПОЛЕ!
-                ET.SubElement(checklist_el, "position").text = str(item["position"])
-                
-                payload = ET.tostring(checklist_el, encoding="utf-8", method="xml")
-                
-                # ЛОГИРУЕМ PAYLOAD
-                logging.info(f"[CHECKLIST] XML payload: {payload.decode('utf-8')}")
-                
-                async with session.post(
-                    f"{REDMINE_URL}/issues/{subtask_id}/checklists.xml",
-                    headers=headers,
-                    data=payload,
-                    ssl=False
-                ) as resp:
-                    status = resp.status
-                    response_text = await resp.text()
-                    
-                    # ЛОГИРУЕМ ОТВЕТ
-                    logging.info(f"[CHECKLIST] HTTP {status}")
-                    
-                    if status not in (200, 201):
-                        logging.error(f"[CHECKLIST] Ошибка создания пункта чек-листа!")
-                        logging.error(f"[CHECKLIST] HTTP статус: {status}")
-                        logging.error(f"[CHECKLIST] Ответ сервера: {response_text[:500]}")
-                    else:
-                        logging.info(f"[CHECKLIST] ✅ Пункт создан успешно")
-        
-        logging.info(f"✅ Чек-лист создан для подзадачи #{subtask_id}")
-    
+        await create_checklist_from_template(
+            subtask_id, get_user_api_token(user_id), SUBTASK_CHECKLIST_TEMPLATE,
+            serial=serial, defects=defects,
+        )
     except Exception as e:
         logging.error(f"Ошибка create_subtask_checklist: {e}", exc_info=True)
 
 async def test_checklist_api(issue_id: str, user_id: int):
     """Тестирует доступность API чек-листов"""
-    headers = {"X-Redmine-API-Key": get_user_api_token(user_id)}
-    
     try:
         # Попробуем получить существующие чек-листы
-        url = f"{REDMINE_URL}/issues/{issue_id}/checklists.xml"
-        
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, headers=headers, ssl=False) as resp:
-                status = resp.status
-                text = await resp.text()
-                
-                logging.info(f"[TEST] GET checklists - HTTP {status}")
-                logging.info(f"[TEST] Response: {text[:500]}")
-                
-                if status == 404:
-                    logging.error("[TEST] ❌ API чек-листов недоступен (404)! Возможно плагин не установлен.")
-                    return False
-                
-                return True
+        items = await redmine.get_checklist(issue_id, get_user_api_token(user_id), fresh=True)
+        logging.info(f"[TEST] GET checklists - {len(items)} пунктов")
+        return True
+    
+    except RedmineError as e:
+        logging.info(f"[TEST] GET checklists - HTTP {e.status}")
+        logging.info(f"[TEST] Response: {e.body[:500]}")
+        if e.not_found:
+            logging.error("[TEST] ❌ API чек-листов недоступен (404)! Возможно плагин не установлен.")
+            return False
+        return True
     
     except Exception as e:
         logging.error(f"[TEST] Ошибка тестирования API: {e}")
@@ -3929,43 +3883,23 @@ async def update_control_task_checklist(issue_id: str, serial: str, subtask_id:
     2. Вставляет 4 новых пункта после "Нагрузочное тестирование"
     3. Отмечает 2 из них сразу
     """
-    headers = {
-        "X-Redmine-API-Key": get_user_api_token(user_id),
-        "Content-Type": "application/xml"
-    }
+    api_key = get_user_api_token(user_id)
     
     try:
         # Получаем чек-лист
-        async with aiohttp.ClientSession() as session:
-            async with session.get(
-                f"{REDMINE_URL}/issues/{issue_id}/checklists.xml",
-                headers=headers,
-                ssl=False
-            ) as resp:
-                if resp.status != 200:
-                    logging.error(f"Ошибка получения чек-листа: HTTP {resp.status}")
-                    return
-                xml_text = await resp.text()
-        
-        root = ET.fromstring(xml_text)
-        checklist_items = []
-        
-        for cl in root.findall("checklist"):
-            checklist_items.append({
-                "id": cl.findtext("id"),
-                "subject": (cl.findtext("subject") or "").strip(),
-                "is_done": cl.findtext("is_done") or "0",
-                "position": int(cl.findtext("position") or "0"),
-                "issue_id": cl.findtext("issue_id") or issue_id
-            })
+        try:
+            checklist_items = await redmine.get_checklist(issue_id, api_key)
+        except RedmineError as e:
+            logging.error(f"Ошибка получения чек-листа: HTTP {e.status}")
+            return
         
         # ===== 1. НАЙТИ БЛОК СЕРИЙНИКА =====
         
         serial_idx = None
         for idx, item in enumerate(checklist_items):
-            subj_l = item["subject"].lower()
+            subj_l = item.subject.lower()
             if ("проверка оборудования" in subj_l and 
-                serial.upper() in item["subject"].upper() and
+                serial.upper() in item.subject.upper() and
                 "указать" not in subj_l):
                 serial_idx = idx
                 break
@@ -3976,178 +3910,91 @@ async def update_control_task_checklist(issue_id: str, serial: str, subtask_id:
         
         # ===== 2. НАЙТИ ПОЗИЦИЮ ДЛЯ ВСТАВКИ =====
         
-        insert_after_position = None
+        insert_after_idx = None
         auto_check_until_position = None
         
         for idx in range(serial_idx + 1, len(checklist_items)):
             item = checklist_items[idx]
-            subj_l = item["subject"].lower()
+            subj_l = item.subject.lower()
             
             # Конец блока (новый серийник)
-            if "проверка оборудования" in subj_l and serial.upper() not in item["subject"].upper():
+            if "проверка оборудования" in subj_l and serial.upper() not in item.subject.upper():
                 break
             
             # Пункт для автоотметки (последний)
             if "проверка настройки и лицензирования" in subj_l and "видеонаблюдения" in subj_l:
-                auto_check_until_position = item["position"]
+                auto_check_until_position = item.position
             
             # Пункт после которого вставляем
             if "проведение нагрузочного тестирования" in subj_l:
-                insert_after_position = item["position"]
+                insert_after_idx = idx
         
-        if insert_after_position is None:
+        if insert_after_idx is None:
             logging.error("Не найден пункт 'Проведение нагрузочного тестирования'")
             return
         
         # ===== 3. ОТМЕТИТЬ ПУНКТЫ ОТ НАЧАЛА ДО "ПО ВИДЕОНАБЛЮДЕНИЯ" =====
         
         if auto_check_until_position:
-            async with aiohttp.ClientSession() as session:
-                for idx in range(serial_idx + 1, len(checklist_items)):
-                    item = checklist_items[idx]
-                    
-                    # Пропускаем заголовки
-                    subj_l = item["subject"].lower()
-                    if ("проверка оборудования" in subj_l or
-                        "комплектация оборудования" in subj_l or
-                        "выдача готового" in subj_l):
-                        continue
-                    
-                    # Отмечаем до нужного пункта включительно
-                    if item["position"] <= auto_check_until_position:
-                        if item["is_done"] not in ("1", "true"):
-                            await mark_checklist_item(item["id"], item["issue_id"], item["subject"], user_id)
-                    else:
-                        break
+            to_mark = []
+            for idx in range(serial_idx + 1, len(checklist_items)):
+                item = checklist_items[idx]
+                
+                # Пропускаем заголовки
+                subj_l = item.subject.lower()
+                if ("проверка оборудования" in subj_l or
+                    "комплектация оборудования" in subj_l or
+                    "выдача готового" in subj_l):
+                    continue
+                
+                # Отмечаем до нужного пункта включительно
+                if item.position <= auto_check_until_position:
+                    if not item.is_done:
+                        to_mark.append(item)
+                else:
+                    break
+            
+            await set_checklist_items_done(to_mark, api_key, issue_id, checklist_items)
         
         # ===== 4. ВСТАВИТЬ 4 НОВЫХ ПУНКТА =====
-        
+        # Позиции — в промежутке после "Нагрузочное тестирование" (plan_positions),
+        # пункты создаются параллельно; двое отмечены сразу
         new_items = [
-            {
-                "subject": CHECKLIST_DEFECT_HEADER,
-                "is_done": "0",
-                "is_section": "1",  # ЭТО КЛЮЧЕВОЕ ПОЛЕ - делает элемент секцией!
-                "position": insert_after_position + 1
-            },
-            {
-                "subject": CHECKLIST_DEFECT_PHOTO,
-                "is_done": "1",  # Отмечаем сразу
-                "is_section": "0",  # Обычный пункт
-                "position": insert_after_position + 2
-            },
-            {
-                "subject": CHECKLIST_DEFECT_SUBTASK,
-                "is_done": "1",  # Отмечаем сразу
-                "is_section": "0",  # Обычный пункт
-                "position": insert_after_position + 3
-            },
-            {
-                "subject": CHECKLIST_DEFECT_RECHECK,
-                "is_done": "0",
-                "is_section": "0",  # Обычный пункт
-                "position": insert_after_position + 4
-            }
+            {"subject": CHECKLIST_DEFECT_HEADER, "is_done": False, "is_section": True},
+            {"subject": CHECKLIST_DEFECT_PHOTO, "is_done": True, "is_section": False},
+            {"subject": CHECKLIST_DEFECT_SUBTASK, "is_done": True, "is_section": False},
+            {"subject": CHECKLIST_DEFECT_RECHECK, "is_done": False, "is_section": False},
         ]
-        
-        async with aiohttp.ClientSession() as session:
-            for new_item in new_items:
-                checklist_el = ET.Element("checklist")
-                ET.SubElement(checklist_el, "issue_id").text = issue_id
-                ET.SubElement(checklist_el, "subject").text = new_item["subject"]
-                ET.SubElement(checklist_el, "is_done").text = new_item["is_done"]
-                ET.SubElement(checklist_el, "is_section").text = new_item["is_section"]  # ДОБАВИЛИ ЭТО ПОЛЕ
-                ET.SubElement(checklist_el, "position").text = str(new_item["position"])
-                
-                payload = ET.tostring(checklist_el, encoding="utf-8", method="xml")
-                
-                async with session.post(
-                    f"{REDMINE_URL}/issues/{issue_id}/checklists.xml",
-                    headers=headers,
-                    data=payload,
-                    ssl=False
-                ) as resp:
-                    if resp.status not in (200, 201):
-                        error_text = await resp.text()
-                        logging.error(f"Ошибка вставки пункта '{new_item['subject']}': HTTP {resp.status}")
-                        logging.error(f"Ответ сервера: {error_text}")
+        items = list(checklist_items)
+        target = items[:insert_after_idx + 1] + new_items + items[insert_after_idx + 1:]
+        if not await write_checklist_order(issue_id, api_key, target):
+            logging.error(f"Чек-лист задачи контроля #{issue_id} обновлён не полностью")
+            return
         
         logging.info(f"✅ Чек-лист задачи контроля #{issue_id} обновлён")
     
     except Exception as e:
         logging.error(f"Ошибка update_control_task_checklist: {e}", exc_info=True)
 
-async def mark_checklist_item(item_id: str, issue_id: str, subject: str, user_id: int):
-    """Отмечает один пункт чек-листа"""
-    headers = {
-        "X-Redmine-API-Key": get_user_api_token(user_id),
-        "Content-Type": "application/xml"
-    }
-    
-    try:
-        checklist_el = ET.Element("checklist")
-        ET.SubElement(checklist_el, "id").text = item_id
-        ET.SubElement(checklist_el, "issue_id").text = issue_id
-        ET.SubElement(checklist_el, "subject").text = subject
-        ET.SubElement(checklist_el, "is_done").text = "1"
-        
-        payload = ET.tostring(checklist_el, encoding="utf-8", method="xml")
-        
-        async with aiohttp.ClientSession() as session:
-            async with session.put(
-                f"{REDMINE_URL}/checklists/{item_id}.xml",
-                headers=headers,
-                data=payload,
-                ssl=False
-            ) as resp:
-                if resp.status not in (200, 201, 422):
-                    logging.error(f"Ошибка отметки пункта: HTTP {resp.status}")
-    
-    except Exception as e:
-        logging.error(f"Ошибка mark_checklist_item: {e}")
-        
 async def upload_photo_to_redmine_by_id(issue_id: str, file_id: str, user_id: int):
     """Загружает фото в Redmine по file_id из Telegram"""
-    headers = {"X-Redmine-API-Key": get_user_api_token(user_id)}
+    api_key = get_user_api_token(user_id)
     
     try:
-        # Скачиваем файл из Telegram
-        file = await bot.get_file(file_id)
-        file_url = f"https://api.telegram.org/file/bot{TELEGRAM_TOKEN}/{file.file_path}"
-        filename = file.file_path.split("/")[-1]
-        
-        async with aiohttp.ClientSession() as session:
-            async with session.get(file_url, ssl=False) as resp:
-                photo_data = await resp.read()
-            
-            # Загружаем в Redmine
-            upload_url = f"{REDMINE_URL}/uploads.json"
-            async with session.post(
-                upload_url,
-                headers={**headers, "Content-Type": "application/octet-stream"},
-                data=photo_data,
-                ssl=False
-            ) as resp:
-                if resp.status not in (200, 201):
-                    logging.error(f"Ошибка загрузки файла: HTTP {resp.status}")
-                    return
-                upload_info = await resp.json()
-                token = upload_info["upload"]["token"]
-            
-            # Прикрепляем к задаче
-            payload = {
-                "issue": {
-                    "uploads": [{"token": token, "filename": filename, "content_type": "image/jpeg"}]
-                }
-            }
-            
-            async with session.put(
-                f"{REDMINE_URL}/issues/{issue_id}.json",
-                headers={**headers, "Content-Type": "application/json"},
-                json=payload,
-                ssl=False
-            ) as resp:
-                if resp.status in (200, 204):
-                    logging.info(f"✅ Фото прикреплено к задаче #{issue_id}")
+        # Перекладываем файл из Telegram в Redmine потоком
+        try:
+            token, filename = await upload_telegram_file(file_id, api_key)
+        except RedmineError as e:
+            logging.error(f"Ошибка загрузки файла: HTTP {e.status}")
+            return
+        
+        # Прикрепляем к задаче
+        try:
+            await redmine.attach(issue_id, api_key, token, filename, "image/jpeg")
+        except RedmineError as e:
+            logging.error(f"Не удалось прикрепить фото к задаче #{issue_id}: {e}")
+            return
+        logging.info(f"✅ Фото прикреплено к задаче #{issue_id}")
     
     except Exception as e:
         logging.error(f"Ошибка upload_photo_to_redmine_by_id: {e}")
@@ -0,0 +1,259 @@
+"""
+Модель чек-листа задачи контроля (плагин redmine_checklists).
+
+Чек-лист состоит из блоков оборудования: заголовок "Проверка оборудования <S/N>"
+(или "... указать серийный номер" — ещё не заполненный блок) и пункты до следующего
+такого заголовка. Индекс блоков строится за один проход при загрузке чек-листа,
+поэтому поиск блока по серийнику — O(1), а работа с блоком — O(размер блока).
+"""
+import xml.etree.ElementTree as ET
+from typing import Optional, List, Dict, Iterable, Iterator, Tuple, Union
+
+BLOCK_HEADER = "проверка оборудования"
+PLACEHOLDER_MARK = "указать"
+# Подзаголовки внутри блока: не считаются пунктами проверки
+SUBHEADERS = ("комплектация оборудования", "выдача готового")
+# Шаг позиций новых пунктов: между соседями остаётся место для вставки без сдвига остальных
+POSITION_STEP = 10
+
+class ChecklistItem:
+    """Пункт чек-листа"""
+    __slots__ = ("id", "issue_id", "subject", "is_done", "position", "is_section")
+
+    def __init__(self, id: int, issue_id: Optional[int], subject: str, is_done: bool, position: int,
+                 is_section: Optional[bool] = None):
+        self.id = id
+        self.issue_id = issue_id
+        self.subject = subject
+        self.is_done = is_done
+        self.position = position
+        self.is_section = is_section   # None — поле не пришло в XML
+
+    def __repr__(self) -> str:
+        return (f"ChecklistItem(id={self.id}, subject={self.subject!r}, is_done={self.is_done}, "
+                f"position={self.position})")
+
+    @classmethod
+    def from_xml(cls, el: ET.Element) -> "ChecklistItem":
+        is_section = el.findtext("is_section")
+        issue_id = el.findtext("issue_id")
+        return cls(
+            id=int(el.findtext("id") or 0),
+            issue_id=int(issue_id) if issue_id else None,
+            subject=(el.findtext("subject") or "").strip(),
+            is_done=(el.findtext("is_done") or "0") in ("1", "true"),
+            position=int(el.findtext("position") or 0),
+            is_section=None if is_section is None else is_section == "true",
+        )
+
+def block_serial(subject: str) -> Optional[str]:
+    """
+    Серийник из заголовка блока: "Проверка оборудования ABC123" → "ABC123".
+    "" — заголовок без серийника (указать серийный номер), None — не заголовок.
+    """
+    pos = subject.lower().find(BLOCK_HEADER)
+    if pos < 0:
+        return None
+    if PLACEHOLDER_MARK in subject.lower():
+        return ""
+    return subject[pos + len(BLOCK_HEADER):].strip().upper()
+
+def is_subheader(subject_lower: str) -> bool:
+    return any(mark in subject_lower for mark in SUBHEADERS)
+
+class SerialBlock:
+    """Блок оборудования: items[start] — заголовок, items[start+1 .. end] — пункты"""
+    __slots__ = ("serial", "start", "end", "done", "total")
+
+    def __init__(self, serial: str, start: int, end: int):
+        self.serial = serial
+        self.start = start
+        self.end = end
+        self.done = 0     # отмеченных пунктов проверки (без заголовков)
+        self.total = 0
+
+    @property
+    def complete(self) -> bool:
+        return self.done >= self.total
+
+class Checklist:
+    """
+    Пункты чек-листа в порядке position + индекс блоков оборудования.
+    Список пунктов не изменяется на месте: добавление/удаление создают новый список,
+    так что уже идущий по чек-листу цикл не сбивается.
+    """
+
+    def __init__(self, items: List[ChecklistItem]):
+        self.items = sorted(items, key=lambda item: item.position)
+        self._reindex()
+
+    def _reindex(self):
+        """Один проход: блоки, серийник → блок, пункт → блок, счётчики done/total"""
+        self.blocks: List[SerialBlock] = []
+        self._by_serial: Dict[str, SerialBlock] = {}
+        self._block_of: Dict[int, SerialBlock] = {}
+        block = None
+        for idx, item in enumerate(self.items):
+            serial = block_serial(item.subject)
+            if serial is not None:
+                if block is not None:
+                    block.end = idx - 1
+                block = SerialBlock(serial, idx, len(self.items) - 1)
+                self.blocks.append(block)
+                if serial:
+                    self._by_serial.setdefault(serial, block)
+                continue
+            if block is None:
+                continue
+            self._block_of[item.id] = block
+            if not is_subheader(item.subject.lower()):
+                block.total += 1
+                block.done += item.is_done
+
+    def __iter__(self) -> Iterator[ChecklistItem]:
+        return iter(self.items)
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def __getitem__(self, idx):
+        return self.items[idx]
+
+    def block(self, serial: str) -> Optional[SerialBlock]:
+        """Блок серийника; если точного совпадения нет — первый заголовок, содержащий серийник"""
+        serial = (serial or "").strip().upper()
+        if not serial:
+            return None
+        found = self._by_serial.get(serial)
+        if found is None:
+            found = next((b for b in self.blocks if b.serial and serial in b.serial), None)
+        return found
+
+    def block_items(self, serial: str) -> List[ChecklistItem]:
+        """Пункты блока без заголовка; [] — серийника в чек-листе нет"""
+        found = self.block(serial)
+        return self.items[found.start + 1:found.end + 1] if found else []
+
+    def serial_blocks(self) -> List[SerialBlock]:
+        """Блоки с заполненным серийником, в порядке чек-листа"""
+        return [b for b in self.blocks if b.serial]
+
+    def find(self, item_id: int) -> Optional[ChecklistItem]:
+        return next((item for item in self.items if item.id == item_id), None)
+
+    def update_item(self, item_id: int, **fields):
+        """Применяет изменённые поля пункта; отметка пересчитывает только счётчик его блока"""
+        item = self.find(int(item_id))
+        if item is None:
+            return
+        fields = {name: value for name, value in fields.items() if value is not None}
+        structural = ("subject" in fields and fields["subject"] != item.subject) or \
+                     ("position" in fields and fields["position"] != item.position)
+        was_done = item.is_done
+        for name, value in fields.items():
+            setattr(item, name, value)
+        if structural:
+            self.items = sorted(self.items, key=lambda i: i.position)
+            self._reindex()
+        elif item.is_done != was_done:
+            block = self._block_of.get(item.id)
+            if block is not None and not is_subheader(item.subject.lower()):
+                block.done += 1 if item.is_done else -1
+
+    def add(self, item: ChecklistItem):
+        self.items = sorted(self.items + [item], key=lambda i: i.position)
+        self._reindex()
+
+    def remove(self, item_id: int):
+        self.remove_many([item_id])
+
+    def remove_many(self, item_ids: Iterable[int]):
+        """Убирает пункты разом: индекс блоков перестраивается один раз на всю пачку"""
+        removed = {int(i) for i in item_ids}
+        self.items = [i for i in self.items if i.id not in removed]
+        self._reindex()
+
+def plan_positions(target: List[Union[ChecklistItem, dict]],
+                   step: int = POSITION_STEP) -> Tuple[List[Tuple[ChecklistItem, int]], List[Tuple[dict, int]]]:
+    """
+    Позиции для чек-листа в порядке target. Существующие пункты (ChecklistItem) остаются
+    на своих позициях, пока порядок не нарушен; новые (dict с subject, is_done, is_section)
+    равномерно занимают промежуток между соседями. Если места в промежутке нет, новые
+    ставятся с шагом step, а следующий пункт сдвигается за них — сдвиг идёт дальше,
+    только пока пункты не разойдутся, так что число запросов зависит от размера вставки,
+    а не чек-листа. Возвращает только изменения:
+    (перемещения [(пункт, позиция)], создания [(новый пункт, позиция)]).
+    """
+    moves: List[Tuple[ChecklistItem, int]] = []
+    creates: List[Tuple[dict, int]] = []
+    last = 0
+    pending: List[dict] = []
+    for entry in target:
+        if isinstance(entry, dict):
+            pending.append(entry)
+            continue
+        if entry.position - last > len(pending):
+            gap = (entry.position - last) // (len(pending) + 1)
+            for offset, new in enumerate(pending, 1):
+                creates.append((new, last + gap * offset))
+            last = entry.position
+        else:
+            for offset, new in enumerate(pending, 1):
+                creates.append((new, last + step * offset))
+            last += step * (len(pending) + 1)
+            moves.append((entry, last))
+        pending = []
+    for offset, new in enumerate(pending, 1):
+        creates.append((new, last + step * offset))
+    return moves, creates
+
+def parse_checklist_xml(xml_text: str) -> Checklist:
+    """Ответ /issues/<id>/checklists.xml → чек-лист с индексом блоков"""
+    root = ET.fromstring(xml_text)
+    return Checklist([ChecklistItem.from_xml(cl) for cl in root.findall("checklist")])
+
+def checklist_item_xml(issue_id: Optional[int] = None, subject: Optional[str] = None,
+                       is_done: Optional[bool] = None, position: Optional[int] = None,
+                       is_section: Optional[bool] = None) -> bytes:
+    """XML пункта чек-листа; в документ попадают только заданные поля"""
+    el = ET.Element("checklist")
+    if issue_id is not None:
+        ET.SubElement(el, "issue_id").text = str(issue_id)
+    if subject is not None:
+        ET.SubElement(el, "subject").text = subject
+    if is_done is not None:
+        ET.SubElement(el, "is_done").text = "1" if is_done else "0"
+    if position is not None:
+        ET.SubElement(el, "position").text = str(position)
+    if is_section is not None:
+        ET.SubElement(el, "is_section").text = "true" if is_section else "false"
+    return ET.tostring(el, encoding="utf-8", method="xml")
+
+class ChecklistTemplate:
+    """
+    Шаблон чек-листа: строки {"subject", "is_section", "is_done", "repeat"}.
+    subject — шаблон str.format; строка с repeat="<имя>" повторяется для каждого
+    элемента списка <имя> (элемент доступен как {item}). render() один раз превращает
+    шаблон в готовые XML-документы с явными позициями (с шагом step — под будущие
+    вставки), поэтому пункты можно создавать параллельно — порядок задают позиции,
+    а не очередь запросов.
+    """
+
+    def __init__(self, rows: List[dict]):
+        self.rows = rows
+
+    def render(self, issue_id: int, start: int = POSITION_STEP, step: int = POSITION_STEP,
+               **values) -> List[Tuple[int, str, bytes]]:
+        """[(позиция, subject, XML пункта), ...] в порядке чек-листа"""
+        rendered = []
+        position = start
+        for row in self.rows:
+            repeat = row.get("repeat")
+            for item in (values[repeat] if repeat else [None]):
+                subject = row["subject"].format(item=item, **values)
+                payload = checklist_item_xml(issue_id=issue_id, subject=subject,
+                                             is_done=row.get("is_done", False), position=position,
+                                             is_section=row.get("is_section", False))
+                rendered.append((position, subject, payload))
+                position += step
+        return rendered
@@ -64,6 +64,45 @@ REDMINE_API_TOKEN = "349f8y340987fh0934hf04237hy"
 # === ВАЛИДАЦИЯ СЕРИЙНЫХ НОМЕРОВ ===
 ALLOWED_SERIAL_PREFIXES = ["PC", "CE"]
 
+# === OCR ===
+# Как часто (в распознаваниях) писать в лог сводку по времени этапов OCR
+OCR_STATS_LOG_EVERY = int(os.getenv("OCR_STATS_LOG_EVERY", "20"))
+
+# Консенсус по нескольким кадрам (альбом или серия фото одной этикетки)
+CONSENSUS_WINDOW_SEC = float(os.getenv("CONSENSUS_WINDOW_SEC", "1.5"))   # сколько ждать следующий кадр серии
+CONSENSUS_QUORUM = int(os.getenv("CONSENSUS_QUORUM", "2"))               # сколько кадров с одинаковым S/N достаточно для ответа
+CONSENSUS_MAX_FRAMES = int(os.getenv("CONSENSUS_MAX_FRAMES", "5"))       # максимум кадров в одной серии
+CONSENSUS_SINGLE_FRAME_CONFIDENCE = float(os.getenv("CONSENSUS_SINGLE_FRAME_CONFIDENCE", "0.9"))  # одиночный кадр с такой уверенностью принимается сразу
+VIDEO_MAX_SIZE_MB = int(os.getenv("VIDEO_MAX_SIZE_MB", "20"))            # лимит getFile Bot API: больше Telegram не отдаёт
+
+# === REDMINE: ПУЛ СОЕДИНЕНИЙ ===
+REDMINE_POOL_LIMIT = int(os.getenv("REDMINE_POOL_LIMIT", "20"))      # соединений к Redmine одновременно
+REDMINE_KEEPALIVE_SEC = float(os.getenv("REDMINE_KEEPALIVE_SEC", "60"))  # сколько держать простаивающее соединение
+REDMINE_DNS_TTL_SEC = int(os.getenv("REDMINE_DNS_TTL_SEC", "300"))   # кэш DNS-резолва
+REDMINE_TIMEOUT_SEC = float(os.getenv("REDMINE_TIMEOUT_SEC", "15"))  # дедлайн вызова API вместе с повторами
+REDMINE_UPLOAD_TIMEOUT_SEC = float(os.getenv("REDMINE_UPLOAD_TIMEOUT_SEC", "120"))  # дедлайн загрузки файла
+REDMINE_UPLOAD_CHUNK_KB = int(os.getenv("REDMINE_UPLOAD_CHUNK_KB", "64"))  # кусок потоковой загрузки файла из Telegram
+REDMINE_RETRIES = int(os.getenv("REDMINE_RETRIES", "3"))             # повторов идемпотентных запросов
+REDMINE_VERIFY_SSL = os.getenv("REDMINE_VERIFY_SSL", "0") == "1"  # проверять сертификат Redmine (по умолчанию нет, как раньше)
+REDMINE_FANOUT_LIMIT = int(os.getenv("REDMINE_FANOUT_LIMIT", "8"))  # параллельных запросов одного обхода задач
+CHECKLIST_WRITE_LIMIT = int(os.getenv("CHECKLIST_WRITE_LIMIT", "16"))  # параллельных записей в один чек-лист
+CHECKLIST_PROGRESS_EDIT_SEC = float(os.getenv("CHECKLIST_PROGRESS_EDIT_SEC", "2"))  # не чаще — правка сообщения с прогрессом
+CHECKLIST_CACHE_TTL_SEC = float(os.getenv("CHECKLIST_CACHE_TTL_SEC", "30"))  # свежесть кэша чек-листов (0 — без кэша)
+
+# === ЛОКАЛЬНЫЙ ИНДЕКС S/N И ЗЕРКАЛО REDMINE ===
+LOCAL_DB_PATH = os.getenv("LOCAL_DB_PATH", "redmine_cache.sqlite3")           # SQLite: индекс S/N и зеркало задач
+SERIAL_INDEX_SYNC_SEC = int(os.getenv("SERIAL_INDEX_SYNC_SEC", "900"))       # период фоновой синхронизации (0 — выкл.)
+LEXICON_SNAP_CONFIDENCE = float(os.getenv("LEXICON_SNAP_CONFIDENCE", "0.9"))  # валидный S/N правится по справочнику только ниже этой уверенности OCR
+REDMINE_MIRROR_SYNC_SEC = int(os.getenv("REDMINE_MIRROR_SYNC_SEC", "120"))   # опрос изменённых задач (0 — без зеркала)
+REDMINE_MIRROR_BACKFILL_DAYS = int(os.getenv("REDMINE_MIRROR_BACKFILL_DAYS", "180"))  # глубина первой загрузки
+REDMINE_MIRROR_PRUNE_SEC = int(os.getenv("REDMINE_MIRROR_PRUNE_SEC", "21600"))  # сверка id зеркала с Redmine: удалённые задачи (0 — без сверки)
+
+# === КЭШ ФАЙЛОВ TELEGRAM ===
+TG_FILE_CACHE_MB = int(os.getenv("TG_FILE_CACHE_MB", "64"))                  # байты фото для OCR и загрузки (0 — выкл.)
+TG_FILE_CACHE_TTL_SEC = float(os.getenv("TG_FILE_CACHE_TTL_SEC", "900"))     # сколько держать скачанный файл
+TG_FILE_PATH_TTL_SEC = float(os.getenv("TG_FILE_PATH_TTL_SEC", "3000"))      # file_path из getFile (ссылка живёт ≥ 1 ч)
+TG_DOWNLOAD_TIMEOUT_SEC = int(os.getenv("TG_DOWNLOAD_TIMEOUT_SEC", "120"))    # скачивание файла из Telegram
+
 # === СТАТУСЫ ЗАДАЧ ===
 STATUS_NEW = 1
 STATUS_IN_PROGRESS = 2
@@ -0,0 +1,610 @@
+"""
+Клиент Redmine: одна долгоживущая aiohttp-сессия с пулом соединений на всё приложение
+и типизированные методы поверх REST API и API плагина чек-листов.
+
+Сессия создаётся при старте бота и закрывается при остановке; API-ключ
+пользователя передаётся в заголовках каждого запроса, а не в сессии.
+
+У каждого вызова есть дедлайн; идемпотентные запросы (GET/PUT/DELETE) повторяются
+с экспоненциальной паузой со случайным разбросом при сетевых ошибках, таймаутах,
+429 и 5xx. Ошибки поднимаются как RedmineError с методом, путём и HTTP-статусом.
+"""
+import random
+import asyncio
+import logging
+import aiohttp
+import xml.etree.ElementTree as ET
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Optional, AsyncIterator, Awaitable, Callable, Iterable, List, Dict, Any, Tuple
+
+from checklist_model import Checklist, ChecklistItem, parse_checklist_xml, checklist_item_xml
+
+TRANSIENT_STATUSES = (429, 500, 502, 503, 504)
+IDEMPOTENT_METHODS = ("GET", "HEAD", "PUT", "DELETE")
+
+class RedmineError(Exception):
+    """Ошибка обращения к Redmine. status=None — сеть или таймаут (ответа не было)."""
+
+    def __init__(self, method: str, path: str, status: Optional[int] = None, body: str = "", reason: str = ""):
+        self.method = method
+        self.path = path
+        self.status = status
+        self.body = body
+        self.reason = reason
+        detail = f"HTTP {status}" if status is not None else (reason or "нет ответа")
+        super().__init__(f"{method} {path}: {detail}")
+
+    @property
+    def transient(self) -> bool:
+        """Имеет смысл повторить: нет ответа, 429 или 5xx"""
+        return self.status is None or self.status in TRANSIENT_STATUSES
+
+    @property
+    def not_found(self) -> bool:
+        return self.status == 404
+
+async def gather_limited(func: Callable[[Any], Awaitable[Any]], args: Iterable[Any], limit: int = 8) -> List[Any]:
+    """
+    Вызывает func(arg) для всех args параллельно, но не больше limit одновременно.
+    Результаты — в порядке args; исключение возвращается на месте результата.
+    """
+    semaphore = asyncio.Semaphore(max(1, limit))
+
+    async def run(arg):
+        async with semaphore:
+            return await func(arg)
+
+    return await asyncio.gather(*(run(arg) for arg in args), return_exceptions=True)
+
+class ChecklistCache:
+    """
+    Разобранные чек-листы задач с коротким TTL.
+    Изменения, сделанные через клиент, применяются к закэшированной копии (write-through),
+    так что цепочка «прочитать → отметить → пересчитать процент» не перечитывает чек-лист.
+    Правки в обход бота (веб-интерфейс Redmine) видны не позже чем через ttl секунд.
+    Копия одна на задачу, но отдаётся только ключам, которые сами читали чек-лист
+    не раньше ttl назад: доступ у пользователей разный, клиент — общий.
+    """
+
+    def __init__(self, ttl: float = 30, max_issues: int = 256):
+        self.ttl = ttl
+        self.max_issues = max_issues
+        self._entries: "OrderedDict[str, Tuple[float, Checklist]]" = OrderedDict()
+        self._readers: Dict[str, Dict[str, float]] = {}    # задача → {api_key: когда читал}
+        self._item_issue: Dict[int, str] = {}
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _now() -> float:
+        return asyncio.get_running_loop().time()
+
+    def _checklist_of(self, item_id: int) -> Optional[Checklist]:
+        key = self._item_issue.get(int(item_id))
+        entry = self._entries.get(key) if key else None
+        return entry[1] if entry else None
+
+    def get(self, issue_id, api_key: str) -> Optional[Checklist]:
+        key = str(issue_id)
+        entry = self._entries.get(key)
+        now = self._now()
+        if entry is None or now - entry[0] > self.ttl:
+            if entry is not None:
+                self.invalidate(key)
+            self.misses += 1
+            return None
+        read_at = self._readers.get(key, {}).get(api_key)
+        if read_at is None or now - read_at > self.ttl:
+            # Этот ключ задачу не читал — права проверит запрос в Redmine с ним
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    def put(self, issue_id, checklist: Checklist, api_key: str):
+        if self.ttl <= 0:
+            return
+        key = str(issue_id)
+        now = self._now()
+        readers = {k: t for k, t in self._readers.get(key, {}).items() if now - t <= self.ttl}
+        readers[api_key] = now
+        self.invalidate(key)
+        self._entries[key] = (now, checklist)
+        self._readers[key] = readers
+        for item in checklist:
+            self._item_issue[item.id] = key
+        while len(self._entries) > self.max_issues:
+            self.invalidate(next(iter(self._entries)))
+
+    def invalidate(self, issue_id):
+        entry = self._entries.pop(str(issue_id), None)
+        self._readers.pop(str(issue_id), None)
+        if entry:
+            for item in entry[1]:
+                self._item_issue.pop(item.id, None)
+
+    def invalidate_item(self, item_id: int):
+        """Сбрасывает копию задачи, которой принадлежит пункт"""
+        key = self._item_issue.get(int(item_id))
+        if key:
+            self.invalidate(key)
+
+    def update_item(self, item_id: int, **fields):
+        """Применяет изменённые поля пункта к копии в кэше"""
+        checklist = self._checklist_of(item_id)
+        if checklist is not None:
+            checklist.update_item(item_id, **fields)
+
+    def add_item(self, issue_id, item: Optional[ChecklistItem]):
+        """Новый пункт; без id (ответ не разобран) копия просто сбрасывается"""
+        key = str(issue_id)
+        entry = self._entries.get(key)
+        if not entry:
+            return
+        if item is None or not item.id:
+            self.invalidate(key)
+            return
+        entry[1].add(item)
+        self._item_issue[item.id] = key
+
+    def remove_item(self, item_id: int):
+        self.remove_items([item_id])
+
+    def remove_items(self, item_ids: Iterable[int]):
+        """Убирает пункты из копий; каждая копия перестраивается один раз на пачку"""
+        by_issue: Dict[str, List[int]] = {}
+        for item_id in item_ids:
+            key = self._item_issue.pop(int(item_id), None)
+            if key in self._entries:
+                by_issue.setdefault(key, []).append(int(item_id))
+        for key, ids in by_issue.items():
+            self._entries[key][1].remove_many(ids)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "saved_gets": self.hits,
+            "fetches": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else None,
+            "issues": len(self._entries),
+        }
+
+class IssueLoader:
+    """
+    Пакетная загрузка задач по id в пределах одного запроса пользователя.
+    Много id склеиваются в issues.json?issue_id=1,2,3&status_id=* (кусками, чтобы
+    не упереться в длину URL); загруженное запоминается, повторно не запрашивается.
+    Задачи — в формате списка issues.json (без journals/attachments/children).
+    """
+
+    def __init__(self, client: "RedmineClient", api_key: str, max_ids_chars: int = 1500, parallel: int = 4):
+        self.client = client
+        self.api_key = api_key
+        self.max_ids_chars = max_ids_chars
+        self.parallel = parallel
+        self._issues: Dict[str, Optional[dict]] = {}    # None — нет доступа или удалена
+        self.requests = 0
+
+    def _chunks(self, ids: List[str]) -> List[List[str]]:
+        chunks: List[List[str]] = []
+        size = 0
+        for issue_id in ids:
+            if not chunks or size + len(issue_id) + 1 > self.max_ids_chars:
+                chunks.append([])
+                size = 0
+            chunks[-1].append(issue_id)
+            size += len(issue_id) + 1
+        return chunks
+
+    async def _load_chunk(self, chunk: List[str]):
+        self.requests += 1
+        issues = await self.client.list_issues(
+            self.api_key, {"issue_id": ",".join(chunk), "status_id": "*"}
+        )
+        for issue_id in chunk:
+            self._issues[issue_id] = None
+        for issue in issues:
+            self._issues[str(issue["id"])] = issue
+
+    async def load_many(self, issue_ids: Iterable[Any]) -> Dict[str, dict]:
+        """{id: задача} для доступных задач из issue_ids; куски с ошибкой запрашиваются снова при следующем вызове"""
+        ids = list(dict.fromkeys(str(i) for i in issue_ids))
+        missing = [i for i in ids if i not in self._issues]
+        if missing:
+            results = await gather_limited(self._load_chunk, self._chunks(missing), self.parallel)
+            errors = [r for r in results if isinstance(r, Exception)]
+            if errors and len(errors) == len(results):
+                # Ни один кусок не загрузился — это ошибка, а не «задач нет»
+                raise errors[0]
+        return {i: self._issues[i] for i in ids if self._issues.get(i) is not None}
+
+    async def get(self, issue_id) -> Optional[dict]:
+        return (await self.load_many([issue_id])).get(str(issue_id))
+
+class IssueTree:
+    """
+    Граф задач «родитель → подзадачи» в пределах одного запроса пользователя.
+    Узел грузится одним GET /issues/<id>.json?include=children,attachments: вместе с ним
+    приходят родитель и все потомки (id, subject), поэтому подзадачи уже раскрытой ветки
+    повторно не запрашиваются. Задачи без подзадач догружаются пакетом через IssueLoader.
+    """
+    INCLUDE = "children,attachments"
+
+    def __init__(self, client: "RedmineClient", api_key: str, parallel: int = 8):
+        self.client = client
+        self.api_key = api_key
+        self.parallel = parallel
+        self.loader = IssueLoader(client, api_key)
+        self._nodes: Dict[str, dict] = {}              # загружены с include
+        self._stubs: Dict[str, dict] = {}              # {id, subject, ...} из списков потомков
+        self._children: Dict[str, List[dict]] = {}
+        self._parent: Dict[str, Optional[str]] = {}    # None — корневая задача
+        self.requests = 0
+
+    def _add_children(self, parent_id: str, children: List[dict]):
+        self._children[parent_id] = children
+        for child in children:
+            child_id = str(child["id"])
+            self._stubs.setdefault(child_id, child)
+            self._parent[child_id] = parent_id
+            # Redmine не отдаёт ключ children у задач без подзадач
+            self._add_children(child_id, child.get("children", []))
+
+    def _add_issue(self, issue_id: str, issue: dict):
+        parent = issue.get("parent")
+        self._parent[issue_id] = str(parent["id"]) if parent else None
+
+    async def _load_node(self, issue_id: str):
+        self.requests += 1
+        issue = await self.client.get_issue(issue_id, self.api_key, include=self.INCLUDE)
+        self._nodes[issue_id] = issue
+        self._add_issue(issue_id, issue)
+        self._add_children(issue_id, issue.get("children", []))
+
+    async def node(self, issue_id) -> dict:
+        """Задача с подзадачами и вложениями; ошибки Redmine пробрасываются"""
+        issue_id = str(issue_id)
+        if issue_id not in self._nodes:
+            await self._load_node(issue_id)
+        return self._nodes[issue_id]
+
+    async def nodes(self, issue_ids: Iterable[Any]) -> List[dict]:
+        """То же для нескольких задач (параллельно); порядок — как в issue_ids, ошибка → {}"""
+        ids = [str(i) for i in issue_ids]
+        missing = list(dict.fromkeys(i for i in ids if i not in self._nodes))
+        results = await gather_limited(self._load_node, missing, self.parallel)
+        for issue_id, result in zip(missing, results):
+            if isinstance(result, Exception):
+                logging.warning(f"[REDMINE] Задача #{issue_id} не загружена: {result}")
+        return [self._nodes.get(i, {}) for i in ids]
+
+    async def children(self, issue_ids: Iterable[Any]) -> List[List[dict]]:
+        """Подзадачи каждой задачи (с вложенными children); известные ветки не запрашиваются"""
+        ids = [str(i) for i in issue_ids]
+        await self.nodes(i for i in ids if i not in self._children)
+        return [self._children.get(i, []) for i in ids]
+
+    async def issues(self, issue_ids: Iterable[Any]) -> List[dict]:
+        """Задачи без гарантии children/attachments; недостающие — пакетом. Порядок сохраняется, нет доступа → {}"""
+        ids = [str(i) for i in issue_ids]
+        missing = [i for i in ids if i not in self._nodes and i not in self._stubs]
+        if missing:
+            try:
+                for issue_id, issue in (await self.loader.load_many(missing)).items():
+                    self._stubs[issue_id] = issue
+                    self._add_issue(issue_id, issue)
+            except RedmineError as e:
+                logging.warning(f"[REDMINE] Пакетная загрузка задач {missing} не удалась: {e}")
+        return [self._nodes.get(i) or self._stubs.get(i) or {} for i in ids]
+
+    async def parent_ids(self, issue_ids: Iterable[Any]) -> List[str]:
+        """Родители задач без повторов, в порядке issue_ids; неизвестные связи догружаются пакетом"""
+        ids = [str(i) for i in issue_ids]
+        await self.issues(i for i in ids if i not in self._parent)
+        parents: List[str] = []
+        for issue_id in ids:
+            parent_id = self._parent.get(issue_id)
+            if parent_id and parent_id not in parents:
+                parents.append(parent_id)
+        return parents
+
+    def parent_of(self, issue_id) -> Optional[str]:
+        return self._parent.get(str(issue_id))
+
+    @property
+    def total_requests(self) -> int:
+        return self.requests + self.loader.requests
+
+class RedmineClient:
+    def __init__(self, base_url: str, limit_per_host: int = 20, keepalive_timeout: float = 60,
+                 dns_ttl: int = 300, timeout: float = 15, upload_timeout: float = 120,
+                 retries: int = 3, backoff: float = 0.5, backoff_max: float = 5.0,
+                 checklist_ttl: float = 30, verify_ssl: bool = True):
+        self.base_url = base_url.rstrip("/")
+        # False — не проверять сертификат (самоподписанный на внутреннем Redmine)
+        self.ssl = None if verify_ssl else False
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.dns_ttl = dns_ttl
+        self.timeout = timeout                  # дедлайн вызова по умолчанию, с учётом повторов
+        self.upload_timeout = upload_timeout    # дедлайн загрузки файла
+        self.retries = retries
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self._session: Optional[aiohttp.ClientSession] = None
+        self.checklists = ChecklistCache(ttl=checklist_ttl)
+        # Потоковые загрузки файлов: сколько файлов, кусков и байт ушло в /uploads.json
+        self.upload_counters = {"files": 0, "failed": 0, "chunks": 0, "bytes": 0}
+
+    async def start(self):
+        """Создаёт сессию (повторный вызов при живой сессии ничего не делает)"""
+        if self._session is not None and not self._session.closed:
+            return
+        connector = aiohttp.TCPConnector(
+            limit_per_host=self.limit_per_host,
+            keepalive_timeout=self.keepalive_timeout,
+            ttl_dns_cache=self.dns_ttl,
+            use_dns_cache=True,
+        )
+        # Страховочный таймаут для запросов в обход типизированных методов (скачивание файлов и т.п.)
+        self._session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=self.upload_timeout),
+        )
+        logging.info(
+            f"[REDMINE] Сессия создана: limit_per_host={self.limit_per_host}, "
+            f"keepalive={self.keepalive_timeout}с, dns_ttl={self.dns_ttl}с"
+        )
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+            logging.info("[REDMINE] Сессия закрыта")
+        self._session = None
+
+    @asynccontextmanager
+    async def session(self) -> AsyncIterator[aiohttp.ClientSession]:
+        """
+        Общая сессия для блока запросов: `async with redmine.session() as session:`.
+        В отличие от `aiohttp.ClientSession()` при выходе из блока сессия не закрывается,
+        соединения остаются в пуле. До start() (например, в тестовых скриптах) создаётся лениво.
+        """
+        if self._session is None or self._session.closed:
+            await self.start()
+        yield self._session
+
+    # ===================== ЗАПРОСЫ =====================
+
+    def _backoff_delay(self, attempt: int) -> float:
+        """Пауза перед повтором: full jitter — случайно в [0, backoff * 2^attempt]"""
+        return random.uniform(0, min(self.backoff_max, self.backoff * (2 ** attempt)))
+
+    async def request(self, method: str, path: str, api_key: str, *, params: Optional[dict] = None,
+                      json: Any = None, data: Any = None, content_type: Optional[str] = None,
+                      expect: str = "json", timeout: Optional[float] = None,
+                      retry: Optional[bool] = None, headers: Optional[Dict[str, str]] = None) -> Any:
+        """
+        Запрос к Redmine. expect: "json" — разобранный JSON, "text" — тело строкой,
+        "bytes" — тело как есть, "none" — ничего. timeout — общий дедлайн вызова вместе с повторами.
+        retry по умолчанию включён только для идемпотентных методов.
+        path — путь от base_url или полный URL (content_url вложения).
+        """
+        method = method.upper()
+        if retry is None:
+            retry = method in IDEMPOTENT_METHODS
+        timeout = timeout or self.timeout
+        headers = {**(headers or {}), "X-Redmine-API-Key": api_key}
+        if content_type:
+            headers["Content-Type"] = content_type
+
+        url = path if path.startswith(("http://", "https://")) else f"{self.base_url}{path}"
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        attempt = 0
+        async with self.session() as session:
+            while True:
+                left = deadline - loop.time()
+                try:
+                    if left <= 0:
+                        raise asyncio.TimeoutError()
+                    async with session.request(
+                        method, url, headers=headers, params=params,
+                        json=json, data=data, ssl=self.ssl, timeout=aiohttp.ClientTimeout(total=left),
+                    ) as resp:
+                        if resp.status >= 400:
+                            raise RedmineError(method, path, resp.status, (await resp.text())[:500])
+                        if expect == "json":
+                            return await resp.json(content_type=None) if resp.status != 204 else {}
+                        if expect == "text":
+                            return await resp.text()
+                        if expect == "bytes":
+                            return await resp.read()
+                        return None
+                except RedmineError as e:
+                    error = e
+                except asyncio.TimeoutError:
+                    error = RedmineError(method, path, reason=f"таймаут {timeout:.0f}с")
+                except aiohttp.ClientError as e:
+                    error = RedmineError(method, path, reason=f"{type(e).__name__}: {e}")
+
+                delay = self._backoff_delay(attempt)
+                if not (retry and error.transient and attempt < self.retries
+                        and loop.time() + delay < deadline):
+                    raise error
+                attempt += 1
+                logging.warning(f"[REDMINE] {error} — повтор {attempt}/{self.retries} через {delay:.2f}с")
+                await asyncio.sleep(delay)
+
+    # ===================== ЗАДАЧИ =====================
+
+    async def get_issue(self, issue_id, api_key: str, include: Optional[str] = None) -> dict:
+        """Задача целиком (содержимое ключа "issue"); include — "attachments", "children", ..."""
+        params = {"include": include} if include else None
+        data = await self.request("GET", f"/issues/{issue_id}.json", api_key, params=params)
+        return data.get("issue", {})
+
+    async def list_issues(self, api_key: str, params: Dict[str, Any], page_size: int = 100,
+                          max_pages: int = 50) -> List[dict]:
+        """Список задач по фильтру с постраничной догрузкой (offset/limit, total_count)"""
+        issues, _ = await self.list_issues_counted(api_key, params, page_size, max_pages)
+        return issues
+
+    async def list_issues_counted(self, api_key: str, params: Dict[str, Any], page_size: int = 100,
+                                  max_pages: int = 50) -> Tuple[List[dict], int]:
+        """То же с total_count: len(issues) < total_count — выдача обрезана на max_pages"""
+        issues: List[dict] = []
+        total = 0
+        for page in range(max_pages):
+            data = await self.request(
+                "GET", "/issues.json", api_key,
+                params={**params, "limit": page_size, "offset": page * page_size},
+            )
+            batch = data.get("issues", [])
+            issues.extend(batch)
+            total = data.get("total_count", len(issues))
+            if len(batch) < page_size or len(issues) >= total:
+                break
+        return issues, total
+
+    def issue_loader(self, api_key: str) -> IssueLoader:
+        """Загрузчик задач с мемоизацией — на один запрос пользователя"""
+        return IssueLoader(self, api_key)
+
+    def issue_tree(self, api_key: str, parallel: int = 8) -> IssueTree:
+        """Граф родитель/подзадачи с кэшем — на один запрос пользователя"""
+        return IssueTree(self, api_key, parallel)
+
+    async def list_children(self, parent_id, api_key: str) -> List[dict]:
+        """Подзадачи (любого статуса) одного уровня"""
+        return await self.list_issues(api_key, {"parent_id": parent_id, "status_id": "*"})
+
+    async def update_issue(self, issue_id, api_key: str, fields: Dict[str, Any]):
+        # PUT с notes не идемпотентен: повтор после потерянного ответа задвоит комментарий в журнале
+        await self.request("PUT", f"/issues/{issue_id}.json", api_key,
+                           json={"issue": fields}, expect="none", retry=False if "notes" in fields else None)
+
+    async def create_issue(self, api_key: str, fields: Dict[str, Any]) -> dict:
+        data = await self.request("POST", "/issues.json", api_key, json={"issue": fields})
+        return data.get("issue", {})
+
+    async def search(self, query: str, api_key: str, limit: int = 10, scope: str = "issues") -> List[dict]:
+        """Полнотекстовый поиск: [{"id", "title", "url", "type", ...}, ...]"""
+        data = await self.request("GET", "/search.json", api_key,
+                                  params={"q": query, "limit": limit, "scope": scope})
+        return data.get("results", [])
+
+    # ===================== ЧЕК-ЛИСТЫ =====================
+
+    async def get_checklist(self, issue_id, api_key: str, fresh: bool = False) -> Checklist:
+        """Чек-лист задачи с индексом блоков; из кэша, если он свежий (fresh=True — всегда из Redmine)"""
+        if not fresh:
+            cached = self.checklists.get(issue_id, api_key)
+            if cached is not None:
+                return cached
+        xml_text = await self.request("GET", f"/issues/{issue_id}/checklists.xml", api_key, expect="text")
+        checklist = parse_checklist_xml(xml_text)
+        self.checklists.put(issue_id, checklist, api_key)
+        return checklist
+
+    async def update_checklist_item(self, item_id, api_key: str, *, subject: Optional[str] = None,
+                                    is_done: Optional[bool] = None, position: Optional[int] = None,
+                                    issue_id: Optional[int] = None):
+        payload = checklist_item_xml(issue_id=issue_id, subject=subject, is_done=is_done, position=position)
+        try:
+            await self.request("PUT", f"/checklists/{item_id}.xml", api_key, data=payload,
+                               content_type="application/xml", expect="none")
+        except RedmineError:
+            # Неизвестно, применилось ли изменение — копию задачи больше не используем
+            self.checklists.invalidate_item(item_id)
+            raise
+        self.checklists.update_item(item_id, subject=subject, is_done=is_done, position=position)
+
+    async def create_checklist_item(self, issue_id, api_key: str, subject: str, *, is_done: bool = False,
+                                    position: Optional[int] = None, is_section: Optional[bool] = None) -> Optional[int]:
+        """Создаёт пункт; возвращает его id (если Redmine его вернул)"""
+        payload = checklist_item_xml(issue_id=issue_id, subject=subject, is_done=is_done,
+                                     position=position, is_section=is_section)
+        return await self.create_checklist_payload(issue_id, api_key, payload)
+
+    async def create_checklist_payload(self, issue_id, api_key: str, payload: bytes) -> Optional[int]:
+        """Создаёт пункт по готовому XML (ChecklistTemplate.render); возвращает его id"""
+        try:
+            xml_text = await self.request("POST", f"/issues/{issue_id}/checklists.xml", api_key, data=payload,
+                                          content_type="application/xml", expect="text")
+        except RedmineError:
+            self.checklists.invalidate(issue_id)
+            raise
+        try:
+            created = ChecklistItem.from_xml(ET.fromstring(xml_text)) if xml_text.strip() else None
+        except (ET.ParseError, ValueError):
+            created = None
+        self.checklists.add_item(issue_id, created)
+        return created.id if created and created.id else None
+
+    async def delete_checklist_item(self, item_id, api_key: str, forget: bool = True):
+        """
+        forget=False — удалённый пункт из копии в кэше не убирается: пачку удалений
+        вызывающий убирает сам одним checklists.remove_items
+        """
+        try:
+            await self.request("DELETE", f"/checklists/{item_id}.xml", api_key, expect="none")
+        except RedmineError as e:
+            if e.not_found:
+                # Пункта уже нет (например, удалил повтор после обрыва) — из копии тоже убираем
+                if forget:
+                    self.checklists.remove_item(item_id)
+            else:
+                self.checklists.invalidate_item(item_id)
+            raise
+        if forget:
+            self.checklists.remove_item(item_id)
+
+    # ===================== ФАЙЛЫ =====================
+
+    async def upload(self, data: Any, api_key: str, filename: Optional[str] = None) -> str:
+        """Загружает файл в /uploads.json, возвращает токен для прикрепления"""
+        params = {"filename": filename} if filename else None
+        result = await self.request("POST", "/uploads.json", api_key, params=params, data=data,
+                                    content_type="application/octet-stream", timeout=self.upload_timeout)
+        return result["upload"]["token"]
+
+    async def upload_stream(self, chunks: AsyncIterator[bytes], api_key: str, filename: Optional[str] = None,
+                            size: Optional[int] = None) -> str:
+        """
+        Загружает файл в /uploads.json по кускам, не собирая его в памяти целиком.
+        size — длина файла, если известна (иначе chunked-передача). Поток одноразовый,
+        поэтому запрос не повторяется. Возвращает токен для прикрепления.
+        """
+        counters = self.upload_counters
+
+        async def counted() -> AsyncIterator[bytes]:
+            async for chunk in chunks:
+                counters["chunks"] += 1
+                counters["bytes"] += len(chunk)
+                yield chunk
+
+        params = {"filename": filename} if filename else None
+        headers = {"Content-Length": str(size)} if size is not None else None
+        try:
+            result = await self.request("POST", "/uploads.json", api_key, params=params, data=counted(),
+                                        content_type="application/octet-stream", timeout=self.upload_timeout,
+                                        retry=False, headers=headers)
+        except Exception:
+            counters["failed"] += 1
+            raise
+        counters["files"] += 1
+        return result["upload"]["token"]
+
+    async def attach(self, issue_id, api_key: str, token: str, filename: str,
+                     content_type: str = "application/octet-stream", notes: Optional[str] = None,
+                     fields: Optional[Dict[str, Any]] = None):
+        """Прикрепляет загруженный файл к задаче; fields — поля, меняемые тем же PUT (статус и т.п.)"""
+        fields = {**(fields or {}), "uploads": [{"token": token, "filename": filename, "content_type": content_type}]}
+        if notes:
+            fields["notes"] = notes
+        # Токен загрузки одноразовый: повтор после потерянного ответа вернул бы 422
+        await self.request("PUT", f"/issues/{issue_id}.json", api_key,
+                           json={"issue": fields}, expect="none", retry=False)
@@ -0,0 +1,167 @@
+"""
+Локальное зеркало задач Redmine (SQLite).
+
+Фоновая синхронизация забирает issues.json?updated_on=>=<отметка>&status_id=* постранично
+и сохраняет задачи как есть (JSON из списка задач: subject, parent, project, status,
+assigned_to, custom_fields) плюс столбцы для поиска: родитель и серийники из поля
+«Серийный номер». Обработчики сначала читают зеркало и идут в Redmine, только если
+в зеркале ответа нет. Опрос по updated_on не видит удалённых задач: их убирает
+периодическая сверка всех id зеркала (и ответ 404 на проверочный GET).
+"""
+import json
+import time
+import sqlite3
+import threading
+from typing import Optional, List, Iterable, Dict, Any
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS mirror_issues (
+    id         INTEGER PRIMARY KEY,
+    parent_id  INTEGER,
+    subject    TEXT,
+    updated_on TEXT,
+    data       TEXT NOT NULL,
+    synced_at  REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS mirror_issues_parent ON mirror_issues (parent_id);
+CREATE TABLE IF NOT EXISTS mirror_serials (
+    serial   TEXT NOT NULL,
+    issue_id INTEGER NOT NULL,
+    PRIMARY KEY (serial, issue_id)
+);
+CREATE INDEX IF NOT EXISTS mirror_serials_issue ON mirror_serials (issue_id);
+CREATE TABLE IF NOT EXISTS mirror_meta (
+    key   TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+class RedmineMirror:
+    """Задачи Redmine по id, по родителю и по серийнику; значения — dict в формате REST API"""
+
+    def __init__(self, path: str, serial_field_id: int):
+        self.path = path
+        self.serial_field_id = serial_field_id
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.last_sync: Optional[float] = None
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def _serials_of(self, issue: Dict[str, Any]) -> List[str]:
+        for cf in issue.get("custom_fields", []):
+            if cf.get("id") == self.serial_field_id and isinstance(cf.get("value"), str):
+                return [s.upper() for s in cf["value"].split()]
+        return []
+
+    def upsert(self, issues: Iterable[Dict[str, Any]]) -> int:
+        """Записывает задачи из ответа issues.json; возвращает их число"""
+        now = time.time()
+        count = 0
+        with self._lock:
+            cur = self._db.cursor()
+            cur.execute("BEGIN")
+            try:
+                for issue in issues:
+                    issue_id = int(issue["id"])
+                    parent = issue.get("parent") or {}
+                    cur.execute(
+                        "INSERT INTO mirror_issues (id, parent_id, subject, updated_on, data, synced_at) "
+                        "VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT(id) DO UPDATE SET "
+                        "parent_id = excluded.parent_id, subject = excluded.subject, "
+                        "updated_on = excluded.updated_on, data = excluded.data, synced_at = excluded.synced_at",
+                        (issue_id, parent.get("id"), issue.get("subject"), issue.get("updated_on"),
+                         json.dumps(issue, ensure_ascii=False), now),
+                    )
+                    cur.execute("DELETE FROM mirror_serials WHERE issue_id = ?", (issue_id,))
+                    cur.executemany(
+                        "INSERT OR IGNORE INTO mirror_serials (serial, issue_id) VALUES (?, ?)",
+                        [(serial, issue_id) for serial in self._serials_of(issue)],
+                    )
+                    count += 1
+                cur.execute("COMMIT")
+            except Exception:
+                cur.execute("ROLLBACK")
+                raise
+        self.last_sync = now
+        return count
+
+    def delete(self, issue_ids: Iterable[Any]) -> int:
+        """Убирает задачи (удалены в Redmine или недоступны ключу синхронизации); возвращает их число"""
+        ids = [(int(i),) for i in issue_ids]
+        if not ids:
+            return 0
+        with self._lock:
+            cur = self._db.cursor()
+            cur.execute("BEGIN")
+            try:
+                cur.executemany("DELETE FROM mirror_serials WHERE issue_id = ?", ids)
+                cur.executemany("DELETE FROM mirror_issues WHERE id = ?", ids)
+                cur.execute("COMMIT")
+            except Exception:
+                cur.execute("ROLLBACK")
+                raise
+        return len(ids)
+
+    def ids(self) -> List[int]:
+        with self._lock:
+            return [row[0] for row in self._db.execute("SELECT id FROM mirror_issues ORDER BY id")]
+
+    def _rows(self, query: str, args: tuple) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = self._db.execute(query, args).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def get(self, issue_id) -> Optional[Dict[str, Any]]:
+        rows = self._rows("SELECT data FROM mirror_issues WHERE id = ?", (int(issue_id),))
+        if rows:
+            self.hits += 1
+            return rows[0]
+        self.misses += 1
+        return None
+
+    def children(self, parent_id) -> List[Dict[str, Any]]:
+        """Подзадачи одного уровня в порядке id (как issues.json?parent_id=...)"""
+        return self._rows("SELECT data FROM mirror_issues WHERE parent_id = ? ORDER BY id", (int(parent_id),))
+
+    def issues_with_serial(self, serial: str) -> List[Dict[str, Any]]:
+        """Задачи, в поле «Серийный номер» которых есть этот S/N"""
+        return self._rows(
+            "SELECT i.data FROM mirror_serials s JOIN mirror_issues i ON i.id = s.issue_id "
+            "WHERE s.serial = ? ORDER BY i.id",
+            ((serial or "").strip().upper(),),
+        )
+
+    def watermark(self) -> Optional[str]:
+        """updated_on самой свежей синхронизированной задачи (формат Redmine, UTC)"""
+        with self._lock:
+            row = self._db.execute("SELECT value FROM mirror_meta WHERE key = 'watermark'").fetchone()
+        return row[0] if row else None
+
+    def set_watermark(self, value: str):
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO mirror_meta (key, value) VALUES ('watermark', ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                (value,),
+            )
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            issues = self._db.execute("SELECT COUNT(*) FROM mirror_issues").fetchone()[0]
+        total = self.hits + self.misses
+        return {
+            "issues": issues,
+            "watermark": self.watermark(),
+            "lag_sec": round(time.time() - self.last_sync) if self.last_sync else None,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else None,
+        }
@@ -0,0 +1,151 @@
+"""
+Локальный индекс "серийник → задача контроля" (SQLite).
+
+Заполняется из заголовков чек-листов "Проверка оборудования <S/N>" и поля
+«Серийный номер» задач, которые бот уже открывал, плюс фоновой синхронизацией.
+Поиск по индексу — один SELECT по первичному ключу вместо search.json и обхода
+дерева задач; полнотекстовый поиск Redmine остаётся запасным путём.
+"""
+import time
+import sqlite3
+import threading
+from typing import Optional, Iterable, Dict
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS control_tasks (
+    issue_id   INTEGER PRIMARY KEY,
+    subject    TEXT,
+    url        TEXT,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS serials (
+    serial     TEXT PRIMARY KEY,
+    issue_id   INTEGER NOT NULL,
+    source     TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS serials_issue ON serials (issue_id);
+CREATE TABLE IF NOT EXISTS meta (
+    key   TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+# Заголовок чек-листа надёжнее поля задачи производства: поле не перетирает его
+SOURCE_PRIORITY = {"field": 0, "search": 1, "checklist": 2}
+_PRIORITY_SQL = "CASE serials.source " + " ".join(
+    f"WHEN '{source}' THEN {priority}" for source, priority in SOURCE_PRIORITY.items()
+) + " ELSE 0 END"
+
+class SerialIndex:
+    """serial → {"id", "subject", "url"}; subject может быть None, если задача ещё не открывалась"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def lookup(self, serial: str) -> Optional[dict]:
+        serial = (serial or "").strip().upper()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT s.issue_id, t.subject, t.url FROM serials s "
+                "LEFT JOIN control_tasks t ON t.issue_id = s.issue_id WHERE s.serial = ?",
+                (serial,),
+            ).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return {"id": str(row[0]), "subject": row[1], "url": row[2]}
+
+    def remember_task(self, issue_id, subject: Optional[str] = None, url: Optional[str] = None):
+        """Задача контроля; пустые subject/url не затирают известные"""
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO control_tasks (issue_id, subject, url, updated_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(issue_id) DO UPDATE SET "
+                "subject = COALESCE(excluded.subject, subject), url = COALESCE(excluded.url, url), "
+                "updated_at = excluded.updated_at",
+                (int(issue_id), subject, url, time.time()),
+            )
+
+    def remember(self, serials: Iterable[str], issue_id, source: str,
+                 subject: Optional[str] = None, url: Optional[str] = None) -> int:
+        """
+        Привязывает серийники к задаче контроля. Источник с меньшим приоритетом
+        не перебивает привязку из более надёжного. Возвращает число записанных строк.
+        """
+        now = time.time()
+        rows = [(s.strip().upper(), int(issue_id), source, now) for s in serials if s and s.strip()]
+        if not rows:
+            return 0
+        priority = SOURCE_PRIORITY.get(source, 0)
+        with self._lock:
+            cur = self._db.cursor()
+            cur.execute("BEGIN")
+            try:
+                cur.execute(
+                    "INSERT INTO control_tasks (issue_id, subject, url, updated_at) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT(issue_id) DO UPDATE SET "
+                    "subject = COALESCE(excluded.subject, subject), url = COALESCE(excluded.url, url)",
+                    (int(issue_id), subject, url, now),
+                )
+                before = self._db.total_changes
+                for row in rows:
+                    cur.execute(
+                        "INSERT INTO serials (serial, issue_id, source, updated_at) VALUES (?, ?, ?, ?) "
+                        "ON CONFLICT(serial) DO UPDATE SET issue_id = excluded.issue_id, "
+                        "source = excluded.source, updated_at = excluded.updated_at "
+                        f"WHERE {_PRIORITY_SQL} <= ?",
+                        (*row, priority),
+                    )
+                changed = self._db.total_changes - before
+                cur.execute("COMMIT")
+            except Exception:
+                cur.execute("ROLLBACK")
+                raise
+        return changed
+
+    def forget_issue(self, issue_id, source: Optional[str] = None) -> int:
+        """Убирает привязки к задаче (например, после удаления её чек-листа)"""
+        with self._lock:
+            if source:
+                cur = self._db.execute("DELETE FROM serials WHERE issue_id = ? AND source = ?", (int(issue_id), source))
+            else:
+                cur = self._db.execute("DELETE FROM serials WHERE issue_id = ?", (int(issue_id),))
+            return cur.rowcount
+
+    def get_meta(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key: str, value: str):
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO meta (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                (key, value),
+            )
+
+    def stats(self) -> Dict[str, Optional[float]]:
+        with self._lock:
+            serials = self._db.execute("SELECT COUNT(*) FROM serials").fetchone()[0]
+            tasks = self._db.execute("SELECT COUNT(*) FROM control_tasks").fetchone()[0]
+        total = self.hits + self.misses
+        return {
+            "serials": serials,
+            "control_tasks": tasks,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else None,
+        }
@@ -0,0 +1,157 @@
+"""
+Справочник известных серийников для исправления ошибок OCR.
+
+Наполняется из Redmine (поле «Серийный номер» и заголовки чек-листов
+"Проверка оборудования <S/N>"). Поиск ближайшего известного серийника / модели
+идёт по BK-дереву, а не перебором всего справочника.
+"""
+import threading
+from typing import Optional, List, Tuple, Iterable, Dict
+
+from serial_text import is_valid_serial
+
+def levenshtein(a: str, b: str) -> int:
+    """Редакционное расстояние (вставка, удаление, замена)"""
+    if len(a) < len(b):
+        a, b = b, a
+    prev = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        cur = [i]
+        for j, cb in enumerate(b, 1):
+            cur.append(min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (ca != cb)))
+        prev = cur
+    return prev[-1]
+
+class BKTree:
+    """BK-дерево по расстоянию Левенштейна: поиск слов в радиусе без полного перебора"""
+
+    def __init__(self):
+        self.root: Optional[Tuple[str, Dict[int, tuple]]] = None
+        self.size = 0
+
+    def add(self, word: str) -> bool:
+        """Добавляет слово; False — уже было"""
+        if self.root is None:
+            self.root = (word, {})
+            self.size = 1
+            return True
+        node = self.root
+        while True:
+            d = levenshtein(word, node[0])
+            if d == 0:
+                return False
+            child = node[1].get(d)
+            if child is None:
+                node[1][d] = (word, {})
+                self.size += 1
+                return True
+            node = child
+
+    def search(self, word: str, max_distance: int) -> List[Tuple[int, str]]:
+        """Все слова на расстоянии <= max_distance: [(расстояние, слово), ...] по возрастанию"""
+        if self.root is None:
+            return []
+        found = []
+        stack = [self.root]
+        while stack:
+            node_word, children = stack.pop()
+            d = levenshtein(word, node_word)
+            if d <= max_distance:
+                found.append((d, node_word))
+            # Неравенство треугольника: искомые слова только в ветках [d - r, d + r]
+            for dist in range(max(1, d - max_distance), d + max_distance + 1):
+                child = children.get(dist)
+                if child is not None:
+                    stack.append(child)
+        return sorted(found)
+
+class SerialLexicon:
+    """
+    Известные серийники и модели (первые 5 букв S/N).
+
+    correct() не трогает цифровой хвост валидного серийника: соседние юниты партии
+    отличаются на одну цифру, и «ближайший известный» легко оказался бы чужим.
+    Исправляется только модель (PCPPF → PCPPP), и то если кандидат невалиден или OCR
+    прочитал его с уверенностью ниже snap_confidence: уверенно прочитанная неизвестная
+    модель — скорее новая партия, чем ошибка. Целиком серийник подбирается лишь
+    для кандидатов, не прошедших is_valid_serial, и только при единственном соседе.
+    """
+
+    def __init__(self, max_distance: int = 1, snap_confidence: float = 0.9):
+        self.max_distance = max_distance
+        self.snap_confidence = snap_confidence
+        self._serials = BKTree()
+        self._prefixes = BKTree()
+        self._known: set = set()
+        self._lock = threading.Lock()
+        self.corrections = 0
+
+    def __len__(self) -> int:
+        return len(self._known)
+
+    def add(self, serial: str) -> bool:
+        """Добавляет серийник (невалидные игнорируются); True — новый"""
+        serial = (serial or "").strip().upper()
+        if not is_valid_serial(serial):
+            return False
+        with self._lock:
+            if serial in self._known:
+                return False
+            self._known.add(serial)
+            self._serials.add(serial)
+            self._prefixes.add(serial[:5])
+        return True
+
+    def add_many(self, serials: Iterable[str]) -> int:
+        return sum(self.add(s) for s in serials)
+
+    def _unique_nearest(self, tree: BKTree, word: str) -> Optional[str]:
+        """Ближайшее слово, если оно единственное на минимальном расстоянии"""
+        found = tree.search(word, self.max_distance)
+        if not found:
+            return None
+        best = found[0][0]
+        nearest = [w for d, w in found if d == best]
+        return nearest[0] if len(nearest) == 1 else None
+
+    def correct(self, candidate: str, confidence: Optional[float] = None) -> Optional[str]:
+        """
+        Известный серийник для кандидата из OCR или None.
+        Для уже известного серийника возвращает его же.
+        confidence — уверенность OCR для кандидата (None — неизвестна, считается высокой).
+        """
+        candidate = (candidate or "").strip().upper()
+        if not candidate:
+            return None
+        with self._lock:
+            if candidate in self._known:
+                return candidate
+            if not self._known:
+                return None
+
+            valid = is_valid_serial(candidate)
+            doubtful = not valid or (confidence is not None and confidence < self.snap_confidence)
+
+            # Модель: PCPPF033000349 → PCPPP033000349
+            if doubtful and len(candidate) > 5 and candidate[5:].isdigit():
+                prefix = self._unique_nearest(self._prefixes, candidate[:5])
+                if prefix and prefix != candidate[:5] and is_valid_serial(prefix + candidate[5:]):
+                    self.corrections += 1
+                    return prefix + candidate[5:]
+
+            if valid:
+                return None
+
+            # Невалидный кандидат целиком: единственный известный сосед
+            serial = self._unique_nearest(self._serials, candidate)
+            if serial:
+                self.corrections += 1
+            return serial
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "serials": len(self._known),
+                "prefixes": self._prefixes.size,
+                "corrections": self.corrections,
+            }
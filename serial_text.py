@@ -0,0 +1,202 @@
+"""
+Текстовая часть распознавания S/N: нормализация строк OCR, поиск и валидация
+серийного номера, вычисление пароля BIOS. Модуль не зависит от OCR и OpenCV.
+"""
+import re
+from typing import Optional, Tuple, List, Dict
+
+# Импортируем разрешённые префиксы (если config.py доступен)
+try:
+    from config import ALLOWED_SERIAL_PREFIXES
+except ImportError:
+    ALLOWED_SERIAL_PREFIXES = ["PC", "CE"]  # Дефолтное значение
+
+DIGIT_SUBS = str.maketrans({
+    'O':'0', 'o':'0', 'I':'1', 'l':'1', 'L':'1', 'i':'1', 'B':'8', 'S':'5', 'Z':'2',
+})
+
+def normalize_line(s: str) -> str:
+    if s is None:
+        return ""
+    s = s.replace('\\', '/')
+    s = s.replace('\u2013', '-')
+    s = re.sub(r'[^A-Za-z0-9\s/:.\-]', ' ', s)
+    return s.upper().strip()
+
+def compact(s: str) -> str:
+    return re.sub(r'[\s.:/\\\-]', '', s)
+
+def fix_digits_mistakes(s: str) -> str:
+    return s.translate(DIGIT_SUBS)
+
+def is_valid_serial(sn: str) -> bool:
+    """
+    Проверяет валидность серийного номера:
+    - Формат: 5 букв + 9 цифр
+    - Префикс: ТОЛЬКО из списка ALLOWED_SERIAL_PREFIXES (по умолчанию: PC, CE)
+    """
+    if not re.fullmatch(r'[A-Z]{5}[0-9]{9}', sn):
+        return False
+    
+    prefix = sn[:2]
+    return prefix in ALLOWED_SERIAL_PREFIXES
+
+def compute_bios_password_string(serial: str) -> str:
+    if not is_valid_serial(serial):
+        raise ValueError("Сериал не валидный для вычисления пароля")
+    first_two = serial[:2]
+    digits = serial[5:]
+    number1 = int(digits[:3])
+    number2 = int(digits[-3:])
+    product = number1 * number2
+    return f"{first_two}{product}"
+
+def find_serial_near_sn_in_text(text: str) -> Optional[str]:
+    norm = normalize_line(text)
+    comp = compact(norm)
+
+    # ИСПРАВЛЕНО: экранирование спецсимволов
+    pat1 = re.compile(r'\bS[\s/\\\.\-]*N[\s:]*([A-Z0-9]{14})\b', re.IGNORECASE)
+    pat2 = re.compile(r'\bSN[\s:]*([A-Z0-9]{14})\b', re.IGNORECASE)
+    
+    for pat in (pat1, pat2):
+        for m in pat.finditer(norm):
+            candidate_raw = m.group(1)
+            letters_part = candidate_raw[:5]
+            digits_part_raw = candidate_raw[5:]
+            digits_fixed = fix_digits_mistakes(digits_part_raw)
+            candidate = (letters_part + digits_fixed).upper()
+            if is_valid_serial(candidate):
+                return candidate
+
+    m2 = re.search(r'(?:SN|S5N|5N)([A-Z0-9]{14})', comp, re.IGNORECASE)
+    if m2:
+        candidate_raw = m2.group(1)
+        letters_part = candidate_raw[:5]
+        digits_part_raw = candidate_raw[5:]
+        digits_fixed = fix_digits_mistakes(digits_part_raw)
+        candidate = (letters_part + digits_fixed).upper()
+        if is_valid_serial(candidate):
+            return candidate
+
+    for m in re.finditer(r'\bS[\s/\\\.\-]*N\b|\bSN\b|\bS5N\b|\b5N\b', norm, re.IGNORECASE):
+        start = m.end()
+        window = norm[start:start + 80]
+        joined = compact(window)
+        mo = re.search(r'([A-Z0-9]{14})', joined)
+        if mo:
+            candidate_raw = mo.group(1)
+            letters_part = candidate_raw[:5]
+            digits_part_raw = candidate_raw[5:]
+            digits_fixed = fix_digits_mistakes(digits_part_raw)
+            candidate = (letters_part + digits_fixed).upper()
+            if is_valid_serial(candidate):
+                return candidate
+
+    return None
+
+def find_any_serial_in_text(text: str) -> Optional[str]:
+    norm = normalize_line(text)
+    
+    m = re.search(r'([A-Z]{5}[0-9]{9})', norm)
+    if m:
+        return m.group(1).upper()
+
+    for m in re.finditer(r'([A-Z]{5}[A-Z0-9]{9})', norm):
+        letters = m.group(1)[:5]
+        digits_raw = m.group(1)[5:]
+        digits_fixed = fix_digits_mistakes(digits_raw)
+        candidate = (letters + digits_fixed).upper()
+        if is_valid_serial(candidate):
+            return candidate
+
+    comp = compact(norm)
+    mo = re.search(r'([A-Z]{5}[A-Z0-9]{9})', comp)
+    if mo:
+        letters = mo.group(1)[:5]
+        digits_raw = mo.group(1)[5:]
+        digits_fixed = fix_digits_mistakes(digits_raw)
+        candidate = (letters + digits_fixed).upper()
+        if is_valid_serial(candidate):
+            return candidate
+    
+    return None
+
+def extract_serial(text: str) -> Tuple[Optional[str], Optional[str]]:
+    """
+    Ищет серийник в тексте OCR: сначала рядом с меткой S/N, затем любой подходящий.
+    Возвращает (серийник, имя сработавшего экстрактора) или (None, None).
+    """
+    serial = find_serial_near_sn_in_text(text)
+    if serial:
+        return serial, "near_sn"
+    serial = find_any_serial_in_text(text)
+    if serial:
+        return serial, "any_serial"
+    return None, None
+
+def _serial_windows(text: str, pattern: str) -> List[str]:
+    """
+    14-символьные окна по pattern (с перекрытием) в строке как есть и в «схлопнутой»
+    строке, с исправленным цифровым хвостом, без дублей.
+    """
+    norm = normalize_line(text)
+    found: List[str] = []
+    
+    def add(raw: str):
+        candidate = (raw[:5] + fix_digits_mistakes(raw[5:])).upper()
+        if candidate not in found:
+            found.append(candidate)
+    
+    for m in re.finditer(pattern, norm):
+        add(m.group(1))
+    
+    for line in norm.splitlines():
+        for m in re.finditer(pattern, compact(line)):
+            add(m.group(1))
+    
+    return found
+
+def find_all_serials_in_text(text: str) -> List[str]:
+    """
+    Все валидные серийники в тексте (несколько единиц оборудования на одном фото),
+    без дублей. Кандидаты ищутся с перекрытием — и в строке как есть,
+    и в «схлопнутой» строке, где OCR разбил серийник разделителями.
+    """
+    return [sn for sn in _serial_windows(text, r'(?=([A-Z]{5}[A-Z0-9]{9}))') if is_valid_serial(sn)]
+
+def find_serial_candidates(text: str) -> List[str]:
+    """
+    Сырые кандидаты в серийник, в том числе невалидные (цифра в буквенной части:
+    PC0PP033000349) — для сверки со справочником известных серийников.
+    """
+    return _serial_windows(text, r'(?=([A-Z][A-Z0-9]{4}[A-Z0-9]{9}))')
+
+def vote_serial(candidates: List[Tuple[str, Optional[float]]]) -> Tuple[Optional[str], float]:
+    """
+    Посимвольное голосование по серийникам с нескольких кадров.
+    candidates: [(серийник, уверенность распознавания), ...]; вес голоса — уверенность.
+    Возвращает (серийник или None, согласие 0..1 — средняя доля веса победителя по позициям).
+    """
+    candidates = [(sn, conf if conf is not None else 0.5) for sn, conf in candidates if sn]
+    if not candidates:
+        return None, 0.0
+    
+    length = len(candidates[0][0])
+    candidates = [(sn, conf) for sn, conf in candidates if len(sn) == length]
+    
+    chars = []
+    agreement = 0.0
+    for pos in range(length):
+        weights: Dict[str, float] = {}
+        for sn, conf in candidates:
+            weights[sn[pos]] = weights.get(sn[pos], 0.0) + conf
+        winner = max(weights, key=weights.get)
+        chars.append(winner)
+        total = sum(weights.values())
+        agreement += weights[winner] / total if total else 0.0
+    
+    serial = "".join(chars)
+    if not is_valid_serial(serial):
+        return None, 0.0
+    return serial, round(agreement / length, 4)
@@ -0,0 +1,98 @@
+"""
+Кэш файлов Telegram в памяти процесса.
+
+В сценарии "." одно и то же фото скачивается для OCR, затем для загрузки в Redmine,
+а при повторе — ещё раз; bot.get_file для одного file_id тоже вызывается многократно.
+Кэш хранит скачанные байты (LRU с ограничением по суммарному размеру и TTL) и
+file_path из getFile. Ключ — file_unique_id: он один у файла, даже если file_id
+в разных сообщениях различаются; file_id → file_unique_id запоминается при getFile.
+"""
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple, Dict, Any
+
+class TelegramFileCache:
+    """Байты файлов и file_path по file_unique_id"""
+
+    def __init__(self, max_bytes: int, ttl: float, path_ttl: float, max_paths: int = 2048):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.path_ttl = path_ttl        # ссылка на файл Telegram живёт не меньше часа
+        self.max_paths = max_paths
+        self._data: "OrderedDict[str, Tuple[float, bytes]]" = OrderedDict()
+        self._size = 0
+        self._aliases: "OrderedDict[str, str]" = OrderedDict()      # file_id → file_unique_id
+        self._paths: "OrderedDict[str, Tuple[float, str, Optional[int]]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.path_hits = 0
+        self.path_misses = 0
+        self.evicted = 0
+
+    # ---------- getFile ----------
+
+    def path(self, file_id: str) -> Optional[Tuple[str, str, Optional[int]]]:
+        """(file_unique_id, file_path, размер) из прошлого getFile или None"""
+        unique_id = self._aliases.get(file_id)
+        entry = self._paths.get(unique_id) if unique_id else None
+        if entry is None or time.monotonic() - entry[0] > self.path_ttl:
+            if entry is not None:
+                del self._paths[unique_id]
+            self.path_misses += 1
+            return None
+        self._aliases.move_to_end(file_id)
+        self._paths.move_to_end(unique_id)
+        self.path_hits += 1
+        return unique_id, entry[1], entry[2]
+
+    def put_path(self, file_id: str, file_unique_id: str, file_path: str, size: Optional[int]):
+        self._aliases[file_id] = file_unique_id
+        self._aliases.move_to_end(file_id)
+        self._paths[file_unique_id] = (time.monotonic(), file_path, size)
+        self._paths.move_to_end(file_unique_id)
+        while len(self._aliases) > self.max_paths:
+            self._aliases.popitem(last=False)
+        while len(self._paths) > self.max_paths:
+            self._paths.popitem(last=False)
+
+    # ---------- байты ----------
+
+    def get(self, file_unique_id: str) -> Optional[bytes]:
+        entry = self._data.get(file_unique_id)
+        if entry is None or time.monotonic() - entry[0] > self.ttl:
+            if entry is not None:
+                self._drop(file_unique_id)
+            self.misses += 1
+            return None
+        self._data.move_to_end(file_unique_id)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, file_unique_id: str, data: bytes):
+        """Файл больше всего кэша не кладётся; старые вытесняются, пока новый не влезет"""
+        if len(data) > self.max_bytes:
+            return
+        if file_unique_id in self._data:
+            self._drop(file_unique_id)
+        while self._data and self._size + len(data) > self.max_bytes:
+            self._drop(next(iter(self._data)))
+            self.evicted += 1
+        self._data[file_unique_id] = (time.monotonic(), data)
+        self._size += len(data)
+
+    def _drop(self, file_unique_id: str):
+        _, data = self._data.pop(file_unique_id)
+        self._size -= len(data)
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        path_total = self.path_hits + self.path_misses
+        return {
+            "files": len(self._data),
+            "bytes": self._size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else None,
+            "path_hit_rate": round(self.path_hits / path_total, 4) if path_total else None,
+            "evicted": self.evicted,
+        }